@@ -0,0 +1,52 @@
+# backend/batch.py
+# 批量生成人物卡：python backend/batch.py characters.jsonl -o out/
+import os
+import sys
+import argparse
+from services import processing_service, batch_service
+
+def main():
+    config = batch_service.batch_config()
+    parser = argparse.ArgumentParser(description="根据 JSONL / CSV 清单批量生成人物卡")
+    parser.add_argument("manifest", help="清单文件，每行一个 CharacterModel（.jsonl / .csv）")
+    parser.add_argument("-o", "--output", required=True, help="输出目录，写入 <key>.png / <key>.json 与 report.json")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="清单格式，默认按扩展名判断")
+    parser.add_argument("-c", "--concurrency", type=int, default=config.get("concurrency", 16), help="同时处理的行数")
+    parser.add_argument("--timeout", type=float, default=config.get("row_timeout_minutes", 30), help="单行超时（分钟）")
+    parser.add_argument("--force", action="store_true", help="忽略已有输出，全部重新生成")
+    args = parser.parse_args()
+
+    manifest_path = os.path.abspath(args.manifest)
+    with open(manifest_path, "r", encoding="utf-8-sig") as f:
+        text = f.read()
+    try:
+        rows = batch_service.parse_manifest(
+            text,
+            args.format or batch_service.manifest_format(manifest_path),
+            base_dir=os.path.dirname(manifest_path),
+        )
+    except ValueError as e:
+        print(f"[!] {e}")
+        return 2
+
+    # 集群模式下启动协调线程：本进程也作为一个 worker 认领共享队列中的任务
+    if processing_service.CLUSTER:
+        processing_service.resume_unfinished_tasks()
+
+    runner = batch_service.BatchRunner(
+        rows,
+        os.path.abspath(args.output),
+        concurrency=args.concurrency,
+        row_timeout=args.timeout * 60,
+        force=args.force,
+        resume_interrupted=True,
+        manifest=manifest_path,
+    )
+    try:
+        report = runner.run()
+    finally:
+        processing_service.flush_state_store()
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
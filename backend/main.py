@@ -1,12 +1,21 @@
 # backend/main.py
 import uvicorn
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
 from routers import file_router
+from services import processing_service
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 恢复上次退出时未完成的任务，退出前把未落盘的状态写入存储
+    processing_service.resume_unfinished_tasks()
+    yield
+    processing_service.flush_state_store()
+
+app = FastAPI(lifespan=lifespan)
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 FRONTEND_DIR = BASE_DIR / "frontend"
@@ -21,4 +30,12 @@ app.include_router(file_router.router, prefix="/api/file", tags=["file"])
 app.mount("/", StaticFiles(directory=FRONTEND_DIR, html=True), name="static")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=LISTEN_PORT)
+    workers = processing_service.load_config().get("cluster", {}).get("workers", 1)
+    if workers > 1 and processing_service.CLUSTER is None:
+        print("[!] cluster.workers > 1 requires cluster.enabled, starting a single worker")
+        workers = 1
+    if workers > 1:
+        # 多进程模式下 uvicorn 需要以导入字符串的形式加载 app
+        uvicorn.run("main:app", host="127.0.0.1", port=LISTEN_PORT, workers=workers)
+    else:
+        uvicorn.run(app, host="127.0.0.1", port=LISTEN_PORT)
@@ -22,6 +22,8 @@ class ReferenceModel(BaseModel):
     reliability_score: int
     resource_url: str 
     file_name: Optional[str] = None 
+    bypass_cache: bool = False # 仅 search 使用：跳过研究缓存强制重新搜索
+    content_sha256: Optional[str] = None # 上传文件的内容哈希，由后端在接收时填写（请求中传入的值会被丢弃）
 
 class CharacterModel(BaseModel):
     character_name: str
@@ -30,6 +32,9 @@ class CharacterModel(BaseModel):
     source_work_aliases: List[str] = []
     user_requirement: str = ""
     reference: List[ReferenceModel] = []
+    auto_generate: bool = False # 资料处理完毕后自动生成人物卡，不需要再调用 /generate_card
+    auto_generate_min_reliability: Optional[int] = None # 设置后，可信度不低于该值的资料全部完成即提前开始生成
+    callback_url: Optional[str] = None # 人物卡生成结束（成功或失败）后 POST 结果到该地址
 
 class SubTaskResult(BaseModel):
     step_id: str
@@ -49,6 +54,7 @@ class ProcessState(BaseModel):
     character_info: Optional[CharacterModel] = None
     sub_tasks: List[SubTaskResult] = []
     final_json: Optional[str] = None
+    version: int = 0
 
 class UpdateTaskRequest(BaseModel):
     process_id: str
@@ -1,114 +1,299 @@
+import os
 import json
-import shutil
 import time
 import uuid
+import asyncio
 from pathlib import Path
-from typing import List
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from models import CharacterModel, UpdateTaskRequest, GenerateRequest, RetryTaskRequest
-from services import processing_service
+from services import processing_service, batch_service
+from services.scheduler import SchedulerFullError
+from services.upload_store import BlobStore, UploadTooLarge, receive_multipart
 
 
 router = APIRouter()
 BASE_DATA_DIR = Path(__file__).resolve().parent.parent.parent / "data"
+# 上传文件按内容去重存放，各任务目录通过硬链接引用
+BLOB_STORE = BlobStore(processing_service.load_config().get("upload", {}).get("blob_path") or str(BASE_DATA_DIR / "blobs"))
+
+def _saturated(e: SchedulerFullError) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={
+            "message": str(e),
+            "queue_position": e.queue_position,
+            "queue_depth": e.queue_depth,
+            "max_queue": e.max_queue,
+        },
+        headers={"Retry-After": "10"},
+    )
+
+def _upload_limits() -> dict:
+    upload_config = processing_service.load_config().get("upload", {})
+    return {
+        "max_file_bytes": upload_config.get("max_file_mb", 50) * 1024 * 1024,
+        "max_request_bytes": upload_config.get("max_request_mb", 200) * 1024 * 1024,
+    }
 
 @router.post("/submit")
-async def submit_character_data(
-    data: str = Form(...),
-    files: List[UploadFile] = File(default=[]) 
-):
+async def submit_character_data(request: Request):
+    """
+    multipart 表单：data 为 CharacterModel 的 JSON，files 为按顺序对应 PENDING_UPLOAD 引用的文件
+    请求体边接收边写盘（线程中执行），不会阻塞其他请求
+    """
+    try:
+        fields, files = await receive_multipart(request, BLOB_STORE, **_upload_limits())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         # 1. 解析数据
-        raw_dict = json.loads(data)
+        if "data" not in fields:
+            raise HTTPException(status_code=400, detail="Missing form field: data")
+        raw_dict = json.loads(fields["data"])
         # 补全 Pydantic模型需要的默认字段，防止前端漏传
         character_data = CharacterModel(**raw_dict)
+        if character_data.callback_url:
+            try:
+                await asyncio.to_thread(processing_service.validate_callback_url, character_data.callback_url)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Invalid callback_url: {e}")
 
-        # 2. 文件保存逻辑 (保持原样，略微优化文件名回填)
+        # 2. 文件保存逻辑：内容已按 SHA-256 存入 blob，任务目录里只放硬链接
         timestamp = int(time.time())
         safe_name = "".join([c for c in character_data.character_name if c.isalnum() or c in (' ', '_')]).strip().replace(" ", "_") or "unknown"
         task_dir = BASE_DATA_DIR / f"{safe_name}_{timestamp}"
         files_dir = task_dir / "files"
-        files_dir.mkdir(parents=True, exist_ok=True)
 
-        # file_map = {f.filename: f for f in files}
-        
-        # for ref in character_data.reference:
-        #     # 这里的 logic 和之前一致，处理文件移动
-        #     if ref.resource_type in ["file", "image"] and ref.resource_url == "PENDING_UPLOAD":
-        #         # 前端需要在 formData传递文件名，或者我们在前端 logic 里保证 filename 匹配
-        #         # 为了简单，这里假设 files 列表里的文件顺序和 refs 里待上传的顺序一致 (简单方案)
-        #         pass 
-        #         # 更好的方案：前端 ReferenceModel 里带一个 temp_id，files 上传时 key 对应 temp_id
-        #         # 简单实现：按文件名匹配 (前端需传原始文件名)
-        
-        # # (此处省略具体保存代码，假设文件已保存并更新 ref.resource_url 此时为本地路径)
-        # # 简单做个处理：遍历 files 保存
+        # 按顺序对应待上传的引用
+        files = [f for f in files if f["field"] == "files"]
         uploaded_idx = 0
+        links = []
         for ref in character_data.reference:
+            # 内容哈希是读取缓存的键，只能由后端根据实际收到的文件填写，客户端传入的一律丢弃
+            ref.content_sha256 = None
             if ref.resource_type in ["file", "image"] and ref.resource_url == "PENDING_UPLOAD":
                  if uploaded_idx < len(files):
                      f_obj = files[uploaded_idx]
-                     save_path = files_dir / f_obj.filename
-                     with open(save_path, "wb") as buffer:
-                        shutil.copyfileobj(f_obj.file, buffer)
+                     # 只取文件名部分，防止路径穿越
+                     file_name = Path(f_obj["filename"]).name or f_obj["sha256"]
+                     # 同一请求中可能有同名文件：加序号前缀，避免后一个覆盖前一个而与各自的 content_sha256 对不上
+                     save_path = files_dir / f"{uploaded_idx}_{file_name}"
+                     links.append((f_obj["sha256"], save_path))
                      ref.resource_url = str(save_path.absolute())
-                     ref.file_name = f_obj.filename # 记录下来给UI显示
+                     ref.file_name = file_name # 记录下来给UI显示
+                     ref.content_sha256 = f_obj["sha256"]
                      uploaded_idx += 1
             elif ref.resource_type == "url":
                 ref.file_name = ref.resource_url # URL即文件名
 
+        def _link_files():
+            files_dir.mkdir(parents=True, exist_ok=True)
+            for sha256, save_path in links:
+                BLOB_STORE.link(sha256, str(save_path))
+        await asyncio.to_thread(_link_files)
+
         # 3. 生成唯一的 Process ID
         process_id = str(uuid.uuid4())
 
         # 4. 触发后台处理服务
         # 注意：这里我们只触发，不等待，直接返回 ID 给前端
-        processing_service.start_processing_background(character_data, process_id)
+        queue_position = await asyncio.to_thread(processing_service.start_processing_background, character_data, process_id)
 
         return {
             "status": "success",
             "process_id": process_id,
+            "queue_position": queue_position,
             "message": "Task submitted, processing started."
         }
 
+    except SchedulerFullError as e:
+        raise _saturated(e)
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/batch")
+async def submit_batch(request: Request):
+    """
+    批量生成：multipart 表单中 manifest 为 JSONL / CSV 清单（文件或文本字段，format 字段可指定格式），
+    files 为清单中文件 / 图片资料引用的文件，按文件名对应；没有随请求上传的文件资料该行记为失败，不会读取服务器上的文件
+    立即返回 batch_id，进度与吞吐量报告通过 /batch/{batch_id} 查询
+    """
+    try:
+        fields, files = await receive_multipart(request, BLOB_STORE, **_upload_limits())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    manifest_file = next((f for f in files if f["field"] == "manifest"), None)
+    if manifest_file:
+        text = await asyncio.to_thread(Path(BLOB_STORE.blob_path(manifest_file["sha256"])).read_text, encoding="utf-8-sig")
+        fmt = fields.get("format") or batch_service.manifest_format(manifest_file["filename"])
+    elif "manifest" in fields:
+        text = fields["manifest"]
+        fmt = fields.get("format", "jsonl")
+    else:
+        raise HTTPException(status_code=400, detail="Missing form field: manifest")
+
+    batch_id = uuid.uuid4().hex
+    output_dir = Path(batch_service.batch_output_dir(batch_id))
+    files_dir = output_dir / "files"
+    uploads = {}
+    for f_obj in files:
+        if f_obj["field"] != "files":
+            continue
+        file_name = Path(f_obj["filename"]).name or f_obj["sha256"]
+        uploads[file_name] = (str(files_dir / file_name), f_obj["sha256"])
+
+    try:
+        # 逐行检查回调地址需要解析域名，放到线程中
+        rows = await asyncio.to_thread(batch_service.parse_manifest, text, fmt, uploads=uploads)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    def _link_files():
+        files_dir.mkdir(parents=True, exist_ok=True)
+        for save_path, sha256 in uploads.values():
+            BLOB_STORE.link(sha256, save_path)
+    await asyncio.to_thread(_link_files)
+
+    try:
+        runner = batch_service.start_batch(rows, str(output_dir), batch_id, manifest=manifest_file["filename"] if manifest_file else None)
+    except SchedulerFullError as e:
+        raise _saturated(e)
+    return {
+        "status": "success",
+        "batch_id": batch_id,
+        "total": len(rows),
+        "invalid": sum(1 for row in rows if row["error"]),
+        "output_dir": runner.output_dir,
+        "message": "Batch submitted, processing started."
+    }
+
+@router.get("/batch/{batch_id}")
+async def batch_status(batch_id: str):
+    """
+    批次进度；完成后附带 report（与输出目录中的 report.json 相同）
+    """
+    progress = await asyncio.to_thread(batch_service.get_batch_progress, batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch ID not found")
+    return progress
+
+# 以下路由会读写状态存储 / 集群后端（SQLite 事务、Redis 往返），定义为普通函数在线程池中执行，
+# 不在事件循环里阻塞；流式接收请求体的路由则用 asyncio.to_thread 调用这些服务函数
+
 @router.get("/status/{process_id}")
-async def check_status(process_id: str):
+def check_status(process_id: str, since: Optional[int] = None):
+    """
+    不带 since 时返回完整状态；带 since 时只返回该版本之后的变更事件，
+    变更日志已无法补齐时返回 reset=true 和完整状态
+    """
     status = processing_service.get_task_status(process_id)
     if not status:
         raise HTTPException(status_code=404, detail="Process ID not found")
-    return status
+    if since is None:
+        return status
+
+    changes = processing_service.get_task_changes(process_id, since)
+    if changes is None:
+        return {"process_id": process_id, "version": status.version, "reset": True, "state": status}
+    return changes
+
+SSE_POLL_INTERVAL = 0.5
+SSE_KEEPALIVE_SECONDS = 15
+
+def _sse_message(event: str, data: dict, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.get("/events/{process_id}")
+async def stream_status(process_id: str, request: Request, since: int = 0):
+    """
+    Server-Sent Events：首次连接（或版本过旧）推送一次完整快照，之后只推送变更事件
+    断线重连时浏览器会带上 Last-Event-ID，从该版本继续
+    """
+    if not await asyncio.to_thread(processing_service.get_task_status, process_id):
+        raise HTTPException(status_code=404, detail="Process ID not found")
+
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    async def event_stream():
+        version = since
+        idle = 0.0
+        while not await request.is_disconnected():
+            changes = await asyncio.to_thread(processing_service.get_task_changes, process_id, version) if version > 0 else None
+            if changes is None:
+                state = await asyncio.to_thread(processing_service.get_task_status, process_id)
+                if not state:
+                    break
+                # 先取版本再序列化，快照只会比版本号更新，重放的事件是幂等的
+                version = state.version
+                yield _sse_message("snapshot", state.model_dump(mode="json"), version)
+                idle = 0.0
+            elif changes["events"]:
+                for event in changes["events"]:
+                    yield _sse_message("change", event, event["version"])
+                version = changes["version"]
+                idle = 0.0
+            elif idle >= SSE_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                idle = 0.0
+
+            await asyncio.sleep(SSE_POLL_INTERVAL)
+            idle += SSE_POLL_INTERVAL
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @router.post("/update_task_result")
-async def update_task_result(req: UpdateTaskRequest):
+def update_task_result(req: UpdateTaskRequest):
     """
     Step 3: 用户修改并确认某个子任务的解析结果
     """
-    success = processing_service.update_subtask_result(
-        req.process_id, 
-        req.step_id, 
-        req.new_summary
-    )
+    try:
+        success = processing_service.update_subtask_result(
+            req.process_id, 
+            req.step_id, 
+            req.new_summary
+        )
+    except SchedulerFullError as e:
+        # 集群模式下修改经过共享队列，队列满时同样返回 429
+        raise _saturated(e)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     if not success:
         raise HTTPException(status_code=400, detail="Update failed, task not found.")
     return {"status": "success"}
 
 @router.post("/generate_card")
-async def generate_card(req: GenerateRequest):
+def generate_card(req: GenerateRequest):
     """
     Step 3 -> Step 4: 触发最终生成
     """
     try:
-        processing_service.start_card_generation(req.process_id)
-        return {"status": "success", "message": "Generation started"}
+        queue_position = processing_service.start_card_generation(req.process_id)
+        return {"status": "success", "message": "Generation started", "queue_position": queue_position}
+    except SchedulerFullError as e:
+        raise _saturated(e)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 @router.post("/retry_task")
-async def retry_task(req: RetryTaskRequest):
+def retry_task(req: RetryTaskRequest):
     """
     重试失败的任务
     """
@@ -117,5 +302,50 @@ async def retry_task(req: RetryTaskRequest):
         if not success:
             raise HTTPException(status_code=400, detail="Retry failed, task not found or not retryable.")
         return {"status": "success", "message": "Task retry started"}
+    except SchedulerFullError as e:
+        raise _saturated(e)
     except ValueError as e:
-        raise HTTPException(status_code=404, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=str(e))
+
+def _artifact_response(request: Request, process_id: str, kind: str, media_type: str):
+    artifact = processing_service.get_card_artifact(process_id, kind)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Card not found")
+    path, filename = artifact
+
+    # FileResponse 自带 ETag / Last-Modified 与 Range 支持，这里补上 If-None-Match → 304
+    response = FileResponse(path, media_type=media_type, filename=filename, stat_result=os.stat(path))
+    response.headers["Cache-Control"] = "private, no-cache"
+    etag = response.headers["etag"]
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "private, no-cache"})
+    return response
+
+@router.get("/card/{process_id}.png")
+def download_card_png(process_id: str, request: Request):
+    """
+    Step 4: 下载生成好的 PNG 人物卡
+    """
+    return _artifact_response(request, process_id, "png", "image/png")
+
+@router.get("/card/{process_id}.json")
+def download_card_json(process_id: str, request: Request):
+    """
+    Step 4: 下载生成好的 JSON 人物卡
+    """
+    return _artifact_response(request, process_id, "json", "application/json")
+
+@router.get("/scheduler/metrics")
+def scheduler_metrics():
+    """
+    调度器队列深度、等待时间与限流统计
+    """
+    return processing_service.get_scheduler_metrics()
+
+@router.get("/cache/stats")
+def cache_stats():
+    """
+    读取结果缓存的命中率与容量
+    """
+    return processing_service.get_cache_stats()
\ No newline at end of file
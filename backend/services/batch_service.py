@@ -0,0 +1,466 @@
+import os
+import io
+import re
+import csv
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from pydantic import ValidationError
+from models import CharacterModel, TaskStatus
+from services import processing_service
+from services.scheduler import SchedulerFullError
+
+# ==========================================
+# 批量生成 (Batch Generation)
+# ==========================================
+# 清单（JSONL / CSV）中的每一行是一个 CharacterModel，逐行走与网页相同的流程：
+# 资料处理 -> 生成人物卡。所有行共用进程内的调度器、线程池 / 事件循环与读取缓存，
+# 同一份资料在多行中出现时只读取一次
+
+LIST_FIELDS = ("character_aliases", "source_work_aliases")
+_SAFE_KEY_CHARS = ("-", "_")
+
+
+def _safe_key(text: str) -> str:
+    key = "".join(c if c.isalnum() or c in _SAFE_KEY_CHARS else "_" for c in text.strip())
+    return key.strip("_")[:64]
+
+
+def _parse_list(value) -> list:
+    """
+    CSV 中的列表列可以写成 JSON 数组，也可以用 | 分隔
+    """
+    if isinstance(value, list):
+        return value
+    value = (value or "").strip()
+    if not value:
+        return []
+    if value.startswith("["):
+        return json.loads(value)
+    return [item.strip() for item in value.split("|") if item.strip()]
+
+
+def _read_jsonl(text: str) -> list:
+    rows = []
+    for line_no, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            rows.append((line_no, json.loads(line)))
+        except ValueError as e:
+            rows.append((line_no, e))
+    return rows
+
+
+def _read_csv(text: str) -> list:
+    rows = []
+    reader = csv.DictReader(io.StringIO(text))
+    for line_no, record in enumerate(reader, 2):
+        try:
+            raw = {k.strip(): v for k, v in record.items() if k}
+            for field in LIST_FIELDS:
+                raw[field] = _parse_list(raw.get(field))
+            raw["reference"] = _parse_list(raw.get("reference"))
+            rows.append((line_no, raw))
+        except ValueError as e:
+            rows.append((line_no, e))
+    return rows
+
+
+def _resolve_reference_paths(data: CharacterModel, base_dir: str = None, uploads: dict = None):
+    """
+    文件 / 图片资料的路径：优先匹配随请求上传的同名文件，其次按清单所在目录解析相对路径
+    uploads: {文件名: (本地路径, sha256)}
+    base_dir 为 None（通过接口提交）时不允许引用服务器上的本地文件，未上传的文件资料抛出 ValueError
+    """
+    for ref in data.reference:
+        # 内容哈希决定读取缓存的键：清单中填写的值不可信，只用上传时后端计算的哈希
+        ref.content_sha256 = None
+        if ref.resource_type in ("file", "image"):
+            name = os.path.basename(ref.resource_url)
+            if uploads and name in uploads:
+                ref.resource_url, ref.content_sha256 = uploads[name]
+            elif base_dir is not None:
+                ref.resource_url = os.path.abspath(os.path.join(base_dir, ref.resource_url))
+            else:
+                raise ValueError(f"File '{name}' was not uploaded with the manifest")
+            ref.file_name = ref.file_name or name
+        elif ref.resource_type == "url":
+            ref.file_name = ref.resource_url
+
+
+def parse_manifest(text: str, fmt: str = "jsonl", base_dir: str = None, uploads: dict = None) -> list:
+    """
+    解析清单，返回行列表 [{"line", "key", "data", "error"}]
+    单行格式错误只标记该行失败，不影响其他行；整份清单没有任何行时抛出 ValueError
+    base_dir 只由命令行传入：文件资料可以写相对清单的路径或绝对路径；接口提交的清单只能引用随请求上传的文件
+    key 用于输出文件名与断点续跑：优先取行中的 id 列，否则由角色名 + 内容哈希生成
+    """
+    if fmt not in ("jsonl", "csv"):
+        raise ValueError(f"Unsupported manifest format: {fmt}")
+    records = _read_csv(text) if fmt == "csv" else _read_jsonl(text)
+    if not records:
+        raise ValueError("Manifest is empty")
+
+    rows = []
+    seen = set()
+    for line_no, raw in records:
+        row = {"line": line_no, "key": f"line_{line_no}", "data": None, "error": None}
+        rows.append(row)
+        if isinstance(raw, Exception):
+            row["error"] = f"Invalid row: {raw}"
+            continue
+        if not isinstance(raw, dict):
+            row["error"] = "Invalid row: expected an object"
+            continue
+        try:
+            data = CharacterModel(**{k: v for k, v in raw.items() if k != "id"})
+        except ValidationError as e:
+            row["error"] = f"Invalid row: {e.errors()[0].get('msg')} ({'.'.join(map(str, e.errors()[0].get('loc', ())))})"
+            continue
+        if data.callback_url:
+            try:
+                processing_service.validate_callback_url(data.callback_url)
+            except ValueError as e:
+                row["error"] = f"Invalid row: callback_url: {e}"
+                continue
+        try:
+            _resolve_reference_paths(data, base_dir, uploads)
+        except ValueError as e:
+            row["error"] = f"Invalid row: {e}"
+            continue
+
+        # 结果投递方式不影响生成内容，不参与哈希，改了回调地址的行依然可以跳过 / 续跑
+        digest = hashlib.sha256(data.model_dump_json(exclude={"auto_generate", "callback_url"}).encode("utf-8")).hexdigest()
+        key = _safe_key(str(raw.get("id") or "")) or f"{_safe_key(data.character_name) or 'character'}_{digest[:10]}"
+        if key in seen:
+            row["error"] = f"Duplicate row key: {key}"
+            continue
+        seen.add(key)
+        row.update(key=key, data=data, digest=digest)
+    return rows
+
+
+def manifest_format(filename: str, default: str = "jsonl") -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl"}.get(ext, default)
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class BatchRunner:
+    """
+    执行一份清单：
+    - 同时在处理中的行不超过 concurrency，调度器返回 429 时下一轮再提交
+    - 新提交的行开启 auto_generate，资料处理完毕后由服务端直接接着生成
+    - 输出目录中已有 <key>.png / <key>.json 的行直接跳过（force=True 时重新生成）
+    - 每行的 process_id 由内容哈希决定；状态存储中已有该任务时接着它的进度继续，
+      resume_interrupted=True 时（命令行）重新投递上次中断的任务
+    - 结束后在输出目录写入 report.json（吞吐量、延迟分布、子任务与缓存统计）
+    """
+    def __init__(self, rows: list, output_dir: str, concurrency: int = 16, row_timeout: float = 1800,
+                 poll_interval: float = 0.5, force: bool = False, resume_interrupted: bool = False,
+                 batch_id: str = None, manifest: str = None):
+        self.rows = rows
+        self.output_dir = output_dir
+        self.concurrency = max(1, concurrency)
+        self.row_timeout = row_timeout
+        self.poll_interval = poll_interval
+        self.force = force
+        self.resume_interrupted = resume_interrupted
+        self.batch_id = batch_id or uuid.uuid4().hex
+        self.manifest = manifest
+        self.started_at = None
+        self.finished_at = None
+        self.report = None
+
+        for row in rows:
+            row.setdefault("status", "failed" if row["error"] else "waiting")
+            row.setdefault("process_id", None)
+
+    # --- 输出文件 ---
+
+    def _output_paths(self, row: dict) -> dict:
+        return {kind: os.path.join(self.output_dir, f"{row['key']}.{kind}") for kind in ("png", "json")}
+
+    def _copy_outputs(self, row: dict) -> bool:
+        for kind, dest in self._output_paths(row).items():
+            artifact = processing_service.get_card_artifact(row["process_id"], kind)
+            if artifact is None:
+                return False
+            tmp_path = f"{dest}.tmp"
+            shutil.copyfile(artifact[0], tmp_path)
+            os.replace(tmp_path, dest)
+        return True
+
+    # --- 单行状态机：waiting -> processing -> generating -> success / failed ---
+
+    def _finish(self, row: dict, status: str, error: str = None):
+        row["status"] = status
+        row["error"] = error
+        row["finished_at"] = time.time()
+        if row.get("started_at"):
+            row["latency"] = row["finished_at"] - row["started_at"]
+        print(f"[*] Batch {self.batch_id} row {row['key']}: {status}" + (f" ({error})" if error else ""))
+
+    def _prepare(self, row: dict):
+        """
+        提交前检查输出与已有状态，决定跳过 / 续跑 / 新建
+        """
+        if not self.force and all(os.path.isfile(p) for p in self._output_paths(row).values()):
+            row["status"] = "skipped"
+            return
+        process_id = f"{processing_service.BATCH_PROCESS_PREFIX}{row['digest'][:24]}"
+        state = processing_service.get_task_status(process_id)
+        gen_task = processing_service.get_generation_task(state) if state else None
+        # 上次生成失败（或卡片文件已被清理）的行换一个 process_id 从头处理，读取结果多半能命中缓存
+        stale = gen_task is not None and state.is_finished and not (
+            gen_task.status == TaskStatus.SUCCESS and processing_service.get_card_artifact(process_id, "json"))
+        if self.force or stale:
+            process_id = f"{process_id}_{int(time.time())}"
+        row["process_id"] = process_id
+
+    def _start(self, row: dict) -> bool:
+        """
+        开始处理一行；调度器已满时返回 False，下一轮再试
+        """
+        pid = row["process_id"]
+        state = processing_service.get_task_status(pid)
+        try:
+            if state is None:
+                # 资料处理完立即接着生成，省去一轮轮询
+                row["data"].auto_generate = True
+                processing_service.start_processing_background(row["data"], pid)
+            elif not state.is_finished and self.resume_interrupted:
+                processing_service.resume_task(pid)
+                row["resumed"] = True
+            elif state.is_finished:
+                row["resumed"] = True
+        except SchedulerFullError:
+            return False
+        row["status"] = "processing"
+        row["started_at"] = time.time()
+        return True
+
+    def _poll(self, row: dict):
+        state = processing_service.get_task_status(row["process_id"])
+        if state is None:
+            self._finish(row, "failed", "Task state was evicted")
+            return
+        if time.time() - row["started_at"] > self.row_timeout:
+            self._finish(row, "failed", f"Timed out after {self.row_timeout:.0f}s")
+            return
+
+        gen_task = processing_service.get_generation_task(state)
+        if row["status"] == "processing":
+            if gen_task is not None:
+                # 续跑的任务上次已经进入（或完成了）生成阶段
+                row["status"] = "generating"
+                row["processed_at"] = time.time()
+                return
+            if not state.is_finished:
+                return
+            try:
+                processing_service.start_card_generation(row["process_id"])
+            except SchedulerFullError:
+                return
+            row["status"] = "generating"
+            row["processed_at"] = time.time()
+            return
+
+        # generating：集群模式下生成任务经过共享队列，状态快照里可能还看不到新的生成任务
+        if gen_task is None or not state.is_finished or gen_task.status not in (TaskStatus.SUCCESS, TaskStatus.FAILED):
+            return
+        if gen_task.status == TaskStatus.FAILED:
+            self._finish(row, "failed", gen_task.result_summary)
+        elif self._copy_outputs(row):
+            self._finish(row, "success")
+        else:
+            self._finish(row, "failed", "Card artifacts not found")
+        row["sub_tasks"] = {
+            status.value: sum(1 for t in state.sub_tasks if t.status == status and t.type != "card_generation")
+            for status in (TaskStatus.SUCCESS, TaskStatus.FAILED)
+        }
+
+    def run(self) -> dict:
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.started_at = time.time()
+        print(f"[*] Batch {self.batch_id} started: {len(self.rows)} rows -> {self.output_dir}")
+
+        for row in self.rows:
+            if row["status"] == "waiting":
+                self._prepare(row)
+        waiting = [row for row in self.rows if row["status"] == "waiting"]
+        active = []
+        try:
+            while waiting or active:
+                while waiting and len(active) < self.concurrency:
+                    if not self._start(waiting[0]):
+                        break
+                    active.append(waiting.pop(0))
+                for row in list(active):
+                    try:
+                        self._poll(row)
+                    except Exception as e:
+                        self._finish(row, "failed", str(e))
+                    if row["status"] in ("success", "failed"):
+                        active.remove(row)
+                if waiting or active:
+                    time.sleep(self.poll_interval)
+        finally:
+            self.finished_at = time.time()
+            self.report = self._build_report()
+            with open(os.path.join(self.output_dir, "report.json"), "w", encoding="utf-8") as f:
+                json.dump(self.report, f, ensure_ascii=False, indent=2)
+        print(f"[*] Batch {self.batch_id} finished: {self.report['succeeded']} succeeded, "
+              f"{self.report['failed']} failed, {self.report['skipped']} skipped "
+              f"in {self.report['elapsed_seconds']:.1f}s ({self.report['cards_per_minute']:.1f} cards/min)")
+        return self.report
+
+    # --- 进度与报告 ---
+
+    def _row_summary(self, row: dict) -> dict:
+        summary = {k: row.get(k) for k in ("line", "key", "status", "process_id", "error", "latency", "sub_tasks")}
+        if row["status"] in ("success", "skipped"):
+            summary["outputs"] = self._output_paths(row)
+        if row.get("resumed"):
+            summary["resumed"] = True
+        return summary
+
+    def _counts(self) -> dict:
+        counts = {}
+        for row in self.rows:
+            counts[row["status"]] = counts.get(row["status"], 0) + 1
+        return counts
+
+    def progress(self) -> dict:
+        """
+        供 /api/file/batch/{batch_id} 查询的进度；完成后附带报告
+        """
+        return {
+            "batch_id": self.batch_id,
+            "total": len(self.rows),
+            "counts": self._counts(),
+            "finished": self.report is not None,
+            "elapsed_seconds": (self.finished_at or time.time()) - self.started_at if self.started_at else 0,
+            "report": self.report,
+        }
+
+    def _build_report(self) -> dict:
+        counts = self._counts()
+        elapsed = self.finished_at - self.started_at
+        done = [row for row in self.rows if row["status"] == "success"]
+        latencies = [row["latency"] for row in done if row.get("latency") is not None]
+        processing = [row["processed_at"] - row["started_at"] for row in done if row.get("processed_at")]
+        generation = [row["finished_at"] - row["processed_at"] for row in done if row.get("processed_at")]
+        return {
+            "batch_id": self.batch_id,
+            "manifest": self.manifest,
+            "output_dir": self.output_dir,
+            "total": len(self.rows),
+            "succeeded": counts.get("success", 0),
+            "failed": counts.get("failed", 0),
+            "skipped": counts.get("skipped", 0),
+            "resumed": sum(1 for row in self.rows if row.get("resumed")),
+            "elapsed_seconds": elapsed,
+            "cards_per_minute": len(done) / elapsed * 60 if elapsed > 0 else 0.0,
+            "latency_seconds": {
+                "avg": sum(latencies) / len(latencies) if latencies else 0.0,
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+                "max": max(latencies, default=0.0),
+            },
+            "processing_seconds_avg": sum(processing) / len(processing) if processing else 0.0,
+            "generation_seconds_avg": sum(generation) / len(generation) if generation else 0.0,
+            "sub_tasks": {
+                status: sum(row.get("sub_tasks", {}).get(status, 0) for row in self.rows)
+                for status in (TaskStatus.SUCCESS.value, TaskStatus.FAILED.value)
+            },
+            "cache": processing_service.get_cache_stats(),
+            "rows": [self._row_summary(row) for row in self.rows],
+        }
+
+
+# --- 服务端批量任务登记 ---
+# 内存中只保留运行中的批次（每个 worker 进程各自保存自己接收的）；
+# 结束的批次以输出目录中的 report.json 为准，查询时从磁盘读取，长时间运行也不会累积
+
+BATCHES = {}
+_BATCHES_LOCK = threading.Lock()
+_BATCH_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def batch_config() -> dict:
+    return processing_service.load_config().get("batch", {})
+
+
+def batch_output_dir(batch_id: str) -> str:
+    return os.path.abspath(os.path.join(batch_config().get("output_path") or "data/batches", batch_id))
+
+
+def start_batch(rows: list, output_dir: str, batch_id: str, manifest: str = None) -> BatchRunner:
+    """
+    在后台线程中执行批次，立即返回；同时运行的批次数受 batch.max_batches 限制
+    """
+    config = batch_config()
+    with _BATCHES_LOCK:
+        running = sum(1 for runner in BATCHES.values() if runner.report is None)
+        if running >= config.get("max_batches", 4):
+            raise SchedulerFullError(running, config.get("max_batches", 4))
+        runner = BatchRunner(
+            rows, output_dir,
+            concurrency=config.get("concurrency", 16),
+            row_timeout=config.get("row_timeout_minutes", 30) * 60,
+            batch_id=batch_id,
+            manifest=manifest,
+        )
+        BATCHES[batch_id] = runner
+
+    def _run():
+        try:
+            runner.run()
+        finally:
+            # report.json 已写入输出目录，之后的查询从磁盘读取
+            with _BATCHES_LOCK:
+                BATCHES.pop(batch_id, None)
+
+    threading.Thread(target=_run, name=f"batch:{batch_id}", daemon=True).start()
+    return runner
+
+
+def get_batch_progress(batch_id: str):
+    """
+    返回批次进度；运行中的批次来自内存，已结束的读取 report.json，找不到时返回 None
+    """
+    if not _BATCH_ID_RE.match(batch_id):
+        return None
+    with _BATCHES_LOCK:
+        runner = BATCHES.get(batch_id)
+    if runner is not None:
+        return runner.progress()
+
+    try:
+        with open(os.path.join(batch_output_dir(batch_id), "report.json"), "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    counts = {}
+    for row in report.get("rows", []):
+        counts[row["status"]] = counts.get(row["status"], 0) + 1
+    return {
+        "batch_id": batch_id,
+        "total": report.get("total", 0),
+        "counts": counts,
+        "finished": True,
+        "elapsed_seconds": report.get("elapsed_seconds", 0),
+        "report": report,
+    }
@@ -0,0 +1,653 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from services.scheduler import SchedulerFullError
+
+# ==========================================
+# 多 worker / 多机共享后端 (Cluster Backend)
+# ==========================================
+# 三种后端接口一致：
+#   - 任务状态：save_states / load_state / delete_state / purge_finished
+#   - 租约：acquire_lease / renew_leases / release_lease，持有租约的 worker 才执行并写回该任务
+#   - 共享队列：enqueue / claim_job / queue_depth / enqueue_orphans
+# MemoryClusterBackend 只在单进程内共享，用于本地调试；
+# SQLiteClusterBackend 用于单机多 worker；RedisClusterBackend 用于多机（任何 Redis 协议兼容的服务）
+#
+# 状态行：(process_id, is_finished, active, updated_at, state_json)
+# active 表示仍有子任务在等待 / 执行（例如已完成的任务中正在重试的子任务）
+# 任务：{"job_id", "process_id", "kind", "args", "enqueued_at"}
+
+class MemoryClusterBackend:
+    """
+    进程内的替身实现，语义与其他后端相同
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._leases = {}
+        self._jobs = []
+        self._seq = 0
+
+    def save_states(self, rows: list):
+        with self._lock:
+            for pid, is_finished, active, updated_at, raw in rows:
+                self._states[pid] = (is_finished, active, updated_at, raw)
+
+    def load_state(self, process_id: str):
+        with self._lock:
+            row = self._states.get(process_id)
+        return row[3] if row else None
+
+    def delete_state(self, process_id: str):
+        with self._lock:
+            self._states.pop(process_id, None)
+            self._leases.pop(process_id, None)
+            self._jobs = [j for j in self._jobs if j["process_id"] != process_id]
+
+    def purge_finished(self, before: float) -> list:
+        with self._lock:
+            expired = [
+                pid for pid, (is_finished, active, updated_at, _) in self._states.items()
+                if is_finished and not active and updated_at < before
+            ]
+            for pid in expired:
+                self._states.pop(pid, None)
+        return expired
+
+    def _lease_free(self, process_id: str, owner: str, now: float) -> bool:
+        lease = self._leases.get(process_id)
+        return lease is None or lease[1] < now or lease[0] == owner
+
+    def acquire_lease(self, process_id: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            if not self._lease_free(process_id, owner, now):
+                return False
+            self._leases[process_id] = (owner, now + ttl)
+            return True
+
+    def renew_leases(self, process_ids: list, owner: str, ttl: float) -> list:
+        now = time.time()
+        lost = []
+        with self._lock:
+            for pid in process_ids:
+                lease = self._leases.get(pid)
+                if lease and lease[0] == owner:
+                    self._leases[pid] = (owner, now + ttl)
+                else:
+                    lost.append(pid)
+        return lost
+
+    def release_lease(self, process_id: str, owner: str):
+        with self._lock:
+            lease = self._leases.get(process_id)
+            if lease and lease[0] == owner:
+                del self._leases[process_id]
+
+    def enqueue(self, job: dict):
+        with self._lock:
+            self._seq += 1
+            self._jobs.append({**job, "job_id": self._seq})
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return len(self._jobs)
+
+    def claim_job(self, owner: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            for i, job in enumerate(self._jobs):
+                if self._lease_free(job["process_id"], owner, now):
+                    self._leases[job["process_id"]] = (owner, now + ttl)
+                    return self._jobs.pop(i)
+        return None
+
+    def enqueue_orphans(self, before: float, limit: int = 100) -> list:
+        now = time.time()
+        with self._lock:
+            queued = {j["process_id"] for j in self._jobs}
+            orphans = [
+                pid for pid, (is_finished, active, updated_at, _) in self._states.items()
+                if (not is_finished or active) and updated_at < before and pid not in queued
+                and (pid not in self._leases or self._leases[pid][1] < now)
+            ][:limit]
+            for pid in orphans:
+                self._seq += 1
+                self._jobs.append({"job_id": self._seq, "process_id": pid, "kind": "resume", "args": {}, "enqueued_at": now})
+        return orphans
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            return {
+                "backend": "memory",
+                "queue_depth": len(self._jobs),
+                "leases": sum(1 for _, until in self._leases.values() if until >= now),
+                "active_processes": sum(1 for row in self._states.values() if not row[0] or row[1]),
+            }
+
+
+class SQLiteClusterBackend:
+    """
+    单机多 worker：与 SQLiteStateStore 共用同一个数据库文件（WAL），
+    每个线程一个连接，认领任务、抢租约都在 BEGIN IMMEDIATE 事务中完成
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._tx() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS processes (
+                    process_id TEXT PRIMARY KEY,
+                    is_finished INTEGER NOT NULL,
+                    updated_at REAL NOT NULL,
+                    state TEXT NOT NULL
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(processes)")]
+            if "active" not in columns:
+                # 单 worker 模式建的表没有这一列
+                conn.execute("ALTER TABLE processes ADD COLUMN active INTEGER NOT NULL DEFAULT 0")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    process_id TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    lease_until REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    process_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    enqueued_at REAL NOT NULL
+                )
+            """)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def save_states(self, rows: list):
+        with self._tx() as conn:
+            conn.executemany("""
+                INSERT INTO processes (process_id, is_finished, active, updated_at, state)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(process_id) DO UPDATE SET
+                    is_finished = excluded.is_finished,
+                    active = excluded.active,
+                    updated_at = excluded.updated_at,
+                    state = excluded.state
+            """, [(pid, int(fin), int(active), updated_at, raw) for pid, fin, active, updated_at, raw in rows])
+
+    def load_state(self, process_id: str):
+        row = self._conn().execute(
+            "SELECT state FROM processes WHERE process_id = ?", (process_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete_state(self, process_id: str):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM processes WHERE process_id = ?", (process_id,))
+            conn.execute("DELETE FROM leases WHERE process_id = ?", (process_id,))
+            conn.execute("DELETE FROM jobs WHERE process_id = ?", (process_id,))
+
+    def purge_finished(self, before: float) -> list:
+        with self._tx() as conn:
+            rows = conn.execute(
+                "SELECT process_id FROM processes WHERE is_finished = 1 AND active = 0 AND updated_at < ?",
+                (before,)
+            ).fetchall()
+            conn.executemany("DELETE FROM processes WHERE process_id = ?", rows)
+        return [pid for (pid,) in rows]
+
+    @staticmethod
+    def _take_lease(conn, process_id: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        row = conn.execute(
+            "SELECT owner, lease_until FROM leases WHERE process_id = ?", (process_id,)
+        ).fetchone()
+        if row and row[0] != owner and row[1] >= now:
+            return False
+        conn.execute(
+            "INSERT OR REPLACE INTO leases (process_id, owner, lease_until) VALUES (?, ?, ?)",
+            (process_id, owner, now + ttl)
+        )
+        return True
+
+    def acquire_lease(self, process_id: str, owner: str, ttl: float) -> bool:
+        with self._tx() as conn:
+            return self._take_lease(conn, process_id, owner, ttl)
+
+    def renew_leases(self, process_ids: list, owner: str, ttl: float) -> list:
+        lost = []
+        with self._tx() as conn:
+            for pid in process_ids:
+                cursor = conn.execute(
+                    "UPDATE leases SET lease_until = ? WHERE process_id = ? AND owner = ?",
+                    (time.time() + ttl, pid, owner)
+                )
+                if cursor.rowcount == 0:
+                    lost.append(pid)
+        return lost
+
+    def release_lease(self, process_id: str, owner: str):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM leases WHERE process_id = ? AND owner = ?", (process_id, owner))
+
+    def enqueue(self, job: dict):
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO jobs (process_id, kind, args, enqueued_at) VALUES (?, ?, ?, ?)",
+                (job["process_id"], job["kind"], json.dumps(job.get("args", {}), ensure_ascii=False), job["enqueued_at"])
+            )
+
+    def queue_depth(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def claim_job(self, owner: str, ttl: float):
+        with self._tx() as conn:
+            row = conn.execute("""
+                SELECT j.job_id, j.process_id, j.kind, j.args, j.enqueued_at FROM jobs j
+                LEFT JOIN leases l ON l.process_id = j.process_id
+                WHERE l.process_id IS NULL OR l.lease_until < ? OR l.owner = ?
+                ORDER BY j.job_id LIMIT 1
+            """, (time.time(), owner)).fetchone()
+            if not row:
+                return None
+            job_id, pid, kind, args, enqueued_at = row
+            self._take_lease(conn, pid, owner, ttl)
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        return {"job_id": job_id, "process_id": pid, "kind": kind, "args": json.loads(args), "enqueued_at": enqueued_at}
+
+    def enqueue_orphans(self, before: float, limit: int = 100) -> list:
+        now = time.time()
+        with self._tx() as conn:
+            rows = conn.execute("""
+                SELECT p.process_id FROM processes p
+                LEFT JOIN leases l ON l.process_id = p.process_id
+                WHERE (p.is_finished = 0 OR p.active = 1) AND p.updated_at < ?
+                  AND (l.process_id IS NULL OR l.lease_until < ?)
+                  AND NOT EXISTS (SELECT 1 FROM jobs j WHERE j.process_id = p.process_id)
+                LIMIT ?
+            """, (before, now, limit)).fetchall()
+            conn.executemany(
+                "INSERT INTO jobs (process_id, kind, args, enqueued_at) VALUES (?, 'resume', '{}', ?)",
+                [(pid, now) for (pid,) in rows]
+            )
+        return [pid for (pid,) in rows]
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        return {
+            "backend": "sqlite",
+            "queue_depth": conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0],
+            "leases": conn.execute("SELECT COUNT(*) FROM leases WHERE lease_until >= ?", (time.time(),)).fetchone()[0],
+            "active_processes": conn.execute("SELECT COUNT(*) FROM processes WHERE is_finished = 0 OR active = 1").fetchone()[0],
+        }
+
+
+# 租约续期 / 释放只对自己持有的租约生效
+_RENEW_SCRIPT = """
+local lost = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+    else
+        table.insert(lost, i)
+    end
+end
+return lost
+"""
+
+_ACQUIRE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if (not current) or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 从队列头部起找第一个“租约空闲或属于自己”的任务，抢租约并出队
+_CLAIM_SCRIPT = """
+local jobs = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[3]) - 1)
+for _, raw in ipairs(jobs) do
+    local job = cjson.decode(raw)
+    local lease_key = ARGV[4] .. 'lease:' .. job['process_id']
+    local current = redis.call('GET', lease_key)
+    if (not current) or current == ARGV[1] then
+        redis.call('SET', lease_key, ARGV[1], 'PX', ARGV[2])
+        redis.call('LREM', KEYS[1], 1, raw)
+        if redis.call('HINCRBY', KEYS[2], job['process_id'], -1) <= 0 then
+            redis.call('HDEL', KEYS[2], job['process_id'])
+        end
+        return raw
+    end
+end
+return false
+"""
+
+
+class RedisClusterBackend:
+    """
+    多机部署：任意 Redis 协议兼容的服务（Redis / Valkey / KeyDB 等，需要支持 Lua）
+    - 状态：<prefix>state:<pid>，未完成的任务在有序集合 <prefix>active 中，已完成的在 <prefix>finished 中
+    - 租约：<prefix>lease:<pid>，值为 worker id，过期时间即租约时长
+    - 队列：列表 <prefix>jobs，哈希 <prefix>queued 记录每个任务排队中的数量
+    认领脚本会访问脚本内拼出的租约键，不支持 Redis Cluster 分片模式
+    """
+    def __init__(self, url: str, prefix: str = "waifu:"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("cluster.backend = redis 需要安装 redis：pip install redis")
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._renew = self._redis.register_script(_RENEW_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+        self._claim = self._redis.register_script(_CLAIM_SCRIPT)
+
+    def _key(self, *parts) -> str:
+        return self.prefix + ":".join(parts)
+
+    def save_states(self, rows: list):
+        pipe = self._redis.pipeline()
+        for pid, is_finished, active, updated_at, raw in rows:
+            pipe.set(self._key("state", pid), raw)
+            if is_finished and not active:
+                pipe.zrem(self._key("active"), pid)
+                pipe.zadd(self._key("finished"), {pid: updated_at})
+            else:
+                pipe.zrem(self._key("finished"), pid)
+                pipe.zadd(self._key("active"), {pid: updated_at})
+        pipe.execute()
+
+    def load_state(self, process_id: str):
+        raw = self._redis.get(self._key("state", process_id))
+        return raw.decode("utf-8") if raw is not None else None
+
+    def delete_state(self, process_id: str):
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key("state", process_id), self._key("lease", process_id))
+        pipe.zrem(self._key("active"), process_id)
+        pipe.zrem(self._key("finished"), process_id)
+        pipe.execute()
+
+    def purge_finished(self, before: float) -> list:
+        pids = [pid.decode("utf-8") for pid in self._redis.zrangebyscore(self._key("finished"), "-inf", before)]
+        if pids:
+            pipe = self._redis.pipeline()
+            pipe.delete(*[self._key("state", pid) for pid in pids])
+            pipe.zrem(self._key("finished"), *pids)
+            pipe.execute()
+        return pids
+
+    def acquire_lease(self, process_id: str, owner: str, ttl: float) -> bool:
+        return bool(self._acquire(keys=[self._key("lease", process_id)], args=[owner, int(ttl * 1000)]))
+
+    def renew_leases(self, process_ids: list, owner: str, ttl: float) -> list:
+        if not process_ids:
+            return []
+        lost = self._renew(keys=[self._key("lease", pid) for pid in process_ids], args=[owner, int(ttl * 1000)])
+        return [process_ids[i - 1] for i in lost]
+
+    def release_lease(self, process_id: str, owner: str):
+        self._release(keys=[self._key("lease", process_id)], args=[owner])
+
+    def enqueue(self, job: dict):
+        job = {**job, "job_id": self._redis.incr(self._key("job_seq"))}
+        pipe = self._redis.pipeline()
+        pipe.rpush(self._key("jobs"), json.dumps(job, ensure_ascii=False))
+        pipe.hincrby(self._key("queued"), job["process_id"], 1)
+        pipe.execute()
+
+    def queue_depth(self) -> int:
+        return self._redis.llen(self._key("jobs"))
+
+    def claim_job(self, owner: str, ttl: float, scan: int = 100):
+        raw = self._claim(
+            keys=[self._key("jobs"), self._key("queued")],
+            args=[owner, int(ttl * 1000), scan, self.prefix]
+        )
+        return json.loads(raw) if raw else None
+
+    def enqueue_orphans(self, before: float, limit: int = 100) -> list:
+        candidates = [
+            pid.decode("utf-8")
+            for pid in self._redis.zrangebyscore(self._key("active"), "-inf", before, start=0, num=limit)
+        ]
+        orphans = []
+        for pid in candidates:
+            # 并发扫描时可能重复入队，重复的 resume 会被持有者忽略
+            if self._redis.exists(self._key("lease", pid)) or self._redis.hexists(self._key("queued"), pid):
+                continue
+            self.enqueue({"process_id": pid, "kind": "resume", "args": {}, "enqueued_at": time.time()})
+            orphans.append(pid)
+        return orphans
+
+    def stats(self) -> dict:
+        return {
+            "backend": "redis",
+            "queue_depth": self._redis.llen(self._key("jobs")),
+            "active_processes": self._redis.zcard(self._key("active")),
+        }
+
+
+def create_cluster_backend(config: dict, default_path: str = "data/state.db"):
+    """
+    根据配置创建共享后端：sqlite（默认，与 state_store 同一个文件）、redis 或 memory
+    """
+    backend = config.get("backend", "sqlite")
+    if backend == "memory":
+        return MemoryClusterBackend()
+    if backend == "sqlite":
+        return SQLiteClusterBackend(config.get("path") or default_path)
+    if backend == "redis":
+        return RedisClusterBackend(config.get("redis_url", "redis://127.0.0.1:6379/0"), config.get("key_prefix", "waifu:"))
+    raise ValueError(f"Unknown cluster backend: {backend}")
+
+
+# ==========================================
+# 任务租约与共享队列 (Work Coordinator)
+# ==========================================
+
+class WorkCoordinator:
+    """
+    每个 worker 一个：
+    - submit() 本地还有空位且能拿到租约时直接在本进程执行，否则写入共享队列（满时抛出 SchedulerFullError）
+    - 后台线程按 poll_interval 认领队列中的任务，按 heartbeat_interval 续约，
+      任务空闲（没有等待 / 执行中的子任务）一段时间后写回状态并释放租约
+    - 持有者宕机后租约过期，其他 worker 把仍未完成的任务作为 resume 重新入队并接手
+    dispatch(job) 由调用方提供，负责在本进程执行 job（返回本地排队位置）
+    """
+    def __init__(self, backend, store, dispatch, worker_id: str = None, lease_seconds: float = 30,
+                 heartbeat_interval: float = 5, poll_interval: float = 0.5, max_active: int = 32,
+                 max_queue: int = 1024, release_delay: float = 2.0):
+        self.backend = backend
+        self.store = store
+        self.dispatch = dispatch
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.max_active = max(1, max_active)
+        self.max_queue = max(1, max_queue)
+        self.release_delay = release_delay
+
+        self._lock = threading.RLock()
+        # 本次持有租约期间已经开始处理的任务，避免重复的 process / resume
+        self._started = set()
+        self._last_heartbeat = 0.0
+        self._thread = None
+        self._stopped = threading.Event()
+        self.claimed = 0
+        self.local_starts = 0
+        self.takeovers = 0
+        self.lost_leases = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="cluster_coordinator", daemon=True)
+            self._thread.start()
+            print(f"[*] Cluster worker {self.worker_id} started")
+
+    def _active_count(self) -> int:
+        return sum(1 for pid in self.store.owned_ids() if not self.store.is_idle(pid))
+
+    def submit(self, process_id: str, kind: str, args: dict = None) -> int:
+        """
+        返回排队位置（本地执行时为本地调度器中的位置）
+        """
+        job = {"process_id": process_id, "kind": kind, "args": args or {}, "enqueued_at": time.time()}
+        with self._lock:
+            if self._active_count() < self.max_active and self.backend.acquire_lease(process_id, self.worker_id, self.lease_seconds):
+                try:
+                    position = self._execute(job)
+                    self.local_starts += 1
+                    return position
+                except SchedulerFullError:
+                    # 本地调度器已满，交给其他 worker
+                    self._drop(process_id)
+
+        depth = self.backend.queue_depth()
+        if depth >= self.max_queue:
+            raise SchedulerFullError(depth, self.max_queue)
+        self.backend.enqueue(job)
+        return depth + 1
+
+    def _execute(self, job: dict) -> int:
+        pid = job["process_id"]
+        if pid not in self._started:
+            # 刚拿到租约：从共享后端载入最新状态
+            state = self.store.adopt(pid)
+            if state is None:
+                self._drop(pid)
+                return 0
+            self._started.add(pid)
+            if not self.store.is_idle(pid):
+                # 新提交的任务，或上一个持有者中途退出：从中断处继续
+                if job["kind"] not in ("process", "resume"):
+                    self.takeovers += 1
+                    print(f"[*] Taking over process {pid}")
+                position = self.dispatch({**job, "kind": "resume"})
+                if job["kind"] in ("process", "resume"):
+                    return position
+        elif job["kind"] in ("process", "resume"):
+            # 已经在本进程处理中，重复的 resume 直接忽略
+            return 0
+        return self.dispatch(job)
+
+    def _drop(self, process_id: str):
+        self._started.discard(process_id)
+        self.store.release(process_id)
+        self.backend.release_lease(process_id, self.worker_id)
+
+    def _loop(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"[!] Cluster coordinator error: {e}")
+
+    def tick(self):
+        now = time.monotonic()
+        if now - self._last_heartbeat >= self.heartbeat_interval:
+            self._last_heartbeat = now
+            self._heartbeat()
+        self._release_idle()
+        self._claim()
+
+    def _heartbeat(self):
+        owned = self.store.owned_ids()
+        lost = self.backend.renew_leases(owned, self.worker_id, self.lease_seconds)
+        for pid in lost:
+            # 租约已被其他 worker 接手（例如本进程长时间卡住），之后对该任务的修改不再写回
+            print(f"[!] Lease lost for process {pid}")
+            self.lost_leases += 1
+            with self._lock:
+                self._started.discard(pid)
+                self.store.fence(pid)
+        # 顺带检查宕机 worker 留下的任务：租约过期且没有排队中的任务
+        orphans = self.backend.enqueue_orphans(time.time() - self.lease_seconds)
+        if orphans:
+            print(f"[*] Re-queued {len(orphans)} orphaned processes")
+
+    def _release_idle(self):
+        with self._lock:
+            for pid in self.store.owned_ids():
+                if self.store.is_idle(pid) and self.store.idle_for(pid) >= self.release_delay:
+                    self._drop(pid)
+
+    def _claim(self):
+        while True:
+            with self._lock:
+                if self._active_count() >= self.max_active:
+                    return
+                job = self.backend.claim_job(self.worker_id, self.lease_seconds)
+                if job is None:
+                    return
+                self.claimed += 1
+                try:
+                    self._execute(job)
+                except SchedulerFullError:
+                    # 本地调度器已满：放回共享队列，稍后再认领
+                    self.backend.enqueue(job)
+                    if job["process_id"] not in self._started:
+                        self._drop(job["process_id"])
+                    return
+
+    def shutdown(self):
+        """
+        写回状态并释放全部租约，未完成的任务由其他 worker 接手
+        """
+        self._stopped.set()
+        with self._lock:
+            for pid in self.store.owned_ids():
+                self._drop(pid)
+
+    def metrics(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "owned": len(self.store.owned_ids()),
+            "active": self._active_count(),
+            "max_active": self.max_active,
+            "max_queue": self.max_queue,
+            "claimed": self.claimed,
+            "local_starts": self.local_starts,
+            "takeovers": self.takeovers,
+            "lost_leases": self.lost_leases,
+            **self.backend.stats(),
+        }
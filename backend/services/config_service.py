@@ -0,0 +1,121 @@
+import os
+import json
+import time
+import signal
+import threading
+
+# ==========================================
+# 配置服务 (Config Service)
+# ==========================================
+
+class ConfigService:
+    """
+    缓存解析后的配置文件：
+    - get() 最多每 check_interval 秒检查一次 mtime，文件变化时才重新解析
+    - 收到 SIGHUP 后下一次 get() 强制重新加载
+    - 新文件解析失败（例如编辑到一半）时继续使用上一份有效配置
+    - watch() 注册某个配置段的回调，只有该段（或指定的键）真正变化时才触发，
+      用于按需重建 LLM / HTTP 客户端
+    get() 返回的是共享的字典，调用方不要修改
+    """
+    def __init__(self, path: str, check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self.reloads = 0
+        self._config = {}
+        self._mtime = None
+        self._last_checked = 0.0
+        self._force_reload = False
+        self._lock = threading.Lock()
+        self._watchers = []
+        self._reload()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            print(f"[!] Config file not found at: {self.path}")
+            return {}, None
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f), mtime
+
+    def _reload(self):
+        try:
+            config, mtime = self._read()
+        except Exception as e:
+            print(f"[!] Error loading config: {e}")
+            # 记下出错文件的 mtime，文件再次修改前不重复解析
+            try:
+                self._mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                pass
+            return
+
+        with self._lock:
+            old = self._config
+            self._config = config
+            self._mtime = mtime
+            self.reloads += 1
+            watchers = list(self._watchers)
+        if self.reloads > 1:
+            print(f"[*] Config reloaded from {self.path}")
+
+        for section, keys, callback in watchers:
+            if self._section(old, section, keys) != self._section(config, section, keys):
+                self._notify(section, callback, config)
+
+    @staticmethod
+    def _section(config: dict, section: str, keys):
+        value = config.get(section, {})
+        if keys is None or not isinstance(value, dict):
+            return value
+        return {k: value.get(k) for k in keys}
+
+    @staticmethod
+    def _notify(section: str, callback, config: dict):
+        try:
+            callback(config.get(section, {}))
+        except Exception as e:
+            print(f"[!] Config watcher for '{section}' failed: {e}")
+
+    def get(self) -> dict:
+        now = time.monotonic()
+        if self._force_reload:
+            self._force_reload = False
+            self._last_checked = now
+            self._reload()
+        elif now - self._last_checked >= self.check_interval:
+            self._last_checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self._reload()
+        return self._config
+
+    def reload(self):
+        """
+        标记为需要重新加载（可在信号处理函数中调用）
+        """
+        self._force_reload = True
+
+    def watch(self, section: str, callback, keys: tuple = None):
+        """
+        注册回调 callback(section_dict)：立即以当前值调用一次，之后只在该段变化时调用
+        keys 指定时只比较这些键
+        """
+        with self._lock:
+            self._watchers.append((section, keys, callback))
+            config = self._config
+        self._notify(section, callback, config)
+
+    def install_sighup_handler(self):
+        """
+        kill -HUP <pid> 触发重新加载；Windows 没有 SIGHUP，非主线程也无法注册
+        """
+        if not hasattr(signal, "SIGHUP"):
+            return
+        try:
+            signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+        except ValueError:
+            pass
@@ -0,0 +1,156 @@
+import time
+import heapq
+import itertools
+import threading
+import requests
+from concurrent.futures import Future, ThreadPoolExecutor
+from services.http_client import HttpClient
+
+# ==========================================
+# Deep Research 轮询器 (Interaction Poller)
+# ==========================================
+
+class ResearchPoller:
+    """
+    所有进行中的 interaction 共用一个定时线程 + 少量轮询线程
+    定时线程按“下次轮询时间”维护一个小顶堆，到期后把 GET 请求交给线程池执行，
+    因此几百个并发的研究任务也只占用 poll_workers + 1 个线程
+
+    轮询间隔自适应：状态没有变化时按 backoff 倍率增长到 max_interval，
+    状态变化（如 queued -> running）时重置为 min_interval
+    """
+    def __init__(self, http_client: HttpClient = None, poll_workers: int = 4, min_interval: float = 5,
+                 max_interval: float = 60, backoff: float = 1.5,
+                 max_consecutive_errors: int = 10):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.max_consecutive_errors = max_consecutive_errors
+
+        # 共用连接池，避免每次轮询都重新握手
+        self.http = http_client or HttpClient({"pool_maxsize": poll_workers})
+
+        self._executor = ThreadPoolExecutor(max_workers=poll_workers, thread_name_prefix="research_poll")
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._active = 0
+
+        self._timer = threading.Thread(target=self._timer_loop, name="research_timer", daemon=True)
+        self._timer.start()
+
+    def watch(self, interaction_id: str, poll_url: str, headers: dict, timeout_seconds: float) -> Future:
+        """
+        登记一个 interaction，返回 Future，结果为 {"status": "success"/"error", ...}
+        """
+        future = Future()
+        job = {
+            "interaction_id": interaction_id,
+            "poll_url": poll_url,
+            "headers": headers,
+            "deadline": time.monotonic() + timeout_seconds,
+            "interval": self.min_interval,
+            "last_status": None,
+            "errors": 0,
+            "started_at": time.monotonic(),
+            "future": future,
+        }
+        with self._cond:
+            self._active += 1
+        self._schedule(job, self.min_interval)
+        return future
+
+    def active_count(self) -> int:
+        with self._cond:
+            return self._active
+
+    def _schedule(self, job: dict, delay: float):
+        with self._cond:
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._seq), job))
+            self._cond.notify()
+
+    def _finish(self, job: dict, result: dict):
+        with self._cond:
+            if job["future"].done():
+                return
+            self._active -= 1
+        job["future"].set_result(result)
+
+    def _timer_loop(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                due_at, _, job = self._heap[0]
+                now = time.monotonic()
+                if due_at > now:
+                    self._cond.wait(due_at - now)
+                    continue
+                heapq.heappop(self._heap)
+            self._executor.submit(self._poll_once, job)
+
+    def _poll_once(self, job: dict):
+        # 任何意外异常（返回格式不对、重新排期失败等）都要结束该任务，否则子任务会一直停在“处理中”
+        try:
+            self._poll_step(job)
+        except Exception as e:
+            print(f"[!] Research {job['interaction_id']} polling crashed: {e}")
+            self._finish(job, {"status": "error", "message": f"Polling failed: {e}"})
+
+    def _poll_step(self, job: dict):
+        interaction_id = job["interaction_id"]
+        elapsed = int(time.monotonic() - job["started_at"])
+
+        if time.monotonic() >= job["deadline"]:
+            self._finish(job, {"status": "error", "message": "Timeout: Research took too long."})
+            return
+
+        try:
+            check_resp = self.http.get(job["poll_url"], headers=job["headers"], timeout=30)
+            job["errors"] = 0
+        except requests.exceptions.RequestException as e:
+            # 网络波动：连续失败多次才放弃
+            job["errors"] += 1
+            print(f"[!] Network fluctuation ({job['errors']}/{self.max_consecutive_errors}): {str(e).split('(')[0]}... Retrying...")
+            if job["errors"] >= self.max_consecutive_errors:
+                self._finish(job, {"status": "error", "message": f"Polling failed: Network unstable ({str(e)})"})
+            else:
+                self._schedule(job, job["interval"])
+            return
+
+        # HTTP 错误 / 非法 JSON 都视为需要重试的情况，不立即报错
+        if check_resp.status_code != 200:
+            print(f"[!] Polling HTTP error ({check_resp.status_code}). Retrying...")
+            self._schedule(job, job["interval"])
+            return
+        try:
+            check_data = check_resp.json()
+        except ValueError:
+            print("[!] Invalid JSON received. Retrying...")
+            self._schedule(job, job["interval"])
+            return
+
+        if not isinstance(check_data, dict):
+            raise ValueError(f"unexpected response: {str(check_data)[:200]}")
+        status = check_data.get("status")
+        print(f"[*] Research {interaction_id} Status ({elapsed}s): {status}")
+
+        if status == "completed":
+            outputs = check_data.get("outputs", [])
+            if outputs and isinstance(outputs[-1], dict):
+                self._finish(job, {"status": "success", "content": outputs[-1].get("text", "")})
+            else:
+                self._finish(job, {"status": "error", "message": "Deep Research completed but output is empty."})
+            return
+        elif status == "failed":
+            error_msg = check_data.get("error", "Unknown error")
+            self._finish(job, {"status": "error", "message": f"Deep Research Failed: {error_msg}"})
+            return
+
+        # 自适应退避
+        if status == job["last_status"]:
+            job["interval"] = min(self.max_interval, job["interval"] * self.backoff)
+        else:
+            job["interval"] = self.min_interval
+        job["last_status"] = status
+        self._schedule(job, job["interval"])
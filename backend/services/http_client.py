@@ -0,0 +1,330 @@
+import time
+import socket
+import asyncio
+import ipaddress
+import threading
+import importlib.util
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ==========================================
+# 共享 HTTP 客户端 (Pooled HTTP Client)
+# ==========================================
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    目标主机的熔断器处于打开状态，请求未发出
+    继承 RequestException，调用方原有的网络异常处理可以直接覆盖
+    """
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器：
+    closed    —— 正常放行，连续失败 failure_threshold 次后打开
+    open      —— 直接拒绝，reset_timeout 秒后进入 half-open
+    half-open —— 放行一个试探请求，成功则关闭，失败则重新打开
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+                self._probing = False
+            if self.state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"[!] Circuit opened after {self.failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """
+        请求未得出结果（被取消、或抛出非网络异常）：不计成功或失败，只交还试探名额
+        """
+        with self._lock:
+            self._probing = False
+
+
+class HostBreakers:
+    """
+    按主机维护熔断器与请求统计，同步 / 异步两个客户端共用这部分逻辑
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._stats = {}
+        self.failure_threshold = 5
+        self.reset_timeout = 30
+
+    def configure(self, config: dict):
+        with self._lock:
+            self.failure_threshold = config.get("breaker_failures", 5)
+            self.reset_timeout = config.get("breaker_reset_seconds", 30)
+            self._breakers = {}
+
+    def get(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+                self._stats.setdefault(host, {"requests": 0, "failures": 0, "rejected": 0})
+            return breaker
+
+    def admit(self, url: str):
+        """
+        返回 (host, breaker)；熔断打开时抛出 CircuitOpenError
+        """
+        host = urlsplit(url).netloc
+        breaker = self.get(host)
+        if not breaker.allow():
+            self.count(host, "rejected")
+            raise CircuitOpenError(f"Circuit open for {host}, request skipped")
+        self.count(host, "requests")
+        return host, breaker
+
+    def record(self, host: str, breaker: CircuitBreaker, ok):
+        """
+        ok 为 None 表示请求没有结果，只释放 half-open 的试探名额，避免熔断器一直卡在试探中
+        """
+        if ok is None:
+            breaker.release()
+        elif ok:
+            breaker.record_success()
+        else:
+            self.count(host, "failures")
+            breaker.record_failure()
+
+    def count(self, host: str, key: str):
+        with self._lock:
+            self._stats[host][key] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                host: {**counts, "circuit": self._breakers[host].state if host in self._breakers else "closed"}
+                for host, counts in self._stats.items()
+            }
+
+
+def ensure_public_url(url: str, allowed_hosts=()):
+    """
+    检查由用户提供、由服务端发起请求的地址（例如回调地址），防止借服务端访问内网 (SSRF)：
+    只允许 http(s)；主机在 allowed_hosts 中时直接放行，否则解析出的每个地址都必须是公网地址
+    不合法时抛出 ValueError
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("URL must be an absolute http(s) URL")
+    host = parts.hostname.lower()
+    if host in {h.lower() for h in allowed_hosts}:
+        return
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError) as e:
+        raise ValueError(f"Cannot resolve host {host}: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        # is_global 排除私有、回环、链路本地、保留等地址段
+        if not address.is_global or address.is_multicast:
+            raise ValueError(f"Host {host} resolves to a non-public address ({address})")
+
+
+class HttpClient:
+    """
+    所有外部读取器（jina / deepdanbooru / gemini）共用的 HTTP 客户端
+    - 一个 HTTPAdapter（urllib3 PoolManager，按主机分连接池）挂到每个线程自己的 Session 上：
+      连接跨线程复用、keep-alive，Cookie 等会话状态互不干扰
+    - 统一的重试（连接错误 + 5xx，指数退避）与默认超时
+    - 按主机熔断：某个服务持续失败时快速失败，不再占用线程等待超时
+    requests / urllib3 只支持 HTTP/1.1；HTTP/2 由异步流水线的 AsyncHttpClient 提供
+    """
+    def __init__(self, config: dict = None):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.breakers = HostBreakers()
+        self.configure(config or {})
+
+    def configure(self, config: dict):
+        """
+        按配置重建连接池与重试策略；已有的 Session 在下次使用时切换到新连接池
+        """
+        retry = Retry(
+            total=config.get("retries", 3),
+            backoff_factor=config.get("backoff_factor", 0.5),
+            status_forcelist=[500, 502, 503, 504],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=config.get("pool_hosts", 10),
+            pool_maxsize=config.get("pool_maxsize", 16),
+            max_retries=retry,
+        )
+        with self._lock:
+            old_adapter = getattr(self, "_adapter", None)
+            self._adapter = adapter
+            self.timeout = (config.get("connect_timeout", 10), config.get("read_timeout", 60))
+            self._generation += 1
+        self.breakers.configure(config)
+        if old_adapter is not None:
+            old_adapter.close()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None or self._local.generation != self._generation:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+            self._local.generation = self._generation
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        host, breaker = self.breakers.admit(url)
+        kwargs.setdefault("timeout", self.timeout)
+        ok = None
+        try:
+            response = self._session().request(method, url, **kwargs)
+            ok = response.status_code < 500
+            return response
+        except requests.exceptions.RequestException:
+            ok = False
+            raise
+        finally:
+            self.breakers.record(host, breaker, ok)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        return self.breakers.stats()
+
+
+def http2_available() -> bool:
+    """
+    httpx 的 HTTP/2 支持依赖可选的 h2 包（pip install "httpx[http2]"）
+    """
+    return importlib.util.find_spec("h2") is not None
+
+
+class AsyncHttpClient:
+    """
+    异步流水线使用的 HTTP 客户端（httpx.AsyncClient）
+    - 与 HttpClient 相同的配置段、超时、5xx 重试退避与按主机熔断
+    - 安装了 h2 且配置允许时启用 HTTP/2，同一主机的并发请求复用一条连接
+    - 客户端在第一次请求时于所在事件循环中创建，配置变化后在下一次请求时重建
+    """
+    def __init__(self, config: dict = None):
+        self._config = {}
+        self._client = None
+        self._generation = 0
+        self._client_generation = -1
+        self.breakers = HostBreakers()
+        self.configure(config or {})
+
+    def configure(self, config: dict):
+        self._config = dict(config)
+        self.breakers.configure(config)
+        self._generation += 1
+
+    def _build_client(self):
+        import httpx
+
+        config = self._config
+        http2 = config.get("http2", True) and http2_available()
+        limits = httpx.Limits(
+            max_connections=config.get("async_max_connections", 100),
+            max_keepalive_connections=config.get("pool_maxsize", 16),
+        )
+        timeout = httpx.Timeout(config.get("read_timeout", 60), connect=config.get("connect_timeout", 10))
+        # transport 层只重试建立连接失败；5xx 的重试在 request() 中处理
+        transport = httpx.AsyncHTTPTransport(http2=http2, limits=limits, retries=config.get("retries", 3))
+        return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+    async def _get_client(self):
+        if self._client is None or self._client_generation != self._generation:
+            old_client = self._client
+            self._client = self._build_client()
+            self._client_generation = self._generation
+            if old_client is not None:
+                await old_client.aclose()
+        return self._client
+
+    async def request(self, method: str, url: str, **kwargs):
+        import httpx
+
+        host, breaker = self.breakers.admit(url)
+        retries = self._config.get("retries", 3)
+        backoff = self._config.get("backoff_factor", 0.5)
+        if "timeout" in kwargs and isinstance(kwargs["timeout"], (int, float)):
+            kwargs["timeout"] = httpx.Timeout(kwargs["timeout"], connect=self._config.get("connect_timeout", 10))
+
+        # 协程可能在任意 await 处被取消（CancelledError 不是 Exception），结果统一在 finally 中记录
+        ok = None
+        try:
+            client = await self._get_client()
+            attempt = 0
+            while True:
+                response = await client.request(method, url, **kwargs)
+                if response.status_code < 500 or attempt >= retries:
+                    break
+                attempt += 1
+                await asyncio.sleep(backoff * (2 ** (attempt - 1)))
+            ok = response.status_code < 500
+            return response
+        except httpx.HTTPError:
+            ok = False
+            raise
+        finally:
+            self.breakers.record(host, breaker, ok)
+
+    async def get(self, url: str, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "http2": self._config.get("http2", True) and http2_available(),
+            "hosts": self.breakers.stats(),
+        }
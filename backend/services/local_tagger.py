@@ -0,0 +1,216 @@
+import csv
+import queue
+import threading
+from concurrent.futures import Future
+from PIL import Image
+
+# ==========================================
+# 本地图片打标 (WD14 风格 ONNX Tagger)
+# ==========================================
+
+# selected_tags.csv 中的 category
+CATEGORY_GENERAL = 0
+CATEGORY_CHARACTER = 4
+CATEGORY_RATING = 9
+
+class LocalTagger:
+    """
+    在本地 CPU 上运行 WD14 风格的 ONNX 打标模型（如 SmilingWolf/wd-*-tagger）
+    - 模型只加载一次并常驻内存，close() 后释放
+    - 预处理在调用线程中完成，推理由单独的线程合批执行：
+      第一张图到达后最多等待 batch_wait_ms，凑满 batch_size 张一起推理
+    onnxruntime / numpy 在第一次使用时才导入
+    """
+    def __init__(self, model_path: str, tags_path: str,
+                 general_threshold: float = 0.35, character_threshold: float = 0.85,
+                 batch_size: int = 8, batch_wait_ms: float = 20, intra_op_threads: int = 0):
+        self.model_path = model_path
+        self.tags_path = tags_path
+        self.general_threshold = general_threshold
+        self.character_threshold = character_threshold
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = batch_wait_ms / 1000
+        self.intra_op_threads = intra_op_threads
+
+        self._session = None
+        self._input_name = None
+        self._input_size = 448
+        self._tags = []
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._closed = False
+        self.batches = 0
+        self.images = 0
+
+    def _load(self):
+        with self._load_lock:
+            if self._closed:
+                raise RuntimeError("Local tagger has been closed")
+            if self._session is not None:
+                return
+            import onnxruntime as ort
+
+            options = ort.SessionOptions()
+            if self.intra_op_threads:
+                options.intra_op_num_threads = self.intra_op_threads
+            session = ort.InferenceSession(self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+
+            model_input = session.get_inputs()[0]
+            # 输入形状为 [batch, height, width, 3]
+            if isinstance(model_input.shape[1], int):
+                self._input_size = model_input.shape[1]
+            self._input_name = model_input.name
+
+            with open(self.tags_path, "r", encoding="utf-8") as f:
+                self._tags = [(row["name"], int(row["category"])) for row in csv.DictReader(f)]
+
+            self._session = session
+            self._worker = threading.Thread(target=self._batch_loop, name="local_tagger", daemon=True)
+            self._worker.start()
+            print(f"[*] Local tagger loaded: {self.model_path} ({len(self._tags)} tags, input {self._input_size})")
+
+    def _preprocess(self, image_path: str):
+        """
+        透明背景合成到白底 → 补成正方形 → 缩放到模型输入尺寸 → RGB 转 BGR
+        """
+        import numpy as np
+
+        with Image.open(image_path) as img:
+            img.draft("RGB", (self._input_size, self._input_size))
+            img = img.convert("RGBA")
+            canvas = Image.new("RGBA", img.size, (255, 255, 255, 255))
+            canvas.alpha_composite(img)
+            img = canvas.convert("RGB")
+
+        side = max(img.size)
+        square = Image.new("RGB", (side, side), (255, 255, 255))
+        square.paste(img, ((side - img.width) // 2, (side - img.height) // 2))
+        if side != self._input_size:
+            square = square.resize((self._input_size, self._input_size), Image.BICUBIC)
+
+        return np.asarray(square, dtype=np.float32)[:, :, ::-1]
+
+    def _batch_loop(self):
+        import numpy as np
+
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            try:
+                while len(batch) < self.batch_size:
+                    item = self._queue.get(timeout=self.batch_wait)
+                    if item is None:
+                        # close() 之前排队的图片推理完再退出
+                        stop = True
+                        break
+                    batch.append(item)
+            except queue.Empty:
+                pass
+
+            try:
+                inputs = np.ascontiguousarray(np.stack([array for array, _ in batch]))
+                probs = self._session.run(None, {self._input_name: inputs})[0]
+                self.batches += 1
+                self.images += len(batch)
+                for (_, future), row in zip(batch, probs):
+                    future.set_result(self._decode(row))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+        # 释放 InferenceSession（onnxruntime 没有显式的 close，去掉引用即可）
+        self._session = None
+
+    def _decode(self, probs) -> list:
+        characters = []
+        general = []
+        for (name, category), score in zip(self._tags, probs):
+            if category == CATEGORY_CHARACTER and score >= self.character_threshold:
+                characters.append((score, name))
+            elif category == CATEGORY_GENERAL and score >= self.general_threshold:
+                general.append((score, name))
+        # 角色标签在前，各自按置信度从高到低；rating 不输出
+        return [name for _, name in sorted(characters, reverse=True)] + \
+               [name for _, name in sorted(general, reverse=True)]
+
+    def tag(self, image_path: str) -> list:
+        if self._session is None:
+            self._load()
+        array = self._preprocess(image_path)
+        future = Future()
+        with self._load_lock:
+            if self._closed:
+                raise RuntimeError("Local tagger has been closed")
+            self._queue.put((array, future))
+        return future.result()
+
+    def close(self):
+        """
+        停止推理线程并释放模型；已排队的图片仍会完成
+        """
+        with self._load_lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._worker is None:
+                return
+            self._queue.put(None)
+        print(f"[*] Local tagger unloaded: {self.model_path}")
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self._session is not None and not self._closed,
+            "batches": self.batches,
+            "images": self.images,
+            "avg_batch_size": round(self.images / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+# 只保留当前配置对应的 tagger，换配置时关闭旧的，避免旧模型一直占着内存
+_TAGGER = None
+_TAGGER_KEY = None
+_TAGGER_LOCK = threading.Lock()
+
+def _tagger_key(tool_config: dict) -> tuple:
+    return (
+        tool_config.get("model_path", "models/wd-tagger/model.onnx"),
+        tool_config.get("tags_path", "models/wd-tagger/selected_tags.csv"),
+        tool_config.get("general_threshold", 0.35),
+        tool_config.get("character_threshold", 0.85),
+        tool_config.get("batch_size", 8),
+        tool_config.get("batch_wait_ms", 20),
+        tool_config.get("intra_op_threads", 0),
+    )
+
+def get_local_tagger(tool_config: dict) -> LocalTagger:
+    """
+    按配置取常驻的 tagger 实例，配置不变时复用同一个模型，配置变化时替换并关闭旧实例
+    """
+    global _TAGGER, _TAGGER_KEY
+    key = _tagger_key(tool_config)
+    with _TAGGER_LOCK:
+        if _TAGGER is not None and _TAGGER_KEY == key:
+            return _TAGGER
+        old = _TAGGER
+        _TAGGER, _TAGGER_KEY = LocalTagger(*key), key
+        tagger = _TAGGER
+    if old is not None:
+        old.close()
+    return tagger
+
+def release_local_tagger(keep_config: dict = None):
+    """
+    关闭当前的 tagger；keep_config 与当前实例的配置一致时保留（供配置监听回调使用）
+    """
+    global _TAGGER, _TAGGER_KEY
+    with _TAGGER_LOCK:
+        if _TAGGER is None or (keep_config is not None and _tagger_key(keep_config) == _TAGGER_KEY):
+            return
+        old = _TAGGER
+        _TAGGER, _TAGGER_KEY = None, None
+    old.close()
@@ -1,23 +1,30 @@
 import time
-import base64
+import asyncio
 import threading
 import requests
-import warnings
 import json
 import os
+import re
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
 from bs4 import BeautifulSoup
-from models import CharacterModel, ProcessState, SubTaskResult, TaskStatus,CharacterCard
-from utils.doc import load_docx, load_pdf, load_text_file, load_excel
-from utils.image import resize_image, blank_image,save_png
-from openai import OpenAI
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
-# 忽略 image_reader 中 verify=False产生的警告
-warnings.filterwarnings("ignore")
-
-# 简单的内存数据库
-MOCK_DB = {}
+from models import CharacterModel, ProcessState, SubTaskResult, TaskStatus
+from utils.doc import load_document, load_document_isolated
+from utils.sandbox import run_isolated
+from utils.image import resize_image, save_png, blank_card_png
+from utils.json_stream import JsonFieldStream
+from utils.context import pack_materials, split_passages, estimate_tokens
+from utils.prompts import PromptLoader
+from services.scheduler import JobScheduler, AsyncJobRunner, RateLimiter, SchedulerFullError
+from services.deep_research import ResearchPoller
+from services.local_tagger import get_local_tagger, release_local_tagger
+from services.state_events import ChangeJournal
+from services.state_store import create_state_store, SharedStateStore
+from services.cluster import WorkCoordinator, create_cluster_backend
+from services.config_service import ConfigService
+from services.http_client import HttpClient, AsyncHttpClient, ensure_public_url
+from services.result_cache import ResultCache, url_key, file_key
+from openai import OpenAI, AsyncOpenAI
 
 # 配置文件路径
 DEBUG_MODE = True
@@ -30,122 +37,323 @@ else:
 # 0. 配置管理 (Config Manager)
 # ==========================================
 
+# 配置缓存：文件 mtime 变化或收到 SIGHUP 时才重新解析
+CONFIG = ConfigService(CONFIG_PATH)
+CONFIG.install_sighup_handler()
+
 def load_config():
     """
-    每次调用时重新读取配置文件，确保能够获取运行过程中的修改
+    返回缓存的配置；运行过程中修改配置文件依然会在约 1 秒内生效
     """
-    if not os.path.exists(CONFIG_PATH):
-        print(f"[!] Config file not found at: {CONFIG_PATH}")
-        return {}
-    
-    try:
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"[!] Error loading config: {e}")
-        return {}
-    
-client = OpenAI(
-    api_key=load_config().get("llm", {}).get("key", ""),
-    base_url=load_config().get("llm", {}).get("endpoint", "")
+    return CONFIG.get()
+
+# LLM 客户端：只有 endpoint / key 变化时才重建（连接池随客户端复用）
+# async_client 供异步流水线使用，只在其事件循环中调用
+client = None
+async_client = None
+
+def _rebuild_llm_client(llm_config: dict):
+    global client, async_client
+    client = OpenAI(
+        api_key=llm_config.get("key", ""),
+        base_url=llm_config.get("endpoint", "")
+    )
+    async_client = AsyncOpenAI(
+        api_key=llm_config.get("key", ""),
+        base_url=llm_config.get("endpoint", "")
+    )
+    if llm_config.get("endpoint"):
+        print(f"[*] LLM client ready: {llm_config.get('endpoint')}")
+
+CONFIG.watch("llm", _rebuild_llm_client, keys=("key", "endpoint"))
+
+def _on_image_reader_change(image_reader_config: dict):
+    # 换了本地模型 / 阈值或不再使用本地打标时，关闭旧的 tagger 释放模型内存
+    keep = image_reader_config.get("local", {}) if image_reader_config.get("type") == "local" else None
+    release_local_tagger(keep)
+
+CONFIG.watch("image_reader", _on_image_reader_change, keys=("type", "local"))
+
+# 任务状态存储：默认 SQLite(WAL) 持久化 + 内存热缓存
+# cluster.enabled 时改为共享后端：多个 worker（或多台机器）通过租约分工，任何 worker 都能查询 / 操作任意任务
+_state_config = load_config().get("state_store", {})
+_cluster_config = load_config().get("cluster", {})
+if _cluster_config.get("enabled", False):
+    STATE_STORE = SharedStateStore(
+        create_cluster_backend(_cluster_config, default_path=_state_config.get("path", "data/state.db")),
+        ttl_seconds=_state_config.get("ttl_hours", 72) * 3600,
+        flush_interval=_state_config.get("flush_interval", 0.5)
+    )
+    # 后台线程在 resume_unfinished_tasks() 中启动；dispatch 在模块末尾之前不会被调用
+    CLUSTER = WorkCoordinator(
+        STATE_STORE.backend, STATE_STORE,
+        dispatch=lambda job: _dispatch_cluster_job(job),
+        lease_seconds=_cluster_config.get("lease_seconds", 30),
+        heartbeat_interval=_cluster_config.get("heartbeat_interval", 5),
+        poll_interval=_cluster_config.get("poll_interval", 0.5),
+        max_active=_cluster_config.get("max_active_per_worker", 32),
+        max_queue=_cluster_config.get("max_queue", 1024)
+    )
+else:
+    STATE_STORE = create_state_store(_state_config)
+    CLUSTER = None
+
+# 状态变更日志：供 SSE / ?since= 增量查询使用
+JOURNAL = ChangeJournal()
+
+# 读取结果缓存：URL 按地址 + TTL，文件按内容 SHA-256，重复提交/重试时不再重复请求第三方服务
+_cache_config = load_config().get("result_cache", {})
+READER_CACHE = ResultCache(
+    root=_cache_config.get("path", "data/cache/readers"),
+    max_bytes=_cache_config.get("max_mb", 512) * 1024 * 1024
+) if _cache_config.get("enabled", True) else None
+
+# Deep Research 结果缓存 + 进行中的研究（用于去重）
+_research_cache_config = load_config().get("research_cache", {})
+RESEARCH_CACHE = ResultCache(
+    root=_research_cache_config.get("path", "data/cache/research"),
+    max_bytes=_research_cache_config.get("max_mb", 128) * 1024 * 1024
+) if _research_cache_config.get("enabled", True) else None
+_RESEARCH_INFLIGHT = {}
+_RESEARCH_INFLIGHT_LOCK = threading.Lock()
+
+# 长资料预摘要线程池：各片段并发请求 LLM
+_summarizer_config = load_config().get("summarizer", {})
+SUMMARY_EXECUTOR = ThreadPoolExecutor(
+    max_workers=_summarizer_config.get("max_workers", 4),
+    thread_name_prefix="summarizer"
+)
+
+# 子任务线程池：网络型读取器(url/image/search)与 CPU 型读取器(doc)分开限流，
+# 避免一个长时间的 deep research 阻塞排在后面的其他资料
+_concurrency_config = load_config().get("concurrency", {})
+NETWORK_EXECUTOR = ThreadPoolExecutor(
+    max_workers=_concurrency_config.get("network_workers", 8),
+    thread_name_prefix="ref_network"
 )
+CPU_EXECUTOR = ThreadPoolExecutor(
+    max_workers=_concurrency_config.get("cpu_workers", 2),
+    thread_name_prefix="ref_cpu"
+)
+TASK_EXECUTORS = {
+    "image_analysis": NETWORK_EXECUTOR,
+    "link_crawl": NETWORK_EXECUTOR,
+    "search": NETWORK_EXECUTOR,
+    "doc_analysis": CPU_EXECUTOR,
+}
+
+# 全局调度器：处理/生成/重试任务统一排队，队列满时拒绝（由 router 返回 429）
+_scheduler_config = load_config().get("scheduler", {})
+SCHEDULER = JobScheduler(
+    workers=_scheduler_config.get("workers", 4),
+    max_queue=_scheduler_config.get("max_queue", 32)
+)
+
+# 按外部服务限流（每秒请求数），防止突发提交同时打满 LLM / Gemini
+RATE_LIMITERS = {}
+
+def _rebuild_rate_limiters(rate_limits: dict):
+    global RATE_LIMITERS
+    # 速率没变的限流器保留原对象，避免清空令牌桶状态
+    RATE_LIMITERS = {
+        provider: RATE_LIMITERS[provider] if provider in RATE_LIMITERS and RATE_LIMITERS[provider].rate == rate else RateLimiter(rate)
+        for provider, rate in rate_limits.items()
+    }
+
+CONFIG.watch("scheduler", lambda scheduler_config: _rebuild_rate_limiters(scheduler_config.get("rate_limits", {})), keys=("rate_limits",))
+
+# 外部服务共用的 HTTP 客户端：按主机复用连接、统一重试/超时、按主机熔断
+HTTP = HttpClient()
+CONFIG.watch("http", HTTP.configure)
+ASYNC_HTTP = AsyncHttpClient()
+CONFIG.watch("http", ASYNC_HTTP.configure)
+
+# 异步流水线：pipeline.mode 为 "async" 时，新任务以协程的形式在专用事件循环中执行，
+# 等待网络 / LLM 时不占用线程；第一次使用时才启动
+ASYNC_RUNNER = None
+_ASYNC_RUNNER_LOCK = threading.Lock()
+# 事件循环内的并发上限（信号量只在事件循环线程中创建和使用）
+_ASYNC_LIMITS = {}
+
+def _get_async_runner() -> AsyncJobRunner:
+    global ASYNC_RUNNER
+    with _ASYNC_RUNNER_LOCK:
+        if ASYNC_RUNNER is None:
+            pipeline_config = load_config().get("pipeline", {})
+            ASYNC_RUNNER = AsyncJobRunner(
+                max_jobs=pipeline_config.get("max_jobs", 256),
+                max_queue=pipeline_config.get("max_queue", 1024)
+            )
+            print(f"[*] Async pipeline started (max_jobs={ASYNC_RUNNER.max_jobs})")
+    return ASYNC_RUNNER
+
+# 批量任务的 process_id 前缀（由 batch_service 生成）：批量任务使用单独的排队 / 并发额度
+BATCH_PROCESS_PREFIX = "batch_"
+
+def _is_batch(process_id: str) -> bool:
+    return process_id.startswith(BATCH_PROCESS_PREFIX)
+
+def _submit_job(name: str, fn, async_fn, process_id: str, *args) -> int:
+    """
+    按 pipeline.mode 把任务交给线程调度器或异步流水线，两者满载时都抛出 SchedulerFullError
+    批量任务最多占用 batch.max_queue 个排队位置，不会把交互提交挤成 429
+    """
+    limit = load_config().get("batch", {}).get("max_queue", 16) if _is_batch(process_id) else None
+    if load_config().get("pipeline", {}).get("mode", "threaded") == "async":
+        return _get_async_runner().submit(name, async_fn, process_id, *args, limit=limit)
+    return SCHEDULER.submit(name, fn, process_id, *args, limit=limit)
+
+def _async_limit(name: str, size: int) -> asyncio.Semaphore:
+    semaphore = _ASYNC_LIMITS.get(name)
+    if semaphore is None:
+        semaphore = _ASYNC_LIMITS[name] = asyncio.Semaphore(max(1, size))
+    return semaphore
+
+# Deep Research 轮询器：所有进行中的研究任务共用
+_research_config = load_config().get("search_engine", {}).get("google", {})
+RESEARCH_POLLER = ResearchPoller(
+    http_client=HTTP,
+    poll_workers=_research_config.get("poll_workers", 4),
+    min_interval=_research_config.get("poll_interval", 5),
+    max_interval=_research_config.get("max_poll_interval", 60)
+)
+
+# 生成结果（卡片 PNG / JSON）落盘到 <path>/<process_id>/，由 /api/file/card/{pid}.png|.json 下发，
+# final_json 只保存引用，状态接口不再反复传输整张卡
+ARTIFACT_ROOT = load_config().get("artifacts", {}).get("path", "data/cards")
+CARD_ARTIFACTS = {"png": "card.png", "json": "card.json"}
+_SAFE_ID_RE = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+def _artifact_path(process_id: str, filename: str) -> str:
+    if not _SAFE_ID_RE.match(process_id):
+        raise ValueError(f"Invalid process id: {process_id}")
+    return os.path.join(ARTIFACT_ROOT, process_id, filename)
+
+def _write_artifact(process_id: str, filename: str, data: bytes) -> str:
+    path = _artifact_path(process_id, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # 先写临时文件再替换，下载中的请求不会读到半个文件
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+def get_card_artifact(process_id: str, kind: str):
+    """
+    返回 (文件路径, 下载文件名)；不存在时返回 None
+    """
+    filename = CARD_ARTIFACTS.get(kind)
+    if filename is None:
+        return None
+    try:
+        path = _artifact_path(process_id, filename)
+    except ValueError:
+        return None
+    if not os.path.isfile(path):
+        return None
+
+    name = "character_card"
+    state = STATE_STORE.get(process_id)
+    if state and state.final_json:
+        try:
+            name = json.loads(state.final_json).get("name") or name
+        except ValueError:
+            pass
+    # 过滤文件名中的非法字符
+    name = re.sub(r'[\\/:*?"<>|\r\n]+', "_", name).strip() or "character_card"
+    return path, f"{name}.{kind}"
+
+def _on_state_evicted(process_id: str):
+    JOURNAL.drop(process_id)
+    shutil.rmtree(os.path.join(ARTIFACT_ROOT, process_id), ignore_errors=True)
+
+STATE_STORE.on_evict = _on_state_evicted
+
+def rate_limit(provider: str):
+    limiter = RATE_LIMITERS.get(provider)
+    if limiter:
+        limiter.acquire()
+
+async def rate_limit_async(provider: str):
+    limiter = RATE_LIMITERS.get(provider)
+    if limiter:
+        await limiter.acquire_async()
+
+def get_cache_stats() -> dict:
+    return {
+        "reader_cache": READER_CACHE.stats() if READER_CACHE else None,
+        "research_cache": RESEARCH_CACHE.stats() if RESEARCH_CACHE else None,
+        "research_inflight": len(_RESEARCH_INFLIGHT),
+    }
+
+def get_scheduler_metrics() -> dict:
+    metrics = SCHEDULER.metrics()
+    metrics["rate_limits"] = {name: limiter.stats() for name, limiter in RATE_LIMITERS.items()}
+    metrics["http"] = HTTP.stats()
+    metrics["http_async"] = ASYNC_HTTP.stats()
+    metrics["async_pipeline"] = ASYNC_RUNNER.metrics() if ASYNC_RUNNER else None
+    metrics["cluster"] = CLUSTER.metrics() if CLUSTER else None
+    return metrics
 # ==========================================
 # 1. 核心工具函数 (Integration Helpers)
 # ==========================================
-def reference_info_prompts_creator(data):
-    with open("backend/prompts/reference_prompts", "r", encoding="utf-8") as f:
-        prompts = f.read()
-
-    if data["reliability_score"] == 1:
-        prompts = prompts.replace("%RELIABILITY%", "低")
-    elif data["reliability_score"] == 2:
-        prompts = prompts.replace("%RELIABILITY%", "中")
-    elif data["reliability_score"] == 3:
-        prompts = prompts.replace("%RELIABILITY%", "高")
-    elif data["reliability_score"] == 4:
-        prompts = prompts.replace("%RELIABILITY%", "确定")
+# prompts 模板启动时加载一次，文件修改后按 mtime 自动重新加载
+PROMPTS = PromptLoader("backend/prompts")
+PROMPTS.preload()
 
-    prompts = prompts.replace("%CONTENT%", data["content"])
-    return prompts
+RELIABILITY_LABELS = {1: "低", 2: "中", 3: "高", 4: "确定"}
 
-def character_info_prompts_creator(data: CharacterModel):
-    with open("backend/prompts/chara_info_prompts", "r", encoding="utf-8") as f:
-        prompts = f.read()
+def _character_fields(data: CharacterModel) -> dict:
+    """
+    角色基本信息的占位符取值，chara_info / deepresearch 两个模板共用
+    """
+    return {
+        "CHARACTER_NAME": data.character_name,
+        "CHARACTER_ALIASES": "- **角色别名:**" + ", ".join(data.character_aliases) if data.character_aliases else "",
+        "SOURCE_WORK_NAME": "- **作品名:**" + data.source_work_name if data.source_work_name else "",
+        "SOURCE_WORK_ALIASES": "- **原作别名:**" + ", ".join(data.source_work_aliases) if data.source_work_aliases else "",
+    }
 
-    prompts = prompts.replace("%CHARACTER_NAME%", data.character_name)
+def reference_info_prompts_creator(data):
+    values = {"CONTENT": data["content"]}
+    if data["reliability_score"] in RELIABILITY_LABELS:
+        values["RELIABILITY"] = RELIABILITY_LABELS[data["reliability_score"]]
+    return PROMPTS.render("reference_prompts", **values)
 
-    if data.character_aliases:
-        CHARACTER_ALIASES = "- **角色别名:**"
-        CHARACTER_ALIASES += ", ".join(data.character_aliases)
-        prompts = prompts.replace("%CHARACTER_ALIASES%", CHARACTER_ALIASES)
-    else:
-        prompts = prompts.replace("%CHARACTER_ALIASES%", "")
-    
-    if data.source_work_name:
-        SOURCE_WORK_NAME = "- **作品名:**"
-        SOURCE_WORK_NAME += data.source_work_name
-        prompts = prompts.replace("%SOURCE_WORK_NAME%", SOURCE_WORK_NAME)
-    else:
-        prompts = prompts.replace("%SOURCE_WORK_NAME%", "")
-    
-    if data.source_work_aliases:
-        SOURCE_WORK_ALIASES = "- **原作别名:**"
-        SOURCE_WORK_ALIASES += ", ".join(data.source_work_aliases)
-        prompts = prompts.replace("%SOURCE_WORK_ALIASES%", SOURCE_WORK_ALIASES)
-    else:
-        prompts = prompts.replace("%SOURCE_WORK_ALIASES%", "")
+def character_info_prompts_creator(data: CharacterModel):
+    return PROMPTS.render(
+        "chara_info_prompts",
+        USER_REQUIREMENT=data.user_requirement or "",
+        **_character_fields(data)
+    )
 
-    if data.user_requirement:
-        prompts = prompts.replace("%USER_REQUIREMENT%", data.user_requirement)
-    else:
-        prompts = prompts.replace("%USER_REQUIREMENT%", "")
-        
-    return prompts
+def summary_prompts_creator(chunk_index: int, chunk_total: int):
+    return PROMPTS.render("summary_prompts", CHUNK_INDEX=chunk_index, CHUNK_TOTAL=chunk_total)
 
 def search_prompts_creator(data: CharacterModel):
-    with open("backend/prompts/deepresearch_prompts", "r", encoding="utf-8") as f:
-        prompts = f.read()
-
-    prompts = prompts.replace("%CHARACTER_NAME%", data.character_name)
-
-    if data.character_aliases:
-        CHARACTER_ALIASES = "- **角色别名:**"
-        CHARACTER_ALIASES += ", ".join(data.character_aliases)
-        prompts = prompts.replace("%CHARACTER_ALIASES%", CHARACTER_ALIASES)
-    else:
-        prompts = prompts.replace("%CHARACTER_ALIASES%", "")
-    
-    if data.source_work_name:
-        SOURCE_WORK_NAME = "- **作品名:**"
-        SOURCE_WORK_NAME += data.source_work_name
-        prompts = prompts.replace("%SOURCE_WORK_NAME%", SOURCE_WORK_NAME)
-    else:
-        prompts = prompts.replace("%SOURCE_WORK_NAME%", "")
-    
-    if data.source_work_aliases:
-        SOURCE_WORK_ALIASES = "- **原作别名:**"
-        SOURCE_WORK_ALIASES += ", ".join(data.source_work_aliases)
-        prompts = prompts.replace("%SOURCE_WORK_ALIASES%", SOURCE_WORK_ALIASES)
-    else:
-        prompts = prompts.replace("%SOURCE_WORK_ALIASES%", "")
-    
-    return prompts
+    return PROMPTS.render("deepresearch_prompts", **_character_fields(data))
 
 def doc_reader(doc_path: str, config: dict = {}, type: str = "default"):
+    """
+    按文件头识别格式后交给注册的读取器（utils.doc.DOC_LOADERS）
+    默认在独立子进程中解析，限制内存与时间，异常文件不会拖垮服务进程
+    """
     content = ""
     if type == "default":
+        doc_config = config.get("doc_reader", {})
+        sandbox_config = doc_config.get("sandbox", {})
         try:
-            if doc_path.endswith(".docx"):
-                content = load_docx(doc_path)
-            elif doc_path.endswith(".pdf"):
-                content = load_pdf(doc_path)
-            elif doc_path.endswith(".xlsx"):
-                content = load_excel(doc_path)
-            elif doc_path.endswith(".xls"):
-                content = load_excel(doc_path)
+            if sandbox_config.get("enabled", True):
+                content = run_isolated(
+                    load_document_isolated, doc_path, doc_config,
+                    timeout=sandbox_config.get("timeout_seconds", 120),
+                    memory_limit_mb=sandbox_config.get("memory_limit_mb", 1024)
+                )
             else:
-                content = load_text_file(doc_path)
-            
+                # 服务进程内不开 PDF 进程池：forkserver / spawn 的 worker 会重新执行入口模块（整套服务初始化）
+                content = load_document(doc_path, {**doc_config, "pdf_workers": 1})
+
             return {
                 "status": "success",
                 "content": content,
@@ -169,7 +377,8 @@ def url_reader(url: str, config: dict, type: str = "jina"):
         if api_key:
             headers["Authorization"] = f"Bearer {api_key}"
         try:
-            response = requests.get(jina_base_url, headers=headers, timeout=30)
+            rate_limit("jina")
+            response = HTTP.get(jina_base_url, headers=headers, timeout=30)
             response.raise_for_status()
             
             return {
@@ -186,6 +395,61 @@ def url_reader(url: str, config: dict, type: str = "jina"):
     else:
         return {"status": "error", "message": f"Unknown url_reader type: {type}"}
 
+async def url_reader_async(url: str, config: dict, type: str = "jina"):
+    """
+    url_reader 的异步版本（异步流水线使用），返回格式相同
+    """
+    tool_config = config.get("url_reader", {}).get(type, {})
+    api_key = tool_config.get("api_key", "")
+
+    if type == "jina":
+        headers = {
+            "User-Agent": "Mozilla/5.0 (compatible; Python/3.9; JinaWrapper/1.0)"
+        }
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+        try:
+            await rate_limit_async("jina")
+            response = await ASYNC_HTTP.get(f"https://r.jina.ai/{url}", headers=headers, timeout=30)
+            response.raise_for_status()
+            return {
+                "status": "success",
+                "format": "markdown",
+                "content": response.text,
+                "url": url
+            }
+        except Exception as err:
+            return {"status": "error", "message": f"An error occurred: {err}"}
+    else:
+        return {"status": "error", "message": f"Unknown url_reader type: {type}"}
+
+
+DEEPDANBOORU_URL = "http://dev.kanotype.net:8003/deepdanbooru/upload"
+DEEPDANBOORU_FORM = {
+    "network_type": "general",
+    "crop": "false"
+}
+
+def _deepdanbooru_headers(cookie: str) -> dict:
+    return {
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
+        "Accept-Language": "zh-CN,zh-HK;q=0.9,zh;q=0.8,en;q=0.7,ja;q=0.6",
+        "Cache-Control": "no-cache",
+        "Cookie": cookie,
+        "DNT": "1",
+        "Origin": "http://dev.kanotype.net:8003",
+        "Pragma": "no-cache",
+        "Referer": "http://dev.kanotype.net:8003/deepdanbooru/",
+        "Upgrade-Insecure-Requests": "1",
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
+    }
+
+def _parse_deepdanbooru_tags(html: str) -> str:
+    soup = BeautifulSoup(html, "html.parser")
+    td_elements = soup.find_all('td')
+    tags = [td.find('a').text for td in td_elements if td.find('a')]
+    filtered_tags = [tag for tag in tags if 'rating' not in tag]
+    return ",".join(filtered_tags)
 
 def image_reader(image_path: str, config: dict, type: str = "deepdanbooru"):
     """
@@ -195,53 +459,124 @@ def image_reader(image_path: str, config: dict, type: str = "deepdanbooru"):
     tool_config = config.get("image_reader", {}).get(type, {})
     
     if type == "deepdanbooru":
-        cookie = tool_config.get("cookie", "")
-        url = "http://dev.kanotype.net:8003/deepdanbooru/upload"
-
-        headers = {
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
-            "Accept-Language": "zh-CN,zh-HK;q=0.9,zh;q=0.8,en;q=0.7,ja;q=0.6",
-            "Cache-Control": "no-cache",
-            "Cookie": cookie,
-            "DNT": "1",
-            "Origin": "http://dev.kanotype.net:8003",
-            "Pragma": "no-cache",
-            "Referer": "http://dev.kanotype.net:8003/deepdanbooru/",
-            "Upgrade-Insecure-Requests": "1",
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
-        }
+        headers = _deepdanbooru_headers(tool_config.get("cookie", ""))
 
         try:
             with open(image_path, "rb") as file:
                 files = {"file": file}
-                data = {
-                    "network_type": "general",  
-                    "crop": "false"  
-                }
 
-                session = requests.Session()
-                response = session.post(url, files=files, data=data, headers=headers, verify=False)
+                rate_limit("deepdanbooru")
+                response = HTTP.post(DEEPDANBOORU_URL, files=files, data=DEEPDANBOORU_FORM, headers=headers)
 
             if response.status_code == 200:
-                soup = BeautifulSoup(response.text, "html.parser")
-                td_elements = soup.find_all('td')
-                tags = [td.find('a').text for td in td_elements if td.find('a')]
-                filtered_tags = [tag for tag in tags if 'rating' not in tag]
-                
-                result_string = ",".join(filtered_tags)
-                return {"status": "success", "content": result_string}
+                return {"status": "success", "content": _parse_deepdanbooru_tags(response.text)}
             else:
                 raise ValueError(f"Fetch error: Status code {response.status_code}")
                 
         except Exception as e:
             return {"status": "error", "message": str(e)}
+    elif type == "local":
+        # 本地 ONNX 模型打标，不依赖网络
+        try:
+            tags = get_local_tagger(tool_config).tag(image_path)
+            return {"status": "success", "content": ",".join(tags)}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
     else:
         return {"status": "error", "message": f"Unknown image_reader type: {type}"}
 
+async def image_reader_async(image_path: str, config: dict, type: str = "deepdanbooru"):
+    """
+    image_reader 的异步版本：读文件、解析 HTML、本地模型推理放到线程中执行
+    """
+    if type == "deepdanbooru":
+        tool_config = config.get("image_reader", {}).get(type, {})
+        try:
+            image_bytes = await asyncio.to_thread(_read_bytes, image_path)
+            await rate_limit_async("deepdanbooru")
+            response = await ASYNC_HTTP.post(
+                DEEPDANBOORU_URL,
+                files={"file": (os.path.basename(image_path), image_bytes)},
+                data=DEEPDANBOORU_FORM,
+                headers=_deepdanbooru_headers(tool_config.get("cookie", ""))
+            )
+            if response.status_code != 200:
+                raise ValueError(f"Fetch error: Status code {response.status_code}")
+            return {"status": "success", "content": await asyncio.to_thread(_parse_deepdanbooru_tags, response.text)}
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+    # 本地打标本身就是 CPU 推理（内部已做批处理），整体放到线程中
+    return await asyncio.to_thread(image_reader, image_path, config, type)
+
+def _read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _resolved(result: dict) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+DEFAULT_RESEARCH_AGENT = "deep-research-pro-preview-12-2025"
+
+def research_cache_key(query: str, agent: str) -> str:
+    """
+    研究缓存键：规范化空白后的 prompt + agent 名
+    """
+    normalized = " ".join(query.split())
+    return url_key(f"search_reader:{agent}", normalized)
+
+def search_reader_async(query: str, config: dict, type: str = "google", bypass_cache: bool = False) -> Future:
+    """
+    统一接口：执行搜索（非阻塞），带研究结果缓存
+    - 相同 prompt + agent 在 ttl_hours 内直接返回缓存结果
+    - 同一研究正在进行时，后来的请求挂到同一个 interaction 上，不再重复发起
+    - bypass_cache=True 时强制重新研究，结果会刷新缓存
+    """
+    agent = config.get("search_engine", {}).get("google", {}).get("agent", DEFAULT_RESEARCH_AGENT)
+    cache_key = research_cache_key(f"{type}\n{query}", agent)
+    cache_ttl = config.get("research_cache", {}).get("ttl_hours", 168) * 3600
+
+    if RESEARCH_CACHE and not bypass_cache:
+        cached = RESEARCH_CACHE.get(cache_key, ttl=cache_ttl)
+        if cached is not None:
+            print("[*] Research cache hit")
+            return _resolved({"status": "success", "content": cached})
+
+    with _RESEARCH_INFLIGHT_LOCK:
+        if not bypass_cache and cache_key in _RESEARCH_INFLIGHT:
+            print("[*] Attaching to running research")
+            return _RESEARCH_INFLIGHT[cache_key]
+        shared = Future()
+        _RESEARCH_INFLIGHT[cache_key] = shared
+
+    def _on_research_done(research_future: Future):
+        try:
+            res = research_future.result()
+        except Exception as e:
+            res = {"status": "error", "message": str(e)}
+        if res["status"] == "success" and RESEARCH_CACHE:
+            try:
+                RESEARCH_CACHE.set(cache_key, res["content"])
+            except Exception as e:
+                print(f"[!] Research cache write failed: {e}")
+        with _RESEARCH_INFLIGHT_LOCK:
+            if _RESEARCH_INFLIGHT.get(cache_key) is shared:
+                del _RESEARCH_INFLIGHT[cache_key]
+        shared.set_result(res)
+
+    try:
+        research_future = _start_research(query, config, type, agent)
+    except Exception as e:
+        research_future = _resolved({"status": "error", "message": f"Exception: {str(e)}"})
+    research_future.add_done_callback(_on_research_done)
+    return shared
 
-def search_reader(query: str, config: dict, type: str = "google"):
+def _start_research(query: str, config: dict, type: str, agent: str) -> Future:
     """
-    统一接口：执行搜索
+    只同步发起创建请求，之后的轮询交给全局 RESEARCH_POLLER，
+    返回的 Future 结果格式与其他 reader 一致
     配置来源：config['search_engine'][type_key]
     注意：代码逻辑中的 type 可能与 config key 不完全一致，这里做映射处理
     """
@@ -257,7 +592,7 @@ def search_reader(query: str, config: dict, type: str = "google"):
     api_key = tool_config.get("api_key", "")
     
     if not api_key:
-         return {"status": "error", "message": f"Missing API Key for search type: {config_key}"}
+         return _resolved({"status": "error", "message": f"Missing API Key for search type: {config_key}"})
     if type == "google-deepresearch" or type == "google":
         try:
             print(f"[*] Starting Deep Research for: \n{query[:150]}...")
@@ -266,28 +601,26 @@ def search_reader(query: str, config: dict, type: str = "google"):
                     f.write(query)
             
             # === 1. 构建请求 ===
-            base_url = "https://generativelanguage.googleapis.com/v1beta/interactions"
+            # base_url 可配置，便于指向本地模拟服务
+            base_url = tool_config.get("base_url", "https://generativelanguage.googleapis.com/v1beta/interactions")
             headers = {
                 "Content-Type": "application/json",
                 "x-goog-api-key": api_key
             }
             payload = {
                 "input": query,
-                "agent": "deep-research-pro-preview-12-2025",
+                "agent": agent,
                 "background": True
             }
-            # 【增加】请求层的重试策略，防止第一次握手就失败
-            session = requests.Session()
-            retries = Retry(total=3, backoff_factor=1, status_forcelist=[500, 502, 503, 504])
-            session.mount('https://', HTTPAdapter(max_retries=retries))
             try:
-                # 使用 session 发送请求
-                response = session.post(base_url, headers=headers, json=payload, timeout=60)
+                rate_limit("gemini")
+                # 共享客户端自带重试策略，防止第一次握手就失败
+                response = HTTP.post(base_url, headers=headers, json=payload, timeout=60)
             except requests.exceptions.RequestException as req_err:
-                 return {"status": "error", "message": f"Network Error (Initial Request): {req_err}"}
+                 return _resolved({"status": "error", "message": f"Network Error (Initial Request): {req_err}"})
             if response.status_code != 200:
                 print(f"[DEBUG] Error Body: {response.text}")
-                return {"status": "error", "message": f"API Error ({response.status_code})"}
+                return _resolved({"status": "error", "message": f"API Error ({response.status_code})"})
             
             data = response.json()
             
@@ -300,77 +633,31 @@ def search_reader(query: str, config: dict, type: str = "google"):
             
             if not interaction_id:
                 print(f"[DEBUG] Response: {data}")
-                return {"status": "error", "message": "Cannot find 'id' in response."}
+                return _resolved({"status": "error", "message": "Cannot find 'id' in response."})
             
             print(f"[*] Research ID: {interaction_id}. Waiting for completion...")
-            # === 3. 轮询状态 (修改核心部分) ===
-            poll_url = f"{base_url}/{interaction_id}"
-            max_retries = tool_config.get("timeout", 30) * 6
-            count = 0
-            
-            # 连续网络错误计数器（防止死循环）
-            consecutive_net_errors = 0 
-            MAX_CONSECUTIVE_ERRORS = 10 
-            while count < max_retries:
-                time.sleep(10) 
-                count += 1
-                
-                try:
-                    # 【核心修改】将 GET 请求包裹在 try-except 中
-                    # 这里也可以复用上面的 session，但为了保险起见，这里独立捕获更灵活
-                    check_resp = requests.get(poll_url, headers=headers, timeout=30)
-                    
-                    # 如果请求成功，重置连续错误计数
-                    consecutive_net_errors = 0 
-                except requests.exceptions.RequestException as e:
-                    # 【关键点】捕获网络异常（SSL, Timeout, ConnectionError等）
-                    consecutive_net_errors += 1
-                    err_msg = str(e)
-                    # 只有连续错误多次才打印详细日志，避免刷屏，或者简单的提示
-                    print(f"[!] Network fluctuation ({consecutive_net_errors}/{MAX_CONSECUTIVE_ERRORS}): {err_msg.split('(')[0]}... Retrying...")
-                    
-                    if consecutive_net_errors >= MAX_CONSECUTIVE_ERRORS:
-                        return {"status": "error", "message": f"Polling failed: Network unstable ({str(e)})"}
-                    
-                    # 遇到网络错误，直接跳过本次循环，进入下一次 sleep 和重试
-                    continue
-                # --- 以下是正常的 HTTP 状态码处理 ---
-                if check_resp.status_code != 200:
-                    print(f"[!] Polling HTTP error ({check_resp.status_code}). Retrying...")
-                    # HTTP 错误也视为一种需要重试的情况，不立即报错
-                    continue
-                
-                try:
-                    check_data = check_resp.json()
-                except ValueError:
-                    print("[!] Invalid JSON received. Retrying...")
-                    continue
-                status = check_data.get("status")
-                print(f"[DEBUG] Response: {check_data}")
-                print(f"[*] Research Status ({count*10}s): {status}") 
-                
-                if status == "completed":
-                    outputs = check_data.get("outputs", [])
-                    if outputs:
-                        content = outputs[-1].get("text", "")
-                        return {"status": "success", "content": content}
-                    else:
-                        return {"status": "error", "message": "Deep Research completed but output is empty."}
-                
-                elif status == "failed":
-                    error_msg = check_data.get("error", "Unknown error")
-                    return {"status": "error", "message": f"Deep Research Failed: {error_msg}"}
-            
-            return {"status": "error", "message": "Timeout: Research took too long."}
+            # === 3. 交给轮询器，不占用当前线程 ===
+            return RESEARCH_POLLER.watch(
+                interaction_id=interaction_id,
+                poll_url=f"{base_url}/{interaction_id}",
+                headers=headers,
+                timeout_seconds=tool_config.get("timeout", 30) * 60
+            )
         except Exception as e:
-            return {"status": "error", "message": f"Exception: {str(e)}"}
+            return _resolved({"status": "error", "message": f"Exception: {str(e)}"})
     
     elif type == "tavily":
         # 预留给 Tavily 的实现
-        return {"status": "error", "message": "Tavily implementation not included in this snippet"}
+        return _resolved({"status": "error", "message": "Tavily implementation not included in this snippet"})
         
     else:
-        return {"status": "error", "message": "Unknown search type"}
+        return _resolved({"status": "error", "message": "Unknown search type"})
+
+def search_reader(query: str, config: dict, type: str = "google", bypass_cache: bool = False):
+    """
+    统一接口：执行搜索（阻塞等待结果）
+    """
+    return search_reader_async(query, config, type, bypass_cache).result()
 
 
 # ==========================================
@@ -378,7 +665,67 @@ def search_reader(query: str, config: dict, type: str = "google"):
 # ==========================================
 
 def get_task_status(process_id: str) -> ProcessState:
-    return MOCK_DB.get(process_id)
+    return STATE_STORE.get(process_id)
+
+def get_task_changes(process_id: str, since: int):
+    """
+    返回 since 之后的增量事件；变更日志无法补齐时返回 None，调用方应改用完整状态
+    """
+    state = STATE_STORE.get(process_id)
+    if not state:
+        return None
+    if not STATE_STORE.owns(process_id):
+        # 由其他 worker 处理的任务，本进程没有变更日志：版本变化时让调用方改取完整快照
+        if state.version > since:
+            return None
+        return {"process_id": process_id, "version": state.version, "events": []}
+    JOURNAL.seed(state)
+    events = JOURNAL.since(process_id, since)
+    if events is None:
+        return None
+    return {
+        "process_id": process_id,
+        "version": events[-1]["version"] if events else max(since, JOURNAL.version(process_id)),
+        "events": events,
+    }
+
+# --- 状态修改统一入口：每次修改都记录一条变更事件 ---
+
+def _update_state(state: ProcessState, **fields):
+    for key, value in fields.items():
+        setattr(state, key, value)
+    STATE_STORE.mark_dirty(state)
+    JOURNAL.record(state, {
+        "type": "state_updated",
+        "data": state.model_dump(mode="json", include=set(fields)),
+    })
+
+def _add_sub_task(state: ProcessState, sub_task: SubTaskResult):
+    state.sub_tasks.append(sub_task)
+    STATE_STORE.mark_dirty(state)
+    JOURNAL.record(state, {
+        "type": "sub_task_added",
+        "step_id": sub_task.step_id,
+        "data": sub_task.model_dump(mode="json"),
+    })
+
+def _remove_sub_task(state: ProcessState, sub_task: SubTaskResult):
+    state.sub_tasks.remove(sub_task)
+    STATE_STORE.mark_dirty(state)
+    JOURNAL.record(state, {
+        "type": "sub_task_removed",
+        "step_id": sub_task.step_id,
+    })
+
+def _update_sub_task(state: ProcessState, sub_task: SubTaskResult, **fields):
+    for key, value in fields.items():
+        setattr(sub_task, key, value)
+    STATE_STORE.mark_dirty(state)
+    JOURNAL.record(state, {
+        "type": "sub_task_updated",
+        "step_id": sub_task.step_id,
+        "data": sub_task.model_dump(mode="json", include=set(fields)),
+    })
 
 def start_processing_background(character_data: CharacterModel, process_id: str):
     initial_state = ProcessState(
@@ -386,144 +733,553 @@ def start_processing_background(character_data: CharacterModel, process_id: str)
         sub_tasks=[],
         character_info=character_data 
     )
-    MOCK_DB[process_id] = initial_state
+    STATE_STORE.put(initial_state)
     
-    t = threading.Thread(
-        target=_processing_logic, 
-        args=(process_id, character_data)
-    )
-    t.start()
+    try:
+        if CLUSTER:
+            return CLUSTER.submit(process_id, "process")
+        _admit_processing(process_id)
+        try:
+            return _submit_job(f"process:{process_id}", _processing_logic, _processing_logic_async, process_id, character_data)
+        except SchedulerFullError:
+            with _FINISH_LOCK:
+                _REFERENCES_RUNNING.discard(process_id)
+            raise
+    except SchedulerFullError:
+        # 未被接收的任务不保留状态
+        STATE_STORE.delete(process_id)
+        JOURNAL.drop(process_id)
+        raise
+
+def _admit_processing(process_id: str):
+    """
+    准入控制：资料处理中（含排队中）的人物数达到 scheduler.max_inflight 时抛出 SchedulerFullError
+    调度线程投递完子任务即返回，进行中的任务数只能在这里限制；批量任务单独按 batch.max_inflight 计数
+    """
+    batch = _is_batch(process_id)
+    if batch:
+        max_inflight = load_config().get("batch", {}).get("max_inflight", 16)
+    else:
+        max_inflight = load_config().get("scheduler", {}).get("max_inflight", 32)
+    with _FINISH_LOCK:
+        running = sum(1 for pid in _REFERENCES_RUNNING if _is_batch(pid) == batch)
+        if running >= max_inflight:
+            raise SchedulerFullError(running, max_inflight)
+        _REFERENCES_RUNNING.add(process_id)
+
+def _build_task_def(idx: int, ref, data: CharacterModel) -> dict:
+    """
+    根据参考资料生成任务定义
+    """
+    title = ""
+    t_type = ""
+    if ref.resource_type == "image":
+        title = f"视觉分析: {ref.file_name or 'Image'}"
+        t_type = "image_analysis"
+    elif ref.resource_type == "file":
+        title = f"文档处理: {ref.file_name or 'Document'}"
+        t_type = "doc_analysis"
+    elif ref.resource_type == "url":
+        title = f"链接读取: {ref.resource_url}"
+        t_type = "link_crawl"
+    elif ref.resource_type == "search":
+        title = f"网络搜索: {data.character_name}"
+        t_type = "search"
+
+    return {
+        "step_id": f"step_ref_{idx}",
+        "title": title,
+        "type": t_type,
+        "payload": {"ref_obj": ref}
+    }
+
+# 影响文档读取结果的 doc_reader 配置项；并发、沙箱等只影响速度的配置不计入缓存键
+_DOC_READER_CACHE_FIELDS = ("max_chars", "max_pages", "excel_max_rows", "ocr_min_chars", "ocr_dpi")
+
+def _reader_cache_key(task_def: dict, current_config: dict):
+    """
+    返回 (缓存键, TTL秒)；不缓存的任务返回 (None, None)
+    """
+    if READER_CACHE is None:
+        return None, None
+    ref = task_def["payload"]["ref_obj"]
+    if task_def["type"] == "link_crawl":
+        ttl = current_config.get("result_cache", {}).get("url_ttl_hours", 24) * 3600
+        return url_key("url_reader:jina", ref.resource_url), ttl
+    if task_def["type"] == "image_analysis":
+        reader_type = current_config.get("image_reader", {}).get("type", "deepdanbooru")
+        reader = f"image_reader:{reader_type}"
+        if reader_type == "local":
+            # 换模型或阈值后结果不同，不能复用旧缓存
+            tool_config = current_config["image_reader"].get("local", {})
+            reader += ":" + json.dumps(tool_config, sort_keys=True)
+        return file_key(reader, ref.resource_url, ref.content_sha256), None
+    if task_def["type"] == "doc_analysis":
+        # 截断上限、OCR 参数变化后结果不同，不能复用旧缓存
+        doc_config = current_config.get("doc_reader", {})
+        options = {k: doc_config.get(k) for k in _DOC_READER_CACHE_FIELDS}
+        reader = "doc_reader:default:" + json.dumps(options, sort_keys=True)
+        return file_key(reader, ref.resource_url, ref.content_sha256), None
+    return None, None
+
+def _reader_cache_lookup(task_def: dict, current_config: dict):
+    """
+    返回 (缓存键, 缓存内容)；未命中时缓存内容为 None
+    """
+    try:
+        cache_key, cache_ttl = _reader_cache_key(task_def, current_config)
+    except OSError:
+        # 文件不存在等情况交给 reader 报错
+        return None, None
+    if cache_key:
+        cached = READER_CACHE.get(cache_key, ttl=cache_ttl)
+        if cached is not None:
+            print(f"[*] Cache hit: {task_def['title']}")
+            return cache_key, cached
+    return cache_key, None
+
+def _reader_content(res: dict, cache_key) -> str:
+    """
+    reader 结果转为内容：成功时写入缓存，失败抛出异常
+    """
+    if res["status"] == "success":
+        if cache_key:
+            READER_CACHE.set(cache_key, res["content"])
+        return res["content"]
+    raise Exception(res["message"])
 
-def _processing_logic(process_id: str, data: CharacterModel):
+def _run_reference_task(task_def: dict, current_config: dict) -> str:
     """
-    真实处理逻辑
+    执行单个参考资料的读取，成功返回内容，失败抛出异常
+    """
+    ref = task_def["payload"]["ref_obj"]
+
+    cache_key, cached = _reader_cache_lookup(task_def, current_config)
+    if cached is not None:
+        return cached
+
+    # === 分支处理逻辑 ===
+    if task_def["type"] == "image_analysis":
+        print(f"[*] Processing Image: {ref.resource_url}")
+        res = image_reader(
+            image_path=ref.resource_url,
+            config=current_config,
+            type=current_config.get("image_reader", {}).get("type", "deepdanbooru")
+        )
+    elif task_def["type"] == "link_crawl":
+        print(f"[*] Crawling URL: {ref.resource_url}")
+        # Dynamic Config Injection: 使用 current_config
+        res = url_reader(
+            url=ref.resource_url,
+            config=current_config,
+            type="jina"
+        )
+    elif task_def["type"] == "doc_analysis":
+        res = doc_reader(
+            doc_path=ref.resource_url,
+            config=current_config,
+        )
+    else:
+        raise Exception(f"Unknown task type: {task_def['type']}")
+
+    return _reader_content(res, cache_key)
+
+def _finish_sub_task(state: ProcessState, sub_task: SubTaskResult, res: dict):
+    """
+    把 reader 的结果写回 sub_task
+    """
+    if res["status"] == "success":
+        # === 任务成功 ===
+        _update_sub_task(state, sub_task,
+            status=TaskStatus.SUCCESS,
+            result_summary=res["content"]
+        )
+    else:
+        # === 任务失败 ===
+        print(f"[!] Task {sub_task.step_id} failed: {res['message']}")
+        _update_sub_task(state, sub_task,
+            status=TaskStatus.FAILED,
+            result_summary=f"Error (Retry {sub_task.retry_count}/{sub_task.max_retries}): {res['message']}",
+            last_error=res["message"]
+        )
+
+def _summary_messages(chunk: str, index: int, total: int, char_info: str) -> list:
+    return [
+        {"role": "system", "content": summary_prompts_creator(index, total)},
+        {"role": "user", "content": char_info},
+        {"role": "user", "content": chunk},
+    ]
+
+def _summarize_chunk(chunk: str, index: int, total: int, char_info: str, model: str) -> str:
+    messages = _summary_messages(chunk, index, total, char_info)
+    rate_limit("llm")
+    response = client.chat.completions.create(model=model, messages=messages)
+    return response.choices[0].message.content or ""
+
+def summarize_material(content: str, char_data: CharacterModel, current_config: dict, depth: int = 0) -> str:
+    """
+    Map-Reduce 预摘要：长资料切块后并发摘要，再合并成一份紧凑的结果
+    合并后仍然超过阈值时再做一轮（最多两轮）
+    """
+    summarizer_config = current_config.get("summarizer", {})
+    threshold = summarizer_config.get("threshold_tokens", 8000)
+    chunk_tokens = summarizer_config.get("chunk_tokens", 3000)
+    model = summarizer_config.get("model") or current_config.get("llm", {}).get("model", "")
+
+    chunks = split_passages(content, chunk_tokens)
+    char_info = character_info_prompts_creator(char_data)
+    print(f"[*] Summarizing {len(chunks)} chunks (~{estimate_tokens(content)} tokens)")
+
+    futures = [
+        SUMMARY_EXECUTOR.submit(_summarize_chunk, chunk, i + 1, len(chunks), char_info, model)
+        for i, chunk in enumerate(chunks)
+    ]
+    summaries = []
+    for i, future in enumerate(futures):
+        try:
+            summary = future.result().strip()
+        except Exception as e:
+            # 单个片段失败时保留原文，不丢信息
+            print(f"[!] Chunk {i + 1} summary failed: {e}")
+            summary = chunks[i]
+        if summary and summary != "无相关内容":
+            summaries.append(summary)
+
+    merged = "\n\n".join(summaries)
+    if depth == 0 and len(chunks) > 1 and estimate_tokens(merged) > threshold:
+        return summarize_material(merged, char_data, current_config, depth + 1)
+    return merged
+
+def _needs_summary(task_def: dict, content: str, current_config: dict) -> bool:
+    summarizer_config = current_config.get("summarizer", {})
+    return (summarizer_config.get("enabled", False)
+            and task_def["type"] in ("doc_analysis", "link_crawl")
+            and estimate_tokens(content) > summarizer_config.get("threshold_tokens", 8000))
+
+def _execute_sub_task(state: ProcessState, task_def: dict, sub_task: SubTaskResult, current_config: dict):
+    """
+    线程池中执行的单个子任务，结果直接写回 sub_task
+    """
+    _update_sub_task(state, sub_task, status=TaskStatus.PROCESSING)
+    try:
+        content = _run_reference_task(task_def, current_config)
+
+        # 可选：长文档 / 网页先做预摘要，避免最终生成时一次塞入整份原文
+        if _needs_summary(task_def, content, current_config):
+            original_tokens = estimate_tokens(content)
+            content = summarize_material(content, state.character_info, current_config)
+            _update_sub_task(state, sub_task, detail={
+                "summarized": True,
+                "original_tokens": original_tokens,
+                "summary_tokens": estimate_tokens(content),
+            })
+
+        res = {"status": "success", "content": content}
+    except Exception as e:
+        res = {"status": "error", "message": str(e)}
+    _finish_sub_task(state, sub_task, res)
+
+def _submit_sub_task(state: ProcessState, task_def: dict, sub_task: SubTaskResult, current_config: dict) -> Future:
+    """
+    投递子任务，返回子任务结束时完成的 Future
+    search 任务只在网络线程池里发起创建请求，轮询期间不占用线程
+    """
+    if task_def["type"] != "search":
+        executor = TASK_EXECUTORS.get(task_def["type"], NETWORK_EXECUTOR)
+        return executor.submit(_execute_sub_task, state, task_def, sub_task, current_config)
+
+    done = Future()
+
+    def _on_research_finished(research_future: Future):
+        try:
+            res = research_future.result()
+        except Exception as e:
+            res = {"status": "error", "message": str(e)}
+        _finish_sub_task(state, sub_task, res)
+        done.set_result(None)
+
+    def _start_research():
+        _update_sub_task(state, sub_task, status=TaskStatus.PROCESSING)
+        try:
+            research_future = search_reader_async(
+                query=task_def["payload"]["ref_obj"].resource_url,
+                config=current_config,
+                type="google-deepresearch",
+                bypass_cache=task_def["payload"]["ref_obj"].bypass_cache
+            )
+        except Exception as e:
+            research_future = _resolved({"status": "error", "message": str(e)})
+        research_future.add_done_callback(_on_research_finished)
+
+    NETWORK_EXECUTOR.submit(_start_research)
+    return done
+
+def _when_all_done(futures: list, callback) -> Future:
+    """
+    所有 futures 完成后调用 callback，不阻塞当前线程
+    返回在 callback 执行完（包括抛出异常）后完成的 Future
+    """
+    remaining = [len(futures)]
+    lock = threading.Lock()
+    done = Future()
+
+    def _run_callback():
+        try:
+            callback()
+        except Exception as e:
+            print(f"[!] Completion callback failed: {e}")
+        finally:
+            done.set_result(None)
+
+    def _on_done(_):
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            _run_callback()
+
+    if not futures:
+        _run_callback()
+    for future in futures:
+        future.add_done_callback(_on_done)
+    return done
+
+def _plan_sub_tasks(state: ProcessState, data: CharacterModel) -> list:
+    """
+    为每份资料生成任务定义并登记“等待中”的子任务，返回 [(task_def, sub_task)]
     """
-    # === 1. 获取最新配置 ===
-    # 在任务开始执行时读取配置，确保动态修改生效
-    current_config = load_config()
-    
-    current_state = MOCK_DB[process_id]
-    
-    # --- 2. 规划任务队列 ---
     tasks_queue = []
 
     # 遍历用户上传的资料
     for idx, ref in enumerate(data.reference):
         print(f"[*] Processing Reference: {ref}")
         print(f"[*] Cureliability_score: {ref.reliability_score}")
-        title = ""
-        t_type = ""
-        
-        task_payload = {"ref_obj": ref}
-
-        if ref.resource_type == "image":
-            title = f"视觉分析: {ref.file_name or 'Image'}"
-            t_type = "image_analysis"
-        elif ref.resource_type == "file":
-            title = f"文档处理: {ref.file_name or 'Document'}"
-            t_type = "doc_analysis"
-        elif ref.resource_type == "url":
-            title = f"链接读取: {ref.resource_url}"
-            t_type = "link_crawl"
-        elif ref.resource_type == "search":
-            title = f"网络搜索: {data.character_name}"
-            t_type = "search"
-            task_payload["ref_obj"].resource_url = search_prompts_creator(data)
-        
-        tasks_queue.append({
-            "step_id": f"step_ref_{idx}",
-            "title": title,
-            "type": t_type,
-            "payload": task_payload
-        })
-    
-    
+        if ref.resource_type == "search":
+            ref.resource_url = search_prompts_creator(data)
+        tasks_queue.append(_build_task_def(idx, ref, data))
+
+    planned = []
     for task_def in tasks_queue:
-        # 创建并展示任务（状态：处理中）
         sub_task = SubTaskResult(
             step_id=task_def["step_id"],
             title=task_def["title"],
             type=task_def["type"],
-            status=TaskStatus.PROCESSING,
+            status=TaskStatus.PENDING,
             reliability_score=task_def["payload"]["ref_obj"].reliability_score
         )
-        current_state.sub_tasks.append(sub_task)
-        
-        # 获取刚才添加的任务引用，以便更新
-        current_sub_task = next(t for t in current_state.sub_tasks if t.step_id == task_def["step_id"])
-        
+        _add_sub_task(state, sub_task)
+        planned.append((task_def, sub_task))
+    return planned
+
+# --- 流程结束判定与自动生成 ---
+# 开启提前生成时，资料处理与人物卡生成会同时进行，两者都结束后流程才算完成
+
+_REFERENCES_RUNNING = set()
+_FINISH_LOCK = threading.Lock()
+# 自动生成与手动生成都在这把锁内检查 / 登记生成任务（可重入：自动生成内部调用手动生成的入口）
+_AUTO_GENERATION_LOCK = threading.RLock()
+
+def get_generation_task(state: ProcessState):
+    return next((t for t in state.sub_tasks if t.step_id == "step_final_gen"), None)
+
+def _finish_if_idle(state: ProcessState) -> bool:
+    """
+    资料处理阶段与生成都已结束时标记流程完成，返回是否已标记
+    """
+    with _FINISH_LOCK:
+        gen_task = get_generation_task(state)
+        if state.process_id in _REFERENCES_RUNNING or (gen_task and gen_task.status == TaskStatus.PROCESSING):
+            return False
+        _update_state(state, is_finished=True)
+        return True
+
+def _finish_processing(state: ProcessState):
+    """
+    资料处理阶段结束：开启 auto_generate 时接着生成人物卡，否则标记流程完成
+    """
+    with _FINISH_LOCK:
+        _REFERENCES_RUNNING.discard(state.process_id)
+    if state.character_info.auto_generate and _start_auto_generation(state):
+        return
+    if _finish_if_idle(state):
+        print(f"Process {state.process_id} finished completely.")
+
+def _start_auto_generation(state: ProcessState) -> bool:
+    """
+    自动开始生成；已经开始过（提前生成或用户手动触发）时不重复生成，返回本次是否开始
+    """
+    with _AUTO_GENERATION_LOCK:
+        if get_generation_task(state) is not None:
+            return False
         try:
-            result_content = ""
-            
-            # === 分支处理逻辑 ===
-            if task_def["type"] == "image_analysis":
-                image_path = task_def["payload"]["ref_obj"].resource_url
-                print(f"[*] Processing Image: {image_path}")
-                
-                res = image_reader(
-                    image_path=image_path, 
-                    config=current_config,
-                    type="deepdanbooru"
-                )
-                
-                if res["status"] == "success":
-                    result_content = res["content"]
-                else:
-                    raise Exception(res["message"])
-
-            elif task_def["type"] == "link_crawl":
-                target_url = task_def["payload"]["ref_obj"].resource_url
-                print(f"[*] Crawling URL: {target_url}")
-                
-                # Dynamic Config Injection: 使用 current_config
-                res = url_reader(
-                    url=target_url, 
-                    config=current_config,
-                    type="jina"
-                )
-                
-                if res["status"] == "success":
-                    result_content = res["content"]
-                else:
-                    raise Exception(res["message"])
-            
-            elif task_def["type"] == "doc_analysis":
-                doc_path = task_def["payload"]["ref_obj"].resource_url
-                res = doc_reader(
-                    doc_path=doc_path,
-                )
-                if res["status"] == "success":
-                    result_content = res["content"]
-                else:
-                    raise Exception(res["message"])
-                
-            elif task_def["type"] == "search":
+            _start_card_generation_local(state.process_id)
+        except SchedulerFullError as e:
+            # 排不进队列时保留资料处理结果，用户可以稍后手动生成
+            print(f"[!] Auto generation for {state.process_id} rejected: {e}")
+            _notify_callback(state, "failed", f"生成队列已满: {e}")
+            return False
+    print(f"[*] Auto generation started for {state.process_id}")
+    return True
 
-                res = search_reader(
-                    query=task_def["payload"]["ref_obj"].resource_url, 
-                    config=current_config,
-                    type="google-deepresearch"
-                )
-                
-                if res["status"] == "success":
-                    result_content = res["content"]
-                else:
-                    raise Exception(res["message"])
-
-            # === 任务成功 ===
-            current_sub_task.status = TaskStatus.SUCCESS
-            current_sub_task.result_summary = result_content
-            
-        except Exception as e:
-            # === 任务失败 ===
-            print(f"[!] Task failed: {e}")
-            current_sub_task.status = TaskStatus.FAILED
-            current_sub_task.result_summary = f"Error (Retry {current_sub_task.retry_count}/{current_sub_task.max_retries}): {str(e)}"
-            current_sub_task.last_error = str(e)
-    
-    # 全部流程结束
-    current_state.is_finished = True
-    print(f"Process {process_id} finished completely.")
+def _early_generation_gate(data: CharacterModel, planned: list):
+    """
+    提前生成需要等待的子任务下标；未开启提前生成时返回 None
+    可信度不低于阈值的资料都已完成（planned 中没有）时返回空列表，即立即开始
+    """
+    threshold = data.auto_generate_min_reliability
+    if not data.auto_generate or threshold is None:
+        return None
+    # 没有任何达到阈值的资料时，提前生成没有可用的材料，按普通的自动生成处理
+    if not any(ref.reliability_score >= threshold for ref in data.reference):
+        return None
+    gate = [i for i, (_, sub_task) in enumerate(planned) if sub_task.reliability_score >= threshold]
+    return None if len(gate) == len(planned) else gate
+
+def _processing_logic(process_id: str, data: CharacterModel):
+    """
+    真实处理逻辑
+    子任务投递到线程池 / 研究轮询器后即返回，调度线程不等待；同时处理的人物数由 scheduler.max_inflight 在提交时限制
+    """
+    _REFERENCES_RUNNING.add(process_id)
+    try:
+        # === 1. 获取最新配置 ===
+        # 在任务开始执行时读取配置，确保动态修改生效
+        current_config = load_config()
+
+        current_state = STATE_STORE.get(process_id)
+
+        # --- 2. 规划任务队列 ---
+        planned = _plan_sub_tasks(current_state, data)
+
+        # --- 3. 并发执行 ---
+        # 先把所有任务以“等待中”展示出来，再按类型投递到对应线程池
+        futures = [
+            _submit_sub_task(current_state, task_def, sub_task, current_config)
+            for task_def, sub_task in planned
+        ]
+    except Exception:
+        # 投递前就失败时归还准入名额
+        with _FINISH_LOCK:
+            _REFERENCES_RUNNING.discard(process_id)
+        raise
+
+    # 可信度高的资料先完成时提前开始生成，其余资料继续处理
+    gate = _early_generation_gate(data, planned)
+    if gate is not None:
+        _when_all_done([futures[i] for i in gate], lambda: _start_auto_generation(current_state))
+
+    # 总耗时约等于最慢的那一份资料；调度线程投递完即返回，不在这里等待
+    _when_all_done(futures, lambda: _finish_processing(current_state))
+
+def resume_unfinished_tasks():
+    """
+    启动时恢复上次进程退出时仍在处理中的任务
+    集群模式下由协调线程接手租约过期的任务
+    """
+    if CLUSTER:
+        CLUSTER.start()
+        return
+    for state in STATE_STORE.load_unfinished():
+        print(f"[*] Resuming process {state.process_id}")
+        try:
+            _submit_job(f"resume:{state.process_id}", _resume_logic, _resume_logic_async, state.process_id)
+        except SchedulerFullError:
+            # 排不进队列的任务标记为失败，用户可以手动重试
+            for task in state.sub_tasks:
+                if task.status in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+                    _update_sub_task(state, task, status=TaskStatus.FAILED, last_error="服务重启后未能恢复")
+            _update_state(state, is_finished=True)
+
+def resume_task(process_id: str) -> int:
+    """
+    重新投递单个中断的任务（批量命令行续跑时使用），返回排队位置
+    集群模式下经过共享队列，正在被其他 worker 处理的任务会被忽略
+    """
+    if CLUSTER:
+        return CLUSTER.submit(process_id, "resume")
+    return _submit_job(f"resume:{process_id}", _resume_logic, _resume_logic_async, process_id)
+
+def _unfinished_sub_tasks(state: ProcessState, data: CharacterModel) -> list:
+    """
+    恢复时需要重新执行的子任务 [(task_def, sub_task)]；缺失的子任务补登记为“等待中”
+    """
+    pending = []
+    for idx, ref in enumerate(data.reference):
+        task_def = _build_task_def(idx, ref, data)
+        sub_task = next((t for t in state.sub_tasks if t.step_id == task_def["step_id"]), None)
+        if sub_task is None:
+            sub_task = SubTaskResult(
+                step_id=task_def["step_id"],
+                title=task_def["title"],
+                type=task_def["type"],
+                status=TaskStatus.PENDING,
+                reliability_score=ref.reliability_score
+            )
+            _add_sub_task(state, sub_task)
+        elif sub_task.status not in (TaskStatus.PENDING, TaskStatus.PROCESSING):
+            continue
+        pending.append((task_def, sub_task))
+    return pending
+
+def _resume_logic(process_id: str):
+    state = STATE_STORE.get(process_id)
+    data = state.character_info
+
+    # 还没来得及规划任务就中断了，直接重新处理
+    if not state.sub_tasks:
+        _processing_logic(process_id, data)
+        return
+
+    _REFERENCES_RUNNING.add(process_id)
+    current_config = load_config()
+    planned = _unfinished_sub_tasks(state, data)
+    futures = [
+        _submit_sub_task(state, task_def, sub_task, current_config)
+        for task_def, sub_task in planned
+    ]
+
+    gen_task = get_generation_task(state)
+    gate = _early_generation_gate(data, planned) if gen_task is None else None
+    if gate is not None:
+        _when_all_done([futures[i] for i in gate], lambda: _start_auto_generation(state))
+
+    def _on_finished():
+        if gen_task and gen_task.status == TaskStatus.PROCESSING:
+            # 中断时正在生成人物卡，重新排队生成
+            with _FINISH_LOCK:
+                _REFERENCES_RUNNING.discard(process_id)
+            try:
+                _submit_job(f"generate:{process_id}", _generation_logic, _generation_logic_async, process_id)
+            except SchedulerFullError as e:
+                _fail_generation(state, gen_task, e)
+        else:
+            _finish_processing(state)
+
+    _when_all_done(futures, _on_finished)
+
+def flush_state_store():
+    if CLUSTER:
+        # 释放租约，未完成的任务由其他 worker 接手
+        CLUSTER.shutdown()
+    STATE_STORE.flush()
+
+def _dispatch_cluster_job(job: dict) -> int:
+    """
+    在本进程执行共享队列中的任务（调用时已持有该任务的租约），返回本地排队位置
+    """
+    process_id = job["process_id"]
+    args = job.get("args", {})
+    if job["kind"] in ("process", "resume"):
+        return _submit_job(f"resume:{process_id}", _resume_logic, _resume_logic_async, process_id)
+    if job["kind"] == "generate":
+        return _start_card_generation_local(process_id)
+    if job["kind"] == "retry":
+        _retry_subtask_local(process_id, args["step_id"])
+        return 0
+    if job["kind"] == "update":
+        _update_subtask_result_local(process_id, args["step_id"], args["new_summary"])
+        return 0
+    raise ValueError(f"Unknown cluster job kind: {job['kind']}")
 
 # ==========================================
 # 3. 新增：交互与生成逻辑
@@ -533,13 +1289,22 @@ def update_subtask_result(process_id: str, step_id: str, new_summary: str):
     """
     前端用户在 UI 上修改了某个步骤的解析结果，调用此函数更新内存状态
     """
-    state = MOCK_DB.get(process_id)
+    state = STATE_STORE.get(process_id)
     if not state:
         raise ValueError("Process ID not found")
-    
+    if not any(task.step_id == step_id for task in state.sub_tasks):
+        return False
+    if CLUSTER:
+        # 由持有该任务租约的 worker 修改，避免与正在处理的 worker 互相覆盖
+        CLUSTER.submit(process_id, "update", {"step_id": step_id, "new_summary": new_summary})
+        return True
+    return _update_subtask_result_local(process_id, step_id, new_summary)
+
+def _update_subtask_result_local(process_id: str, step_id: str, new_summary: str) -> bool:
+    state = STATE_STORE.get(process_id)
     for task in state.sub_tasks:
         if task.step_id == step_id:
-            task.result_summary = new_summary
+            _update_sub_task(state, task, result_summary=new_summary)
             print(f"[*] Updated Task {step_id} with new content (len={len(new_summary)})")
             return True
     return False
@@ -551,32 +1316,61 @@ def start_card_generation(process_id: str):
     2. 结合 CharacterModel
     3. 调用 LLM 生成 JSON
     """
-    state = MOCK_DB.get(process_id)
-    if not state:
+    if not STATE_STORE.get(process_id):
         raise ValueError("Process ID not found")
+    if CLUSTER:
+        return CLUSTER.submit(process_id, "generate")
+    return _start_card_generation_local(process_id)
+
+GEN_TASK_TITLE = "正在根据资料构建人物卡..."
+
+def _start_card_generation_local(process_id: str) -> int:
+    state = STATE_STORE.get(process_id)
+    with _AUTO_GENERATION_LOCK:
+        gen_task = get_generation_task(state)
+        if gen_task and gen_task.status == TaskStatus.PROCESSING:
+            # 自动生成已经开始，不重复生成
+            return 0
+
+        # 先重置完成状态再登记生成任务，按版本重放增量时不会看到“已完成 + 生成中”的中间态
+        _update_state(state, is_finished=False)
+        previous = None
+        if gen_task is None:
+            # 添加一个“生成中”的任务状态，让前端感知到进入了 Step 4 处理
+            gen_task = SubTaskResult(
+                step_id="step_final_gen",
+                title=GEN_TASK_TITLE,
+                type="card_generation",
+                status=TaskStatus.PROCESSING,
+                reliability_score=5 # 最高权重
+            )
+            _add_sub_task(state, gen_task)
+        else:
+            # 重新生成：复用已有的生成任务，step_id 保持唯一
+            previous = gen_task.model_dump(include={"title", "status", "result_summary", "detail", "last_error"})
+            _update_sub_task(state, gen_task,
+                title=GEN_TASK_TITLE,
+                status=TaskStatus.PROCESSING,
+                result_summary=None,
+                detail=None,
+                last_error=None
+            )
 
-    # 添加一个“生成中”的任务状态，让前端感知到进入了 Step 4 处理
-    gen_task_id = "step_final_gen"
-    gen_task = SubTaskResult(
-        step_id=gen_task_id,
-        title="正在根据资料构建人物卡...",
-        type="card_generation",
-        status=TaskStatus.PROCESSING,
-        reliability_score=5 # 最高权重
-    )
-    state.sub_tasks.append(gen_task)
-    state.is_finished = False # 重置完成状态，因为加了新任务
-
-    # 启动后台生成线程
-    t = threading.Thread(target=_generation_logic, args=(process_id,))
-    t.start()
+        try:
+            return _submit_job(f"generate:{process_id}", _generation_logic, _generation_logic_async, process_id)
+        except SchedulerFullError:
+            # 调度器未接收，撤销本次登记
+            if previous is None:
+                _remove_sub_task(state, gen_task)
+            else:
+                _update_sub_task(state, gen_task, **previous)
+            _finish_if_idle(state)
+            raise
 
-def _generation_logic(process_id: str):
-    state = MOCK_DB[process_id]
-    character_data = state.character_info
-    
-    # 1. 聚合数据
-    # 这里将所有之前的分析结果打包
+def _collect_materials(state: ProcessState) -> list:
+    """
+    把所有已完成的分析结果打包，供最终生成使用
+    """
     analyzed_materials = []
     for task in state.sub_tasks:
         if task.type == "card_generation": continue # 跳过自己
@@ -586,38 +1380,186 @@ def _generation_logic(process_id: str):
                 "content": task.result_summary,
                 "reliability_score": task.reliability_score
             })
+    return analyzed_materials
+
+def _save_card(process_id: str, state: ProcessState, gen_task: SubTaskResult, card_json: str, card_png: bytes):
+    _write_artifact(process_id, CARD_ARTIFACTS["png"], card_png)
+    _write_artifact(process_id, CARD_ARTIFACTS["json"], card_json.encode("utf-8"))
+    
+    # 更新状态：只保存引用
+    _update_state(state, final_json=json.dumps({
+        "name": json.loads(card_json).get("name", ""),
+        "image_url": f"/api/file/card/{process_id}.png",
+        "json_url": f"/api/file/card/{process_id}.json",
+        "generated_at": time.time()
+    }, ensure_ascii=False))
+    
+    # 更新任务状态
+    _update_sub_task(state, gen_task,
+        status=TaskStatus.SUCCESS,
+        result_summary="人物卡生成完毕"
+    )
+    
+    # 标记整个流程彻底结束（提前生成时等剩余资料处理完）
+    _finish_if_idle(state)
+    _notify_callback(state, "success", "人物卡生成完毕", card=json.loads(card_json))
+
+def _fail_generation(state: ProcessState, gen_task: SubTaskResult, e: Exception):
+    print(f"[!] Generation Failed: {e}")
+    _update_sub_task(state, gen_task,
+        status=TaskStatus.FAILED,
+        result_summary=f"生成失败: {str(e)}"
+    )
+    _finish_if_idle(state)
+    _notify_callback(state, "failed", f"生成失败: {str(e)}")
+
+def validate_callback_url(url: str):
+    """
+    回调地址只能指向公网主机，或 callback.allowed_hosts 中配置的主机；不合法时抛出 ValueError
+    提交时检查一次，发送前再检查一次（防止 DNS 在两次之间被改为内网地址）
+    """
+    ensure_public_url(url, load_config().get("callback", {}).get("allowed_hosts", []))
+
+def _notify_callback(state: ProcessState, status: str, message: str, card: dict = None):
+    """
+    生成结束后把结果 POST 到 callback_url
+    在异步流水线的事件循环中发送，重试退避期间不占用任何线程（尤其是资料读取的线程池）
+    """
+    url = state.character_info.callback_url if state.character_info else None
+    if not url:
+        return
+    payload = {
+        "process_id": state.process_id,
+        "status": status,
+        "message": message,
+        "result": json.loads(state.final_json) if status == "success" and state.final_json else None,
+        "card": card,
+    }
+    _get_async_runner().run(_post_callback_async(url, payload))
+
+async def _post_callback_async(url: str, payload: dict):
+    callback_config = load_config().get("callback", {})
+    attempts = callback_config.get("attempts", 3)
+    try:
+        await asyncio.to_thread(validate_callback_url, url)
+    except ValueError as e:
+        print(f"[!] Callback for {payload['process_id']} skipped: {e}")
+        return
+
+    for attempt in range(1, attempts + 1):
+        try:
+            # 不跟随重定向：重定向目标未经过地址检查；5xx 的重试退避由 ASYNC_HTTP 处理
+            response = await ASYNC_HTTP.post(url, json=payload, timeout=callback_config.get("timeout", 10))
+            if response.status_code >= 400:
+                print(f"[!] Callback for {payload['process_id']} rejected: HTTP {response.status_code}")
+            return
+        except Exception as e:
+            error = str(e) or type(e).__name__
+        print(f"[!] Callback for {payload['process_id']} failed (attempt {attempt}/{attempts}): {error}")
+        if attempt < attempts:
+            await asyncio.sleep(2 ** attempt)
+
+def _generation_logic(process_id: str):
+    state = STATE_STORE.get(process_id)
+    character_data = state.character_info
+    
+    # 1. 聚合数据
+    analyzed_materials = _collect_materials(state)
     
     print(f"[*] Starting LLM Generation for {character_data.character_name} with {len(analyzed_materials)} materials.")
 
+    gen_task = get_generation_task(state)
+
+    def _on_partial(detail: dict):
+        # 流式模式下，每完成一个字段就推送一次，前端可以先展示 description / first_mes
+        _update_sub_task(state, gen_task, detail=detail)
+
     try:
         # 2. 调用生成函数 (这里是你需要实现的地方)
         # 你可以在这里构建 Prompt，传入 character_data 和 analyzed_materials
-        final_json_str = _mock_llm_generation(character_data, analyzed_materials)
-        
-        # 3. 更新状态
-        state.final_json = final_json_str
-        
-        # 更新任务状态
-        target_task = next(t for t in state.sub_tasks if t.step_id == "step_final_gen")
-        target_task.status = TaskStatus.SUCCESS
-        target_task.result_summary = "人物卡生成完毕"
-        
-        # 标记整个流程彻底结束
-        state.is_finished = True
-        
+        card_json, card_png = _mock_llm_generation(character_data, analyzed_materials, on_partial=_on_partial)
+        # 3. 落盘并更新状态
+        _save_card(process_id, state, gen_task, card_json, card_png)
     except Exception as e:
-        print(f"[!] Generation Failed: {e}")
-        target_task = next(t for t in state.sub_tasks if t.step_id == "step_final_gen")
-        target_task.status = TaskStatus.FAILED
-        target_task.result_summary = f"生成失败: {str(e)}"
-        state.is_finished = True
+        _fail_generation(state, gen_task, e)
+
+class _CompletionStream:
+    """
+    流式 LLM 响应的累积器：边接收边解析 JSON 字段，并统计首 token 延迟与生成速度
+    同步 / 异步两种迭代方式共用
+    """
+    def __init__(self, on_partial=None):
+        self.on_partial = on_partial
+        self.start = time.perf_counter()
+        self.first_token_at = None
+        self.chunk_count = 0
+        self.completion_tokens = None
+        self.pieces = []
+        self.parser = JsonFieldStream()
+
+    def _stats(self) -> dict:
+        now = time.perf_counter()
+        tokens = self.completion_tokens or self.chunk_count
+        gen_seconds = now - self.first_token_at if self.first_token_at else 0
+        return {
+            "ttft_seconds": round(self.first_token_at - self.start, 3) if self.first_token_at else None,
+            "tokens": tokens,
+            "tokens_per_second": round(tokens / gen_seconds, 2) if gen_seconds > 0 else None,
+            "elapsed_seconds": round(now - self.start, 3),
+        }
 
-def _mock_llm_generation(char_data: CharacterModel, materials: list) -> str:
-    with open("backend/prompts/card_genrate_prompts", "r", encoding="utf-8") as f:
-        sys_prompts = f.read()
+    def feed(self, event):
+        # 部分兼容接口会在最后一个 chunk 带上 usage
+        usage = getattr(event, "usage", None)
+        if usage and getattr(usage, "completion_tokens", None):
+            self.completion_tokens = usage.completion_tokens
+        if not event.choices:
+            return
+        delta = event.choices[0].delta.content
+        if not delta:
+            return
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        # 没有 usage 时按 chunk 数近似 token 数
+        self.chunk_count += 1
+        self.pieces.append(delta)
+
+        if self.parser.feed(delta) and self.on_partial:
+            self.on_partial({"partial": dict(self.parser.fields), **self._stats()})
+
+    def finish(self) -> str:
+        stats = self._stats()
+        print(f"[*] LLM stream finished: TTFT={stats['ttft_seconds']}s, {stats['tokens']} tokens, {stats['tokens_per_second']} tokens/s")
+        if self.on_partial:
+            self.on_partial({"partial": dict(self.parser.fields), **stats})
+        return "".join(self.pieces)
+
+def _plain_completion(model: str, messages: list) -> str:
+    response = client.chat.completions.create(
+        model=model,
+        messages=messages
+    )
+    return response.choices[0].message.content
 
-    have_image = False
-    image_path = ""
+def _stream_completion(model: str, messages: list, on_partial=None) -> str:
+    """
+    流式调用 LLM：边接收边解析 JSON 字段，并统计首 token 延迟与生成速度
+    """
+    accumulator = _CompletionStream(on_partial)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True
+    )
+    for event in stream:
+        accumulator.feed(event)
+    return accumulator.finish()
+
+def _generation_messages(char_data: CharacterModel, materials: list) -> tuple:
+    """
+    构建生成人物卡的 messages，返回 (messages, 立绘路径或 None)
+    """
+    sys_prompts = PROMPTS.get("card_genrate_prompts").text
 
     messages = []
     messages.append({"role": "system", "content": sys_prompts})
@@ -627,43 +1569,63 @@ def _mock_llm_generation(char_data: CharacterModel, materials: list) -> str:
         with open("debug/llm_generation_prompts", "w", encoding="utf-8") as f:
             f.write(sys_prompts + character_info_prompts_creator(char_data))
         
+    # 按 token 预算挑选资料内容，保证 prompt 大小与生成延迟有上限
+    llm_config = load_config().get("llm", {})
+    budget = llm_config.get("context_budget_tokens", 60000)
+    if budget > 0:
+        materials, pack_stats = pack_materials(materials, budget, llm_config.get("chunk_tokens", 800))
+        print(f"[*] Context packed: {pack_stats}")
+
     for material in materials:
         messages.append({"role": "user", "content": reference_info_prompts_creator(material)})
 
-    for r in char_data.reference:
-        if r.resource_type == "image":
-            have_image = True
-            image_path = r.resource_url
-            break
-        
+    image_path = next((r.resource_url for r in char_data.reference if r.resource_type == "image"), None)
+    return messages, image_path
 
-    response = client.chat.completions.create(
-        model=load_config().get("llm", {}).get("model", ""),
-        messages=messages
-    )
-
-    raw_text = response.choices[0].message.content
+def _render_card(raw_text: str, image_path) -> tuple:
+    """
+    从 LLM 输出中提取 JSON 并编码卡片 PNG，返回 (角色卡 JSON 字符串, 卡片 PNG 字节)
+    """
     def extract_json(text: str) -> dict:
         start = text.find("{")
         end = text.rfind("}")
         if start == -1 or end == -1:
             raise ValueError("No JSON object found")
         return json.loads(text[start:end + 1])
-    
 
     card_dict = extract_json(raw_text)
     json_str = json.dumps(card_dict, ensure_ascii=False, indent=4)
 
-    if have_image:
-        image = resize_image(image_path)
+    compress_level = load_config().get("card_image", {}).get("compress_level", 6)
+    if image_path:
+        output_image = save_png(resize_image(image_path), json_str, compress_level=compress_level)
     else:
-        image = blank_image()
+        output_image = blank_card_png(json_str, compress_level=compress_level)
 
-    output_image = save_png(image, json_str)
+    return json_str, output_image
 
-    output_image = base64.b64encode(output_image).decode("utf-8")
+def _mock_llm_generation(char_data: CharacterModel, materials: list, on_partial=None) -> tuple:
+    """
+    返回 (角色卡 JSON 字符串, 卡片 PNG 字节)
+    """
+    messages, image_path = _generation_messages(char_data, materials)
+    llm_config = load_config().get("llm", {})
 
-    return json.dumps({"json": json_str,"image": output_image}, ensure_ascii=False, indent=4)
+    model = llm_config.get("model", "")
+
+    rate_limit("llm")
+    if llm_config.get("stream", False):
+        try:
+            raw_text = _stream_completion(model, messages, on_partial)
+        except Exception as e:
+            # 部分兼容接口不支持流式，或中途断流：退回普通请求
+            print(f"[!] LLM stream failed, retrying without stream: {e}")
+            rate_limit("llm")
+            raw_text = _plain_completion(model, messages)
+    else:
+        raw_text = _plain_completion(model, messages)
+
+    return _render_card(raw_text, image_path)
 
 # ==========================================
 # 4. 重试逻辑
@@ -673,10 +1635,22 @@ def retry_subtask(process_id: str, step_id: str) -> bool:
     """
     重试指定的子任务
     """
-    state = MOCK_DB.get(process_id)
+    state = STATE_STORE.get(process_id)
     if not state:
         raise ValueError("Process ID not found")
 
+    if not _retryable_sub_task(state, step_id):
+        return False
+    if CLUSTER:
+        # 由持有该任务租约的 worker 执行重试
+        CLUSTER.submit(process_id, "retry", {"step_id": step_id})
+        return True
+    return _retry_subtask_local(process_id, step_id)
+
+def _retryable_sub_task(state: ProcessState, step_id: str):
+    """
+    返回可重试的子任务（状态为FAILED且重试次数未超限），否则返回 None
+    """
     # 查找要重试的任务
     task_to_retry = None
     for task in state.sub_tasks:
@@ -685,140 +1659,318 @@ def retry_subtask(process_id: str, step_id: str) -> bool:
             break
 
     if not task_to_retry:
-        return False
+        return None
 
-    # 检查任务是否可重试（状态为FAILED且重试次数未超限）
     if task_to_retry.status != TaskStatus.FAILED:
-        return False
+        return None
 
     if task_to_retry.retry_count >= task_to_retry.max_retries:
+        return None
+    return task_to_retry
+
+def _retry_subtask_local(process_id: str, step_id: str) -> bool:
+    state = STATE_STORE.get(process_id)
+    task_to_retry = _retryable_sub_task(state, step_id)
+    if not task_to_retry:
         return False
 
     # 重置任务状态
-    task_to_retry.status = TaskStatus.PROCESSING
-    task_to_retry.retry_count += 1
-    task_to_retry.last_error = None
-
-    # 启动后台线程执行重试
-    t = threading.Thread(
-        target=_retry_task_logic,
-        args=(process_id, step_id, state.character_info)
+    last_error = task_to_retry.last_error
+    _update_sub_task(state, task_to_retry,
+        status=TaskStatus.PROCESSING,
+        retry_count=task_to_retry.retry_count + 1,
+        last_error=None
     )
-    t.start()
+
+    # 交给调度器执行重试，队列满时撤销状态并抛出 SchedulerFullError
+    try:
+        _submit_job(f"retry:{process_id}:{step_id}", _retry_task_logic, _retry_task_logic_async, process_id, step_id, state.character_info)
+    except SchedulerFullError:
+        _update_sub_task(state, task_to_retry,
+            status=TaskStatus.FAILED,
+            retry_count=task_to_retry.retry_count - 1,
+            last_error=last_error
+        )
+        raise
 
     return True
 
-def _retry_task_logic(process_id: str, step_id: str, character_data: CharacterModel):
+def _find_retry_target(state: ProcessState, step_id: str, character_data: CharacterModel):
     """
-    重试单个任务的逻辑
+    返回 (task_def, sub_task)；找不到时返回 (None, None)
     """
-    current_config = load_config()
-    state = MOCK_DB[process_id]
-
     # 查找任务定义（从原始数据中）
     task_def = None
     for idx, ref in enumerate(character_data.reference):
         if f"step_ref_{idx}" == step_id:
-            # 重建任务定义
-            title = ""
-            t_type = ""
-            if ref.resource_type == "image":
-                title = f"视觉分析: {ref.file_name or 'Image'}"
-                t_type = "image_analysis"
-            elif ref.resource_type == "file":
-                title = f"文档处理: {ref.file_name or 'Document'}"
-                t_type = "doc_analysis"
-            elif ref.resource_type == "url":
-                title = f"链接读取: {ref.resource_url}"
-                t_type = "link_crawl"
-            elif ref.resource_type == "search":
-                title = f"网络搜索: {character_data.character_name}"
-                t_type = "search"
-
-            task_def = {
-                "step_id": step_id,
-                "title": title,
-                "type": t_type,
-                "payload": {"ref_obj": ref}
-            }
+            task_def = _build_task_def(idx, ref, character_data)
             break
 
     if not task_def:
         print(f"[!] Task definition not found for step_id: {step_id}")
+        return None, None
+
+    sub_task = next((t for t in state.sub_tasks if t.step_id == step_id), None)
+    if not sub_task:
+        return None, None
+    return task_def, sub_task
+
+def _retry_task_logic(process_id: str, step_id: str, character_data: CharacterModel):
+    """
+    重试单个任务的逻辑
+    """
+    current_config = load_config()
+    state = STATE_STORE.get(process_id)
+
+    task_def, sub_task = _find_retry_target(state, step_id, character_data)
+    if not task_def:
         return
 
-    # 执行任务
-    try:
-        result_content = ""
+    def _on_retry_done(_):
+        if sub_task.status == TaskStatus.SUCCESS:
+            print(f"[*] Task {step_id} retry successful")
 
-        # === 分支处理逻辑 ===
-        if task_def["type"] == "image_analysis":
-            image_path = task_def["payload"]["ref_obj"].resource_url
-            print(f"[*] Retrying Image: {image_path}")
+    # 与首次处理共用线程池，保持相同的并发上限
+    future = _submit_sub_task(state, task_def, sub_task, current_config)
+    future.add_done_callback(_on_retry_done)
 
-            res = image_reader(
-                image_path=image_path,
-                config=current_config,
-                type="deepdanbooru"
-            )
 
-            if res["status"] == "success":
-                result_content = res["content"]
-            else:
-                raise Exception(res["message"])
+# ==========================================
+# 5. 异步流水线 (Async Pipeline)
+# ==========================================
+# pipeline.mode = "async" 时使用：每个任务是 ASYNC_RUNNER 事件循环中的一个协程，
+# 子任务用 asyncio.TaskGroup 并发执行；网络请求走 ASYNC_HTTP / async_client，
+# 只有文档解析、图片编码、缓存读写等 CPU / 磁盘工作卸载到线程
+# 状态读写、缓存键、prompt、结果格式与线程版完全共用，两种模式可以随时切换
+
+async def _run_reference_task_async(task_def: dict, current_config: dict) -> str:
+    ref = task_def["payload"]["ref_obj"]
+
+    cache_key, cached = await asyncio.to_thread(_reader_cache_lookup, task_def, current_config)
+    if cached is not None:
+        return cached
+
+    if task_def["type"] == "image_analysis":
+        print(f"[*] Processing Image: {ref.resource_url}")
+        res = await image_reader_async(
+            image_path=ref.resource_url,
+            config=current_config,
+            type=current_config.get("image_reader", {}).get("type", "deepdanbooru")
+        )
+    elif task_def["type"] == "link_crawl":
+        print(f"[*] Crawling URL: {ref.resource_url}")
+        res = await url_reader_async(
+            url=ref.resource_url,
+            config=current_config,
+            type="jina"
+        )
+    elif task_def["type"] == "doc_analysis":
+        # 文档解析是 CPU 密集型，与线程版共用 CPU_EXECUTOR 的并发上限
+        res = await asyncio.get_running_loop().run_in_executor(
+            CPU_EXECUTOR, doc_reader, ref.resource_url, current_config
+        )
+    else:
+        raise Exception(f"Unknown task type: {task_def['type']}")
 
-        elif task_def["type"] == "link_crawl":
-            target_url = task_def["payload"]["ref_obj"].resource_url
-            print(f"[*] Retrying URL: {target_url}")
+    return await asyncio.to_thread(_reader_content, res, cache_key)
 
-            res = url_reader(
-                url=target_url,
-                config=current_config,
-                type="jina"
-            )
+async def _summarize_chunk_async(chunk: str, index: int, total: int, char_info: str, model: str,
+                                 limit: asyncio.Semaphore) -> str:
+    async with limit:
+        await rate_limit_async("llm")
+        response = await async_client.chat.completions.create(
+            model=model,
+            messages=_summary_messages(chunk, index, total, char_info)
+        )
+    return response.choices[0].message.content or ""
 
-            if res["status"] == "success":
-                result_content = res["content"]
-            else:
-                raise Exception(res["message"])
+async def summarize_material_async(content: str, char_data: CharacterModel, current_config: dict, depth: int = 0) -> str:
+    """
+    summarize_material 的异步版本：各片段用 asyncio.gather 并发，并发数同 summarizer.max_workers
+    """
+    summarizer_config = current_config.get("summarizer", {})
+    threshold = summarizer_config.get("threshold_tokens", 8000)
+    chunk_tokens = summarizer_config.get("chunk_tokens", 3000)
+    model = summarizer_config.get("model") or current_config.get("llm", {}).get("model", "")
+
+    chunks = await asyncio.to_thread(split_passages, content, chunk_tokens)
+    char_info = character_info_prompts_creator(char_data)
+    print(f"[*] Summarizing {len(chunks)} chunks (~{estimate_tokens(content)} tokens)")
+
+    limit = _async_limit("summarizer", summarizer_config.get("max_workers", 4))
+    results = await asyncio.gather(*[
+        _summarize_chunk_async(chunk, i + 1, len(chunks), char_info, model, limit)
+        for i, chunk in enumerate(chunks)
+    ], return_exceptions=True)
+
+    summaries = []
+    for i, result in enumerate(results):
+        if isinstance(result, Exception):
+            # 单个片段失败时保留原文，不丢信息
+            print(f"[!] Chunk {i + 1} summary failed: {result}")
+            summary = chunks[i]
+        else:
+            summary = result.strip()
+        if summary and summary != "无相关内容":
+            summaries.append(summary)
+
+    merged = "\n\n".join(summaries)
+    if depth == 0 and len(chunks) > 1 and estimate_tokens(merged) > threshold:
+        return await summarize_material_async(merged, char_data, current_config, depth + 1)
+    return merged
+
+async def _execute_sub_task_async(state: ProcessState, task_def: dict, sub_task: SubTaskResult, current_config: dict):
+    """
+    单个子任务协程；异常全部转成失败结果，不会取消同一 TaskGroup 中的其他子任务
+    """
+    # 网络型子任务的总并发上限，避免几百个任务同时打到同一个外部服务
+    limit = _async_limit("network", current_config.get("pipeline", {}).get("network_concurrency", 64))
+    if task_def["type"] == "search":
+        ref = task_def["payload"]["ref_obj"]
+        # 只有创建请求占用并发名额；之后由共享的 RESEARCH_POLLER 轮询（去重 + 缓存），这里只等待其 Future
+        async with limit:
+            _update_sub_task(state, sub_task, status=TaskStatus.PROCESSING)
+            try:
+                research_future = await asyncio.to_thread(
+                    search_reader_async, ref.resource_url, current_config, "google-deepresearch", ref.bypass_cache
+                )
+            except Exception as e:
+                research_future = _resolved({"status": "error", "message": str(e)})
+        try:
+            res = await asyncio.wrap_future(research_future)
+        except Exception as e:
+            res = {"status": "error", "message": str(e)}
+        _finish_sub_task(state, sub_task, res)
+        return
 
-        elif task_def["type"] == "doc_analysis":
-            doc_path = task_def["payload"]["ref_obj"].resource_url
-            res = doc_reader(
-                doc_path=doc_path,
-            )
-            if res["status"] == "success":
-                result_content = res["content"]
-            else:
-                raise Exception(res["message"])
+    async with limit:
+        _update_sub_task(state, sub_task, status=TaskStatus.PROCESSING)
+        try:
+            content = await _run_reference_task_async(task_def, current_config)
+            if _needs_summary(task_def, content, current_config):
+                original_tokens = estimate_tokens(content)
+                content = await summarize_material_async(content, state.character_info, current_config)
+                _update_sub_task(state, sub_task, detail={
+                    "summarized": True,
+                    "original_tokens": original_tokens,
+                    "summary_tokens": estimate_tokens(content),
+                })
+            res = {"status": "success", "content": content}
+        except Exception as e:
+            res = {"status": "error", "message": str(e)}
+    _finish_sub_task(state, sub_task, res)
+
+async def _run_sub_tasks_async(state: ProcessState, planned: list, current_config: dict, gate: list = None):
+    async with asyncio.TaskGroup() as group:
+        tasks = [
+            group.create_task(_execute_sub_task_async(state, task_def, sub_task, current_config))
+            for task_def, sub_task in planned
+        ]
+        if gate is not None:
+            group.create_task(_auto_generate_after_async(state, [tasks[i] for i in gate]))
+
+async def _auto_generate_after_async(state: ProcessState, tasks: list):
+    if tasks:
+        await asyncio.wait(tasks)
+    _start_auto_generation(state)
+
+async def _processing_logic_async(process_id: str, data: CharacterModel):
+    _REFERENCES_RUNNING.add(process_id)
+    current_config = load_config()
+    current_state = STATE_STORE.get(process_id)
 
-        elif task_def["type"] == "search":
-            res = search_reader(
-                query=task_def["payload"]["ref_obj"].resource_url,
-                config=current_config,
-                type="google-deepresearch"
-            )
+    planned = _plan_sub_tasks(current_state, data)
+    await _run_sub_tasks_async(current_state, planned, current_config, _early_generation_gate(data, planned))
 
-            if res["status"] == "success":
-                result_content = res["content"]
-            else:
-                raise Exception(res["message"])
+    _finish_processing(current_state)
 
-        # === 任务成功 ===
-        # 更新任务状态
-        for task in state.sub_tasks:
-            if task.step_id == step_id:
-                task.status = TaskStatus.SUCCESS
-                task.result_summary = result_content
-                print(f"[*] Task {step_id} retry successful")
-                break
+async def _resume_logic_async(process_id: str):
+    state = STATE_STORE.get(process_id)
+    data = state.character_info
+
+    if not state.sub_tasks:
+        await _processing_logic_async(process_id, data)
+        return
+
+    _REFERENCES_RUNNING.add(process_id)
+    current_config = load_config()
+    planned = _unfinished_sub_tasks(state, data)
+    gen_task = get_generation_task(state)
+    gate = _early_generation_gate(data, planned) if gen_task is None else None
+    await _run_sub_tasks_async(state, planned, current_config, gate)
+
+    if gen_task and gen_task.status == TaskStatus.PROCESSING:
+        # 中断时正在生成人物卡，直接在当前协程中重新生成
+        with _FINISH_LOCK:
+            _REFERENCES_RUNNING.discard(process_id)
+        await _generation_logic_async(process_id)
+    else:
+        _finish_processing(state)
+
+async def _plain_completion_async(model: str, messages: list) -> str:
+    response = await async_client.chat.completions.create(
+        model=model,
+        messages=messages
+    )
+    return response.choices[0].message.content
+
+async def _stream_completion_async(model: str, messages: list, on_partial=None) -> str:
+    accumulator = _CompletionStream(on_partial)
+    stream = await async_client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True
+    )
+    async for event in stream:
+        accumulator.feed(event)
+    return accumulator.finish()
+
+async def _mock_llm_generation_async(char_data: CharacterModel, materials: list, on_partial=None) -> tuple:
+    # 资料打包（分词估算）与 PNG 编码是 CPU 工作，放到线程中
+    messages, image_path = await asyncio.to_thread(_generation_messages, char_data, materials)
+    llm_config = load_config().get("llm", {})
+
+    model = llm_config.get("model", "")
+
+    await rate_limit_async("llm")
+    if llm_config.get("stream", False):
+        try:
+            raw_text = await _stream_completion_async(model, messages, on_partial)
+        except Exception as e:
+            print(f"[!] LLM stream failed, retrying without stream: {e}")
+            await rate_limit_async("llm")
+            raw_text = await _plain_completion_async(model, messages)
+    else:
+        raw_text = await _plain_completion_async(model, messages)
+
+    return await asyncio.to_thread(_render_card, raw_text, image_path)
+
+async def _generation_logic_async(process_id: str):
+    state = STATE_STORE.get(process_id)
+    character_data = state.character_info
+    analyzed_materials = _collect_materials(state)
+
+    print(f"[*] Starting LLM Generation for {character_data.character_name} with {len(analyzed_materials)} materials.")
+
+    gen_task = get_generation_task(state)
 
+    def _on_partial(detail: dict):
+        _update_sub_task(state, gen_task, detail=detail)
+
+    try:
+        card_json, card_png = await _mock_llm_generation_async(character_data, analyzed_materials, on_partial=_on_partial)
+        await asyncio.to_thread(_save_card, process_id, state, gen_task, card_json, card_png)
     except Exception as e:
-        # === 任务失败 ===
-        print(f"[!] Task retry failed: {e}")
-        for task in state.sub_tasks:
-            if task.step_id == step_id:
-                task.status = TaskStatus.FAILED
-                task.result_summary = f"Error (Retry {task.retry_count}/{task.max_retries}): {str(e)}"
-                task.last_error = str(e)
-                break
\ No newline at end of file
+        _fail_generation(state, gen_task, e)
+
+async def _retry_task_logic_async(process_id: str, step_id: str, character_data: CharacterModel):
+    current_config = load_config()
+    state = STATE_STORE.get(process_id)
+
+    task_def, sub_task = _find_retry_target(state, step_id, character_data)
+    if not task_def:
+        return
+
+    await _execute_sub_task_async(state, task_def, sub_task, current_config)
+    if sub_task.status == TaskStatus.SUCCESS:
+        print(f"[*] Task {step_id} retry successful")
@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# ==========================================
+# 读取结果缓存 (Content-Addressed Result Cache)
+# ==========================================
+
+def url_key(reader: str, url: str) -> str:
+    """
+    URL 类资料按 reader + URL 生成键
+    """
+    return hashlib.sha256(f"{reader}\n{url}".encode("utf-8")).hexdigest()
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def file_key(reader: str, path: str, sha256: str = None) -> str:
+    """
+    文件类资料按 reader + 文件内容的 SHA-256 生成键，同一份文件换个名字也能命中
+    已知内容哈希（上传时计算过）时直接使用，不再读文件
+    """
+    return hashlib.sha256(f"{reader}\n{sha256 or file_sha256(path)}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """
+    磁盘缓存，每个条目一个 JSON 文件：<root>/<key[:2]>/<key>.json
+    - 总大小超过 max_bytes 时按最近访问时间淘汰（LRU），访问时间记录在文件 mtime 上
+    - get 时可传入 ttl，超时的条目视为未命中（用于 URL 这类会变化的资料）
+    """
+    def __init__(self, root: str, max_bytes: int = 512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index = {}
+        self._total_bytes = 0
+
+        os.makedirs(root, exist_ok=True)
+        self._load_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def _load_index(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".json"):
+                    continue
+                st = os.stat(os.path.join(dirpath, name))
+                self._index[name[:-5]] = (st.st_size, st.st_mtime)
+                self._total_bytes += st.st_size
+
+    def get(self, key: str, ttl: float = None):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if ttl is not None and time.time() - entry.get("created_at", 0) > ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index[key] = (self._index[key][0], now)
+        return entry.get("content")
+
+    def set(self, key: str, content: str):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created_at": time.time(), "content": content}, ensure_ascii=False).encode("utf-8")
+
+        # 先写临时文件再替换，避免并发读到半个文件
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            old = self._index.get(key)
+            if old:
+                self._total_bytes -= old[0]
+            self._index[key] = (len(data), time.time())
+            self._total_bytes += len(data)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        if self._total_bytes <= self.max_bytes:
+            return
+        for key, (size, _) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            if self._total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            del self._index[key]
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._index),
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -0,0 +1,255 @@
+import time
+import queue
+import asyncio
+import threading
+import itertools
+from collections import deque
+
+# ==========================================
+# 全局任务调度器 (Job Scheduler)
+# ==========================================
+
+class SchedulerFullError(Exception):
+    """
+    队列已满时抛出，router 层转换为 429
+    """
+    def __init__(self, queue_depth: int, max_queue: int):
+        self.queue_depth = queue_depth
+        self.max_queue = max_queue
+        # 如果此刻排队，会排在第几个
+        self.queue_position = queue_depth + 1
+        super().__init__(f"Scheduler is saturated ({queue_depth}/{max_queue} jobs queued)")
+
+
+class RateLimiter:
+    """
+    令牌桶限流：rate 为每秒允许的请求数，burst 为可累积的最大令牌数
+    rate <= 0 表示不限流
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.total_wait = 0.0
+        self.acquired = 0
+
+    def _take(self) -> float:
+        """
+        尝试取一个令牌：成功返回 0，否则返回需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.acquired += 1
+                return 0
+            sleep_for = (1 - self._tokens) / self.rate
+            self.total_wait += sleep_for
+            return sleep_for
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while (sleep_for := self._take()) > 0:
+            time.sleep(sleep_for)
+
+    async def acquire_async(self):
+        """
+        异步流水线使用：等待令牌时让出事件循环，而不是阻塞线程
+        """
+        if self.rate <= 0:
+            return
+        while (sleep_for := self._take()) > 0:
+            await asyncio.sleep(sleep_for)
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "acquired": self.acquired,
+            "total_wait_seconds": round(self.total_wait, 3),
+        }
+
+
+class JobScheduler:
+    """
+    固定数量的工作线程 + 有界队列
+    队列满时拒绝新任务（准入控制），而不是无限制地创建线程
+    处理任务把子任务投递到线程池 / 研究轮询器后即返回，不会因为长时间的 deep research 占住工作线程
+    """
+    def __init__(self, workers: int = 4, max_queue: int = 32):
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._waits = deque(maxlen=200)
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._threads = []
+
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker_loop, name=f"job_worker_{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, name: str, fn, *args, limit: int = None) -> int:
+        """
+        投递任务，返回其在队列中的位置；队列已满时抛出 SchedulerFullError
+        limit 为该类任务可用的排队上限（例如批量任务），超过时同样拒绝，给其他任务留出队列
+        """
+        job = {
+            "job_id": next(self._ids),
+            "name": name,
+            "fn": fn,
+            "args": args,
+            "enqueued_at": time.monotonic(),
+        }
+        with self._lock:
+            if limit is not None and self._queue.qsize() >= limit:
+                self._rejected += 1
+                raise SchedulerFullError(self._queue.qsize(), limit)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._rejected += 1
+                raise SchedulerFullError(self._queue.qsize(), self.max_queue)
+            self._submitted += 1
+            return self._queue.qsize()
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            wait = time.monotonic() - job["enqueued_at"]
+            with self._lock:
+                self._waits.append(wait)
+                self._running += 1
+            try:
+                job["fn"](*job["args"])
+                with self._lock:
+                    self._completed += 1
+            except Exception as e:
+                print(f"[!] Job {job['name']} crashed: {e}")
+                with self._lock:
+                    self._failed += 1
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._queue.task_done()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            }
+
+
+class AsyncJobRunner:
+    """
+    异步流水线的调度器：一个专用线程运行事件循环，所有任务以协程的形式在其中执行
+    - max_jobs 限制同时运行的任务数，其余在循环内排队；排队数超过 max_queue 时拒绝（与 JobScheduler 一致）
+    - 任务在等待网络 / LLM 时不占用线程，几百个任务也只需要一个线程加少量卸载 CPU 工作的线程
+    - submit() 可以从任意线程调用（路由、启动恢复、线程池回调）
+    """
+    def __init__(self, max_jobs: int = 256, max_queue: int = 1024):
+        self.max_jobs = max(1, max_jobs)
+        self.max_queue = max(1, max_queue)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._waits = deque(maxlen=200)
+        self._queued = 0
+        self._running = 0
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+
+        self.loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._loop_main, name="async_pipeline", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def _loop_main(self):
+        asyncio.set_event_loop(self.loop)
+        # 信号量必须在所属的事件循环中创建
+        self._slots = asyncio.Semaphore(self.max_jobs)
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+
+    def submit(self, name: str, coro_fn, *args, limit: int = None) -> int:
+        """
+        投递协程函数 coro_fn(*args)，返回排队位置；排队已满（或超过该类任务的 limit）时抛出 SchedulerFullError
+        """
+        with self._lock:
+            max_queue = self.max_queue if limit is None else min(limit, self.max_queue)
+            if self._queued >= max_queue:
+                self._rejected += 1
+                raise SchedulerFullError(self._queued, max_queue)
+            self._queued += 1
+            self._submitted += 1
+            position = self._queued
+        job = {
+            "job_id": next(self._ids),
+            "name": name,
+            "enqueued_at": time.monotonic(),
+        }
+        asyncio.run_coroutine_threadsafe(self._run(job, coro_fn, args), self.loop)
+        return position
+
+    async def _run(self, job: dict, coro_fn, args: tuple):
+        async with self._slots:
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._waits.append(time.monotonic() - job["enqueued_at"])
+            try:
+                await coro_fn(*args)
+                with self._lock:
+                    self._completed += 1
+            except Exception as e:
+                print(f"[!] Job {job['name']} crashed: {e}")
+                with self._lock:
+                    self._failed += 1
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+    def run(self, coro):
+        """
+        在事件循环中执行 coro，返回 concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            waits = list(self._waits)
+            return {
+                "max_jobs": self.max_jobs,
+                "running": self._running,
+                "queue_depth": self._queued,
+                "max_queue": self.max_queue,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_seconds": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "max_wait_seconds": round(max(waits), 3) if waits else 0.0,
+            }
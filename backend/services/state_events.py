@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+
+# ==========================================
+# 状态变更日志 (Change Journal)
+# ==========================================
+
+class ChangeJournal:
+    """
+    每个 process 维护一个单调递增的版本号和最近的变更事件
+    前端带着 since=<version> 拉取增量；太旧的版本已被丢弃时返回 None，调用方改发完整快照
+
+    事件格式：
+        {"version": 3, "type": "sub_task_added",   "step_id": "...", "data": {完整子任务}}
+        {"version": 4, "type": "sub_task_updated", "step_id": "...", "data": {变化的字段}}
+        {"version": 5, "type": "sub_task_removed", "step_id": "..."}
+        {"version": 6, "type": "state_updated",    "data": {变化的字段}}
+    """
+    def __init__(self, max_events: int = 500, restart_gap: int = 1000):
+        self.max_events = max_events
+        # 状态是批量落盘的，重启后读到的 version 可能比客户端已经收到的小；
+        # 从存储载入的任务跳过一段版本号再继续编号，新事件不会与客户端已应用过的版本重号
+        self.restart_gap = restart_gap
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._events = {}
+
+    def _seed_locked(self, state) -> int:
+        current = self._versions.get(state.process_id)
+        if current is None:
+            if state.version > 0:
+                # 本进程第一次见到这个任务：服务重启或接手了其他 worker 的任务
+                state.version += self.restart_gap
+            current = self._versions[state.process_id] = state.version
+        return current
+
+    def seed(self, state):
+        """
+        从 state.version 初始化该任务的版本号（已登记时不做任何事）
+        """
+        with self._lock:
+            self._seed_locked(state)
+
+    def record(self, state, event: dict) -> int:
+        """
+        记录一条事件，并把新版本号写回 state.version
+        """
+        with self._lock:
+            version = self._seed_locked(state) + 1
+            self._versions[state.process_id] = version
+            event["version"] = version
+            self._events.setdefault(state.process_id, deque(maxlen=self.max_events)).append(event)
+            state.version = version
+            return version
+
+    def version(self, process_id: str) -> int:
+        with self._lock:
+            return self._versions.get(process_id, 0)
+
+    def since(self, process_id: str, version: int):
+        """
+        返回 version 之后的事件列表；无法补齐时返回 None
+        客户端的版本比当前还新（服务重启过）或本进程没有该任务的记录时也返回 None，让客户端改取快照
+        """
+        with self._lock:
+            current = self._versions.get(process_id)
+            if current is None or version > current:
+                return None
+            if version == current:
+                return []
+            events = self._events.get(process_id)
+            if not events or events[0]["version"] > version + 1:
+                return None
+            return [e for e in events if e["version"] > version]
+
+    def drop(self, process_id: str):
+        with self._lock:
+            self._versions.pop(process_id, None)
+            self._events.pop(process_id, None)
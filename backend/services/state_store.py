@@ -0,0 +1,410 @@
+import os
+import time
+import sqlite3
+import threading
+from models import ProcessState, TaskStatus
+
+# ==========================================
+# 任务状态存储 (State Store)
+# ==========================================
+
+class MemoryStateStore:
+    """
+    纯内存存储：进程重启后状态丢失，只做 TTL 淘汰
+    所有读取都直接命中内存字典，子类在此基础上增加持久化
+    """
+    def __init__(self, ttl_seconds: float = 72 * 3600, sweep_interval: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._cache = {}
+        self._touched = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        # 淘汰回调，例如同时清理变更日志
+        self.on_evict = None
+
+    def get(self, process_id: str):
+        return self._cache.get(process_id)
+
+    def owns(self, process_id: str) -> bool:
+        """
+        本进程是否负责该任务（单 worker 部署时总是 True）
+        """
+        return True
+
+    def put(self, state: ProcessState):
+        with self._lock:
+            self._cache[state.process_id] = state
+            self._touched[state.process_id] = time.time()
+        self.mark_dirty(state)
+
+    def delete(self, process_id: str):
+        with self._lock:
+            self._cache.pop(process_id, None)
+            self._touched.pop(process_id, None)
+
+    def mark_dirty(self, state: ProcessState):
+        self._touched[state.process_id] = time.time()
+        if time.time() - self._last_sweep > self.sweep_interval:
+            self.evict_expired()
+
+    def load_unfinished(self) -> list:
+        return []
+
+    def flush(self):
+        pass
+
+    def evict_expired(self) -> list:
+        """
+        淘汰已完成且超过 TTL 未更新的任务，返回被淘汰的 process_id
+        """
+        self._last_sweep = time.time()
+        if self.ttl_seconds <= 0:
+            return []
+        deadline = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [
+                pid for pid, state in self._cache.items()
+                if state.is_finished and self._touched.get(pid, 0) < deadline
+            ]
+            for pid in expired:
+                self._cache.pop(pid, None)
+                self._touched.pop(pid, None)
+        if expired:
+            print(f"[*] Evicted {len(expired)} expired processes")
+            if self.on_evict:
+                for pid in expired:
+                    self.on_evict(pid)
+        return expired
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """
+    SQLite(WAL) 持久化 + 内存热缓存
+    - 读取优先命中热缓存，未命中时才查库（例如重启后查询旧任务）
+    - 子任务更新只标记 dirty，由后台线程按 flush_interval 批量写入一个事务
+    - 重启后可通过 load_unfinished() 取回崩溃时仍在处理中的任务
+    """
+    def __init__(self, path: str, ttl_seconds: float = 72 * 3600,
+                 flush_interval: float = 0.5, sweep_interval: float = 60):
+        super().__init__(ttl_seconds=ttl_seconds, sweep_interval=sweep_interval)
+        self.path = path
+        self.flush_interval = flush_interval
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS processes (
+                process_id TEXT PRIMARY KEY,
+                is_finished INTEGER NOT NULL,
+                updated_at REAL NOT NULL,
+                state TEXT NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="state_flusher", daemon=True)
+        self._flusher.start()
+
+    def get(self, process_id: str):
+        state = self._cache.get(process_id)
+        if state is not None:
+            return state
+
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT state FROM processes WHERE process_id = ?", (process_id,)
+            ).fetchone()
+        if not row:
+            return None
+        state = ProcessState.model_validate_json(row[0])
+        with self._lock:
+            # 并发加载时保留先放入缓存的那个对象
+            state = self._cache.setdefault(process_id, state)
+            self._touched.setdefault(process_id, time.time())
+        return state
+
+    def delete(self, process_id: str):
+        super().delete(process_id)
+        with self._dirty_lock:
+            self._dirty.discard(process_id)
+        with self._db_lock:
+            self._conn.execute("DELETE FROM processes WHERE process_id = ?", (process_id,))
+            self._conn.commit()
+
+    def mark_dirty(self, state: ProcessState):
+        self._touched[state.process_id] = time.time()
+        with self._dirty_lock:
+            self._dirty.add(state.process_id)
+
+    def flush(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return
+
+        rows = []
+        for pid in dirty:
+            state = self._cache.get(pid)
+            if state is None:
+                continue
+            try:
+                rows.append((pid, int(state.is_finished), self._touched.get(pid, time.time()), state.model_dump_json()))
+            except Exception as e:
+                # 序列化时恰好有其他线程在修改，留到下一轮
+                print(f"[!] State serialize failed for {pid}: {e}")
+                with self._dirty_lock:
+                    self._dirty.add(pid)
+
+        with self._db_lock:
+            self._conn.executemany("""
+                INSERT INTO processes (process_id, is_finished, updated_at, state)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(process_id) DO UPDATE SET
+                    is_finished = excluded.is_finished,
+                    updated_at = excluded.updated_at,
+                    state = excluded.state
+            """, rows)
+            self._conn.commit()
+
+    def load_unfinished(self) -> list:
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT state FROM processes WHERE is_finished = 0"
+            ).fetchall()
+        states = []
+        for (raw,) in rows:
+            state = ProcessState.model_validate_json(raw)
+            with self._lock:
+                state = self._cache.setdefault(state.process_id, state)
+                self._touched[state.process_id] = time.time()
+            states.append(state)
+        return states
+
+    def evict_expired(self) -> list:
+        expired = super().evict_expired()
+        if self.ttl_seconds <= 0:
+            return expired
+        # 只在库中的任务（例如重启前完成的）同样要触发淘汰回调；仍在热缓存中的不删
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT process_id FROM processes WHERE is_finished = 1 AND updated_at < ?",
+                (time.time() - self.ttl_seconds,)
+            ).fetchall()
+            db_only = [pid for (pid,) in rows if pid not in self._cache and pid not in expired]
+            self._conn.executemany(
+                "DELETE FROM processes WHERE process_id = ?",
+                [(pid,) for pid in expired + db_only]
+            )
+            self._conn.commit()
+        if db_only:
+            print(f"[*] Evicted {len(db_only)} expired processes from disk")
+            if self.on_evict:
+                for pid in db_only:
+                    self.on_evict(pid)
+        return expired + db_only
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.time() - self._last_sweep > self.sweep_interval:
+                    self.evict_expired()
+            except Exception as e:
+                print(f"[!] State flush failed: {e}")
+
+
+def is_idle(state: ProcessState) -> bool:
+    """
+    流程已结束且没有等待 / 执行中的子任务（例如重试）
+    """
+    return state.is_finished and not any(
+        t.status in (TaskStatus.PENDING, TaskStatus.PROCESSING) for t in state.sub_tasks
+    )
+
+
+class SharedStateStore(MemoryStateStore):
+    """
+    多 worker / 多机部署：状态存放在共享后端（services.cluster）
+    - 持有租约的 worker 通过 adopt() 把任务载入本地缓存，修改后由后台线程批量写回
+    - 其他 worker 读取共享后端中的快照（snapshot_ttl 秒内复用，状态轮询不会打满后端）
+    - 租约丢失的任务被 fence()，之后本进程对它的修改直接丢弃，不会覆盖新持有者的进度
+    """
+    def __init__(self, backend, ttl_seconds: float = 72 * 3600, flush_interval: float = 0.5,
+                 snapshot_ttl: float = 0.25, sweep_interval: float = 60):
+        super().__init__(ttl_seconds=ttl_seconds, sweep_interval=sweep_interval)
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.snapshot_ttl = snapshot_ttl
+        self._snapshots = {}
+        self._fenced = set()
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name="state_flusher", daemon=True)
+        self._flusher.start()
+
+    # --- 租约相关 ---
+
+    def owns(self, process_id: str) -> bool:
+        return process_id in self._cache
+
+    def owned_ids(self) -> list:
+        with self._lock:
+            return list(self._cache)
+
+    def is_idle(self, process_id: str) -> bool:
+        state = self._cache.get(process_id)
+        return state is None or is_idle(state)
+
+    def idle_for(self, process_id: str) -> float:
+        return time.time() - self._touched.get(process_id, 0)
+
+    def adopt(self, process_id: str):
+        """
+        拿到租约后调用：从共享后端载入最新状态作为本地权威副本
+        """
+        raw = self.backend.load_state(process_id)
+        if raw is None:
+            return None
+        state = ProcessState.model_validate_json(raw)
+        with self._lock:
+            self._cache[process_id] = state
+            self._touched[process_id] = time.time()
+            self._snapshots.pop(process_id, None)
+            self._fenced.discard(process_id)
+        return state
+
+    def release(self, process_id: str):
+        """
+        释放租约前调用：写回最后的修改并从本地缓存移除
+        """
+        self.flush()
+        with self._lock:
+            self._cache.pop(process_id, None)
+            self._touched.pop(process_id, None)
+
+    def fence(self, process_id: str):
+        with self._lock:
+            self._cache.pop(process_id, None)
+            self._touched.pop(process_id, None)
+            self._fenced.add(process_id)
+        with self._dirty_lock:
+            self._dirty.discard(process_id)
+
+    # --- 状态读写 ---
+
+    def get(self, process_id: str):
+        state = self._cache.get(process_id)
+        if state is not None:
+            return state
+
+        snapshot = self._snapshots.get(process_id)
+        if snapshot and time.monotonic() - snapshot[1] < self.snapshot_ttl:
+            return snapshot[0]
+        raw = self.backend.load_state(process_id)
+        if raw is None:
+            self._snapshots.pop(process_id, None)
+            return None
+        state = ProcessState.model_validate_json(raw)
+        self._snapshots[process_id] = (state, time.monotonic())
+        return state
+
+    def put(self, state: ProcessState):
+        # 新任务先直接写入共享后端，由拿到租约的 worker 载入
+        self._snapshots.pop(state.process_id, None)
+        self.backend.save_states([self._row(state)])
+
+    def delete(self, process_id: str):
+        super().delete(process_id)
+        self._snapshots.pop(process_id, None)
+        with self._dirty_lock:
+            self._dirty.discard(process_id)
+        self.backend.delete_state(process_id)
+
+    def mark_dirty(self, state: ProcessState):
+        pid = state.process_id
+        if pid in self._fenced:
+            return
+        if pid in self._cache:
+            self._touched[pid] = time.time()
+            with self._dirty_lock:
+                self._dirty.add(pid)
+        else:
+            # 没有租约时的修改（正常流程中不会出现）直接写穿
+            self.backend.save_states([self._row(state)])
+
+    @staticmethod
+    def _row(state: ProcessState) -> tuple:
+        return (state.process_id, state.is_finished, not is_idle(state), time.time(), state.model_dump_json())
+
+    def flush(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        rows = []
+        for pid in dirty:
+            state = self._cache.get(pid)
+            if state is None:
+                continue
+            try:
+                rows.append(self._row(state))
+            except Exception as e:
+                # 序列化时恰好有其他线程在修改，留到下一轮
+                print(f"[!] State serialize failed for {pid}: {e}")
+                with self._dirty_lock:
+                    self._dirty.add(pid)
+        if rows:
+            self.backend.save_states(rows)
+
+    def evict_expired(self) -> list:
+        self._last_sweep = time.time()
+        if self.ttl_seconds <= 0:
+            return []
+        expired = self.backend.purge_finished(time.time() - self.ttl_seconds)
+        for pid in expired:
+            self._snapshots.pop(pid, None)
+        if expired:
+            print(f"[*] Evicted {len(expired)} expired processes")
+            if self.on_evict:
+                for pid in expired:
+                    self.on_evict(pid)
+        return expired
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                # 快照只是读缓存，定期清掉过期的
+                now = time.monotonic()
+                for pid, (_, fetched_at) in list(self._snapshots.items()):
+                    if now - fetched_at > self.snapshot_ttl:
+                        self._snapshots.pop(pid, None)
+                if time.time() - self._last_sweep > self.sweep_interval:
+                    self.evict_expired()
+            except Exception as e:
+                print(f"[!] State flush failed: {e}")
+
+
+def create_state_store(config: dict):
+    """
+    根据配置创建存储后端：sqlite（默认）或 memory
+    """
+    backend = config.get("backend", "sqlite")
+    ttl_seconds = config.get("ttl_hours", 72) * 3600
+    if backend == "memory":
+        return MemoryStateStore(ttl_seconds=ttl_seconds)
+    if backend == "sqlite":
+        return SQLiteStateStore(
+            path=config.get("path", "data/state.db"),
+            ttl_seconds=ttl_seconds,
+            flush_interval=config.get("flush_interval", 0.5)
+        )
+    raise ValueError(f"Unknown state_store backend: {backend}")
@@ -0,0 +1,216 @@
+import os
+import uuid
+import shutil
+import asyncio
+import hashlib
+import threading
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:
+    # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# ==========================================
+# 上传文件接收与去重存储 (Upload Store)
+# ==========================================
+
+class UploadTooLarge(Exception):
+    """
+    超过单文件或单次请求的大小限制，router 返回 413
+    """
+    def __init__(self, message: str, limit: int):
+        super().__init__(message)
+        self.limit = limit
+
+
+class BlobStore:
+    """
+    按内容 SHA-256 存放上传文件：<root>/<sha[:2]>/<sha>
+    同一份文件被多个任务上传时只保留一份，任务目录里通过硬链接引用（不支持硬链接时退回复制）
+    """
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+        self.dedup_hits = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def temp_path(self) -> str:
+        return os.path.join(self.tmp_dir, uuid.uuid4().hex)
+
+    def commit(self, tmp_path: str, sha256: str, size: int) -> str:
+        """
+        把写完的临时文件归档为 blob；已存在相同内容时直接丢弃临时文件
+        """
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+            with self._lock:
+                self.dedup_hits += 1
+                self.bytes_saved += size
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        return path
+
+    def link(self, sha256: str, dest_path: str):
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(self.blob_path(sha256), dest_path)
+        except OSError:
+            shutil.copyfile(self.blob_path(sha256), dest_path)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"dedup_hits": self.dedup_hits, "bytes_saved": self.bytes_saved}
+
+
+class _FileSink:
+    """
+    单个上传文件：边写边算 SHA-256，写入在线程中执行
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(path, "wb")
+
+    def write_many(self, chunks: list):
+        for chunk in chunks:
+            self._file.write(chunk)
+            self._hash.update(chunk)
+            self.size += len(chunk)
+
+    def close(self) -> str:
+        self._file.close()
+        return self._hash.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+async def receive_multipart(request, store: BlobStore, max_file_bytes: int, max_request_bytes: int,
+                            max_field_bytes: int = 1024 * 1024):
+    """
+    流式解析 multipart 请求体，不经过 Starlette 的整包解析
+    - Content-Length 超限时不读取请求体直接拒绝；否则边读边计数，超限立即中止
+    - 文件内容分块写入 BlobStore 的临时文件（线程中执行），同时计算 SHA-256
+    返回 (fields: {name: str}, files: [{"field", "filename", "sha256", "size"}])，文件顺序与请求中一致
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_request_bytes:
+        raise UploadTooLarge(f"Request body exceeds {max_request_bytes} bytes", max_request_bytes)
+
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing boundary in multipart request")
+
+    fields = {}
+    files = []
+    sinks = []
+    # 解析回调在事件循环里执行，只登记数据；真正的写盘在每个网络块之后批量交给线程
+    pending = []
+    current = {}
+    header_field = []
+    header_value = []
+    headers = {}
+
+    def on_part_begin():
+        headers.clear()
+        current.clear()
+
+    def on_header_field(data, start, end):
+        header_field.append(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.append(data[start:end])
+
+    def on_header_end():
+        headers[b"".join(header_field).lower()] = b"".join(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        current["field"] = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if b"filename" in options:
+            current["filename"] = options[b"filename"].decode("utf-8", errors="replace")
+            current["sink"] = _FileSink(store.temp_path())
+            current["size"] = 0
+            sinks.append(current["sink"])
+        else:
+            current["value"] = []
+            current["size"] = 0
+
+    def on_part_data(data, start, end):
+        current["size"] += end - start
+        if "sink" in current:
+            if current["size"] > max_file_bytes:
+                raise UploadTooLarge(f"File '{current['filename']}' exceeds {max_file_bytes} bytes", max_file_bytes)
+            pending.append((current["sink"], data[start:end]))
+        else:
+            if current["size"] > max_field_bytes:
+                raise UploadTooLarge(f"Form field '{current['field']}' exceeds {max_field_bytes} bytes", max_field_bytes)
+            current["value"].append(data[start:end])
+
+    def on_part_end():
+        if "sink" in current:
+            files.append({"field": current["field"], "filename": current["filename"], "sink": current["sink"]})
+        else:
+            fields[current["field"]] = b"".join(current["value"]).decode("utf-8")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    async def _flush():
+        if not pending:
+            return
+        batch = list(pending)
+        pending.clear()
+        by_sink = {}
+        for sink, chunk in batch:
+            by_sink.setdefault(sink, []).append(chunk)
+        await asyncio.to_thread(lambda: [sink.write_many(chunks) for sink, chunks in by_sink.items()])
+
+    received = 0
+    try:
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > max_request_bytes:
+                raise UploadTooLarge(f"Request body exceeds {max_request_bytes} bytes", max_request_bytes)
+            parser.write(chunk)
+            await _flush()
+        parser.finalize()
+        await _flush()
+
+        def _commit_all():
+            results = []
+            for f in files:
+                sink = f.pop("sink")
+                sha256 = sink.close()
+                store.commit(sink.path, sha256, sink.size)
+                results.append({**f, "sha256": sha256, "size": sink.size})
+            return results
+
+        return fields, await asyncio.to_thread(_commit_all)
+    except BaseException:
+        for sink in sinks:
+            await asyncio.to_thread(sink.discard)
+        raise
@@ -0,0 +1,157 @@
+import re
+import hashlib
+
+# 粗略估算：中日韩字符约 1 token/字，其余约 4 字符/token
+_CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[。！？!?；;.\n])")
+_NORMALIZE_RE = re.compile(r"[\s\W_]+", re.UNICODE)
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def compress_whitespace(text: str) -> str:
+    """
+    合并多余的空行与行内空白（网页 / PDF 文本里很常见）
+    """
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def split_passages(text: str, max_tokens: int = 800) -> list:
+    """
+    按段落切分长文本，过短的段落合并，超长的段落再按句子切开
+    """
+    passages = []
+    current = []
+    current_tokens = 0
+
+    def _flush():
+        nonlocal current, current_tokens
+        if current:
+            passages.append("\n\n".join(current))
+        current = []
+        current_tokens = 0
+
+    for para in _PARAGRAPH_RE.split(text):
+        para = para.strip()
+        if not para:
+            continue
+        tokens = estimate_tokens(para)
+
+        if tokens > max_tokens:
+            _flush()
+            piece = ""
+            for sentence in _SENTENCE_RE.split(para):
+                if piece and estimate_tokens(piece + sentence) > max_tokens:
+                    passages.append(piece.strip())
+                    piece = ""
+                piece += sentence
+                # 单句本身就超长（例如没有标点的表格），按字符硬切
+                while estimate_tokens(piece) > max_tokens:
+                    cut = max(1, len(piece) * max_tokens // estimate_tokens(piece))
+                    passages.append(piece[:cut].strip())
+                    piece = piece[cut:]
+            if piece.strip():
+                passages.append(piece.strip())
+            continue
+
+        if current_tokens + tokens > max_tokens:
+            _flush()
+        current.append(para)
+        current_tokens += tokens
+
+    _flush()
+    return passages
+
+def _fingerprint(passage: str) -> str:
+    return hashlib.sha1(_NORMALIZE_RE.sub("", passage).lower().encode("utf-8")).hexdigest()
+
+def pack_materials(materials: list, budget_tokens: int, chunk_tokens: int = 800):
+    """
+    在 token 预算内挑选资料内容
+    1. 压缩空白，按段切块
+    2. 跨资料去重：同一段落只保留可信度最高的那一份
+    3. 按 reliability_score 加权分配预算，每份资料按原文顺序取段落；
+       用不完的预算再按可信度从高到低分给还有剩余内容的资料
+    总量在预算内时原样返回，不做压缩与去重
+    materials: [{"source_type", "content", "reliability_score"}]
+    返回 (新的 materials 列表, 统计信息)
+    """
+    original_tokens = sum(estimate_tokens(m.get("content") or "") for m in materials)
+    if original_tokens <= budget_tokens:
+        return list(materials), {
+            "original_tokens": original_tokens,
+            "packed_tokens": original_tokens,
+            "budget_tokens": budget_tokens,
+            "duplicate_passages": 0,
+            "packed": False,
+        }
+
+    # 可信度高的先处理，去重时保留它的版本
+    ordered = sorted(enumerate(materials), key=lambda kv: -kv[1]["reliability_score"])
+    seen = set()
+    candidates = []
+    duplicates = 0
+
+    for idx, material in ordered:
+        content = material.get("content") or ""
+        passages = []
+        for passage in split_passages(compress_whitespace(content), chunk_tokens):
+            fp = _fingerprint(passage)
+            if fp in seen:
+                duplicates += 1
+                continue
+            seen.add(fp)
+            passages.append((passage, estimate_tokens(passage)))
+        candidates.append({"index": idx, "material": material, "passages": passages, "selected": [], "cursor": 0})
+
+    total_weight = sum(max(1, c["material"]["reliability_score"]) for c in candidates) or 1
+    remaining = budget_tokens
+
+    def _take(candidate, allowance: int) -> int:
+        used = 0
+        passages = candidate["passages"]
+        while candidate["cursor"] < len(passages):
+            passage, tokens = passages[candidate["cursor"]]
+            if used + tokens > allowance:
+                break
+            candidate["selected"].append(candidate["cursor"])
+            candidate["cursor"] += 1
+            used += tokens
+        return used
+
+    # 第一轮：按权重分配
+    for c in candidates:
+        share = budget_tokens * max(1, c["material"]["reliability_score"]) // total_weight
+        remaining -= _take(c, share)
+
+    # 第二轮：剩余预算按可信度顺序补给
+    for c in candidates:
+        if remaining <= 0:
+            break
+        remaining -= _take(c, remaining)
+
+    packed = []
+    packed_tokens = 0
+    for c in sorted(candidates, key=lambda c: c["index"]):
+        if not c["selected"]:
+            continue
+        parts = [c["passages"][i][0] for i in c["selected"]]
+        omitted = len(c["passages"]) - len(parts)
+        if omitted:
+            parts.append(f"……（因篇幅限制省略 {omitted} 段）")
+        content = "\n\n".join(parts)
+        packed_tokens += estimate_tokens(content)
+        packed.append({**c["material"], "content": content})
+
+    stats = {
+        "original_tokens": original_tokens,
+        "packed_tokens": packed_tokens,
+        "budget_tokens": budget_tokens,
+        "duplicate_passages": duplicates,
+        "packed": True,
+    }
+    return packed, stats
@@ -1,79 +1,488 @@
+import os
 import fitz
+import codecs
+import zipfile
+import itertools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from docx import Document
 import chardet
-import pandas as pd
 
-def load_excel(path) -> str:
+# === Excel ===
+def _xlsx_sheets(path, max_rows: int = None):
     """
-    Excel (.xls / .xlsx) → 结构化纯文本
+    openpyxl 只读模式逐行读取 .xlsx，不构造 DataFrame
+    每个 sheet 最多缓冲 max_rows 行（用于去掉全空列）
     """
-    text_blocks = []
+    import openpyxl
 
-    # 读取所有 sheet
-    xls = pd.ExcelFile(path)
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            rows = []
+            for row in ws.iter_rows(values_only=True):
+                values = ["" if v is None else str(v).strip() for v in row]
+                # 丢弃全空行
+                if not any(values):
+                    continue
+                rows.append(values)
+                # 表头 + max_rows 行数据
+                if max_rows and len(rows) > max_rows:
+                    break
+            yield ws.title, rows
+    finally:
+        wb.close()
 
-    for sheet_name in xls.sheet_names:
-        df = xls.parse(sheet_name)
+def _pandas_sheets(path, max_rows: int = None):
+    """
+    pandas 读取（.xls 或没有 openpyxl 时），整列向量化转换为字符串
+    """
+    # pandas 导入较慢，只在读取 Excel 时导入（沙箱子进程每次都要重新导入）
+    import pandas as pd
 
-        # 丢弃全空行 / 列
+    xls = pd.ExcelFile(path)
+    for sheet_name in xls.sheet_names:
+        df = xls.parse(sheet_name, nrows=max_rows)
         df = df.dropna(how="all")
-        df = df.dropna(axis=1, how="all")
-
         if df.empty:
+            yield sheet_name, []
+            continue
+        headers = [str(h) for h in df.columns]
+        cells = df.astype(object).where(df.notna(), "").astype(str)
+        rows = [headers] + [[v.strip() for v in row] for row in cells.itertuples(index=False, name=None)]
+        yield sheet_name, rows
+
+def iter_excel_sheets(path, max_rows: int = None):
+    """
+    按 sheet 逐个产出 (sheet_name, 文本块)，调用方可以随时停止
+    """
+    if str(path).lower().endswith(".xlsx"):
+        try:
+            import openpyxl  # noqa: F401
+            sheets = _xlsx_sheets(path, max_rows)
+        except ImportError:
+            sheets = _pandas_sheets(path, max_rows)
+    else:
+        sheets = _pandas_sheets(path, max_rows)
+
+    for sheet_name, rows in sheets:
+        if not rows:
+            continue
+        # 丢弃全空列
+        width = max(len(r) for r in rows)
+        keep = [i for i in range(width) if any(i < len(r) and r[i] for r in rows[1:])]
+        if not keep:
             continue
+        lines = [f"### Sheet: {sheet_name}"]
+        lines.extend(" | ".join(r[i] if i < len(r) else "" for i in keep) for r in rows)
+        yield sheet_name, "\n".join(lines)
 
-        text_blocks.append(f"### Sheet: {sheet_name}")
+def load_excel(path, max_rows: int = None, max_chars: int = None) -> str:
+    """
+    Excel (.xls / .xlsx) → 结构化纯文本
+    max_rows 限制每个 sheet 的行数，max_chars 限制总长度（超过后不再读取后面的 sheet）
+    """
+    text_blocks = []
+    total = 0
+    for _, block in iter_excel_sheets(path, max_rows=max_rows):
+        text_blocks.append(block + "\n")  # sheet 间空行
+        total += len(block) + 2
+        if max_chars and total >= max_chars:
+            break
 
-        # 表头
-        headers = [str(h) for h in df.columns]
-        text_blocks.append(" | ".join(headers))
+    text = "\n".join(text_blocks)
+    return text[:max_chars] if max_chars else text
+
+# === 文本 ===
+# UTF-32 LE 的 BOM 以 UTF-16 LE 的 BOM 开头，必须先判断 UTF-32
+_BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+# chardet 对中文常报 GB2312，实际文件多为 GBK / GB18030 的超集
+_ENCODING_UPGRADES = {"gb2312": "gb18030", "gbk": "gb18030"}
 
-        # 行内容
-        for _, row in df.iterrows():
-            values = [
-                "" if pd.isna(v) else str(v).strip()
-                for v in row.tolist()
-            ]
-            text_blocks.append(" | ".join(values))
+def detect_encoding(path, sample_size: int = 64 * 1024) -> str:
+    """
+    只读取文件开头的 sample_size 字节判断编码：BOM → UTF-8 → chardet
+    """
+    with open(path, "rb") as f:
+        sample = f.read(sample_size)
 
-        text_blocks.append("")  # sheet 间空行
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
 
-    return "\n".join(text_blocks)
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # 样本末尾恰好截断了一个多字节字符
+        if e.start >= len(sample) - 3 and len(sample) == sample_size:
+            return "utf-8"
 
-def load_text_file(path):
+    encoding = (chardet.detect(sample)["encoding"] or "utf-8").lower()
+    encoding = _ENCODING_UPGRADES.get(encoding, encoding)
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = "utf-8"
+    return encoding
+
+def iter_text_file(path, chunk_size: int = 1024 * 1024, sample_size: int = 64 * 1024, encoding: str = None):
+    """
+    分块增量解码，逐块产出文本，内存占用与文件大小无关
+    """
+    encoding = encoding or detect_encoding(path, sample_size)
+    decoder = codecs.getincrementaldecoder(encoding)(errors="ignore")
     with open(path, "rb") as f:
-        raw = f.read()
-    enc = chardet.detect(raw)["encoding"]
-    return raw.decode(enc, errors="ignore")
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
 
-def load_pdf(path):
-    doc = fitz.open(path)
-    text = ""
+def load_text_file(path, max_chars: int = None, **options):
+    """
+    文本文件 → 字符串，超过 max_chars 时截断并停止读取
+    options 透传给 iter_text_file
+    """
+    parts = []
+    total = 0
+    for text in iter_text_file(path, **options):
+        parts.append(text)
+        total += len(text)
+        if max_chars and total >= max_chars:
+            break
 
-    for page in doc:
-        t = page.get_text().strip()
-        if t:
-            text += t + "\n"
+    text = "".join(parts)
+    return text[:max_chars] if max_chars else text
 
-    # 如果提取不到文本 → OCR
-    if len(text.strip()) < 50:
-        text = ocr_pdf(doc)
+# === PDF ===
+# 页文本少于 ocr_min_chars 时单独对该页做 OCR（扫描页 / 图片页），而不是整本重新 OCR
+_pdf_pool = None
+_pdf_pool_workers = 0
+_pdf_pool_lock = threading.Lock()
+# 不用默认的 fork：调用方可能是多线程进程，fork 会复制其他线程持有的锁
+_PDF_POOL_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+if _PDF_POOL_CONTEXT.get_start_method() == "forkserver":
+    # worker 从预先导入了本模块（fitz 等）的 server 进程 fork 出来，不必各自重新导入
+    _PDF_POOL_CONTEXT.set_forkserver_preload([__name__])
 
-    return text
+def _ocr_available() -> bool:
+    try:
+        import pytesseract  # noqa: F401
+        return True
+    except ImportError:
+        return False
 
-def ocr_pdf(doc):
+def _ocr_page(page, dpi: int) -> str:
     import pytesseract
     from PIL import Image
     import io
 
-    text = ""
-    for page in doc:
-        pix = page.get_pixmap()
-        img = Image.open(io.BytesIO(pix.tobytes()))
-        text += pytesseract.image_to_string(img)
+    pix = page.get_pixmap(dpi=dpi)
+    img = Image.open(io.BytesIO(pix.tobytes("png")))
+    return pytesseract.image_to_string(img).strip()
+
+def _extract_page_range(path, start: int, end: int, ocr_min_chars: int, ocr_dpi: int, use_ocr: bool) -> list:
+    """
+    提取 [start, end) 页的文本，在进程池中执行
+    """
+    texts = []
+    with fitz.open(path) as doc:
+        for i in range(start, end):
+            page = doc[i]
+            text = page.get_text().strip()
+            if use_ocr and len(text) < ocr_min_chars:
+                text = _ocr_page(page, ocr_dpi) or text
+            texts.append(text)
+    return texts
+
+def _get_pdf_pool(workers: int):
+    """
+    进程池常驻复用，避免每份文档都重新启动子进程
+    """
+    global _pdf_pool, _pdf_pool_workers
+    with _pdf_pool_lock:
+        if _pdf_pool is None or _pdf_pool_workers != workers:
+            if _pdf_pool is not None:
+                _pdf_pool.shutdown(wait=False, cancel_futures=True)
+            _pdf_pool = ProcessPoolExecutor(max_workers=workers, mp_context=_PDF_POOL_CONTEXT)
+            _pdf_pool_workers = workers
+        return _pdf_pool
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is not None:
+            _pdf_pool.shutdown(wait=False, cancel_futures=True)
+        _pdf_pool = None
+
+def iter_pdf_pages(path, workers: int = 4, batch_pages: int = 8, ocr_min_chars: int = 20,
+                   ocr_dpi: int = 200, max_pages: int = None):
+    """
+    按页顺序逐页产出文本（生成器），调用方可以随时停止
+    页数较多时按 batch_pages 分批交给进程池，同时在途的批次不超过 workers * 2，内存有上限
+    """
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+    if max_pages:
+        page_count = min(page_count, max_pages)
+
+    use_ocr = _ocr_available()
+    ranges = [(start, min(start + batch_pages, page_count)) for start in range(0, page_count, batch_pages)]
+
+    # 页数不多时直接在当前进程处理，省去进程间传输
+    if workers <= 1 or len(ranges) <= 2:
+        for start, end in ranges:
+            yield from _extract_page_range(path, start, end, ocr_min_chars, ocr_dpi, use_ocr)
+        return
+
+    pool = _get_pdf_pool(workers)
+    pending = deque()
+    ranges_iter = iter(ranges)
+    try:
+        for start, end in itertools.islice(ranges_iter, workers * 2):
+            pending.append(pool.submit(_extract_page_range, path, start, end, ocr_min_chars, ocr_dpi, use_ocr))
+        while pending:
+            texts = pending.popleft().result()
+            next_range = next(ranges_iter, None)
+            if next_range:
+                pending.append(pool.submit(_extract_page_range, path, *next_range, ocr_min_chars, ocr_dpi, use_ocr))
+            yield from texts
+    except BrokenProcessPool:
+        # 子进程崩溃（例如被 OOM 杀掉），丢弃进程池，下次重新创建
+        _reset_pdf_pool()
+        raise
+    finally:
+        # 调用方提前停止时取消还没开始的批次
+        for future in pending:
+            future.cancel()
+
+def load_pdf(path, max_chars: int = None, **options):
+    """
+    PDF → 纯文本，超过 max_chars 时提前停止
+    options 透传给 iter_pdf_pages
+    """
+    parts = []
+    total = 0
+    for text in iter_pdf_pages(path, **options):
+        if not text:
+            continue
+        parts.append(text)
+        total += len(text) + 1
+        if max_chars and total >= max_chars:
+            break
 
-    return text
+    text = "\n".join(parts)
+    # 整本都提取不到文本且没有 OCR 环境时，明确报错
+    if len(text.strip()) < 50 and not _ocr_available():
+        raise ImportError("PDF has no text layer and pytesseract is not installed for OCR")
+    return text[:max_chars] if max_chars else text
 
 def load_docx(path):
     doc = Document(path)
     return "\n".join(p.text for p in doc.paragraphs if p.text.strip())
+
+# === HTML / EPUB / ODT ===
+def html_to_text(html) -> str:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(["script", "style", "noscript", "head"]):
+        tag.decompose()
+    lines = (line.strip() for line in soup.get_text("\n").splitlines())
+    return "\n".join(line for line in lines if line)
+
+def load_html(path, max_chars: int = None) -> str:
+    return html_to_text(load_text_file(path, max_chars=max_chars))
+
+def load_epub(path, max_chars: int = None) -> str:
+    """
+    EPUB → 纯文本，按 OPF 中 spine 的阅读顺序拼接各章节
+    """
+    import posixpath
+    import xml.etree.ElementTree as ET
+
+    with zipfile.ZipFile(path) as zf:
+        names = set(zf.namelist())
+        chapters = []
+        try:
+            container = ET.fromstring(zf.read("META-INF/container.xml"))
+            opf_path = next(el.get("full-path") for el in container.iter() if el.tag.endswith("rootfile"))
+            opf = ET.fromstring(zf.read(opf_path))
+            base = posixpath.dirname(opf_path)
+            manifest = {
+                el.get("id"): posixpath.normpath(posixpath.join(base, el.get("href")))
+                for el in opf.iter() if el.tag.endswith("}item") and el.get("href")
+            }
+            chapters = [manifest[el.get("idref")] for el in opf.iter()
+                        if el.tag.endswith("}itemref") and el.get("idref") in manifest]
+        except (KeyError, StopIteration, ET.ParseError):
+            pass
+        if not chapters:
+            # 没有合法的 OPF 时退回按文件名排序
+            chapters = sorted(n for n in names if n.lower().endswith((".xhtml", ".html", ".htm")))
+
+        parts = []
+        total = 0
+        for name in chapters:
+            if name not in names:
+                continue
+            text = html_to_text(zf.read(name))
+            if not text:
+                continue
+            parts.append(text)
+            total += len(text) + 1
+            if max_chars and total >= max_chars:
+                break
+
+    text = "\n".join(parts)
+    return text[:max_chars] if max_chars else text
+
+def load_odt(path) -> str:
+    """
+    ODT → 纯文本，取 content.xml 中的标题与段落
+    """
+    import xml.etree.ElementTree as ET
+
+    text_ns = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+    with zipfile.ZipFile(path) as zf:
+        root = ET.fromstring(zf.read("content.xml"))
+    paragraphs = ("".join(el.itertext()).strip() for el in root.iter() if el.tag in (f"{text_ns}p", f"{text_ns}h"))
+    return "\n".join(p for p in paragraphs if p)
+
+# ==========================================
+# 格式识别与读取器注册表
+# ==========================================
+
+_OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_ZIP_MIMETYPES = {
+    "application/epub+zip": "epub",
+    "application/vnd.oasis.opendocument.text": "odt",
+}
+
+def sniff_format(path, sample_size: int = 8192) -> str:
+    """
+    按文件头判断格式，不信任扩展名；扩展名只用于区分同为纯文本的 markdown
+    无法识别的二进制返回 "binary"
+    """
+    with open(path, "rb") as f:
+        head = f.read(sample_size)
+    suffix = os.path.splitext(str(path))[1].lower()
+
+    # 只认文件开头的签名（允许前置 BOM / 空白），正文中引用了 "%PDF-" 的文本不算
+    if head.removeprefix(b"\xef\xbb\xbf").lstrip().startswith(b"%PDF-"):
+        return "pdf"
+
+    if head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(path) as zf:
+                names = set(zf.namelist())
+                if "mimetype" in names:
+                    mimetype = zf.read("mimetype").decode("ascii", errors="ignore").strip()
+                    if mimetype in _ZIP_MIMETYPES:
+                        return _ZIP_MIMETYPES[mimetype]
+                if "word/document.xml" in names:
+                    return "docx"
+                if "xl/workbook.xml" in names:
+                    return "xlsx"
+        except zipfile.BadZipFile:
+            pass
+        return "binary"
+
+    if head.startswith(_OLE_MAGIC):
+        # OLE 容器也可能是 .doc / .ppt，只接受 Excel
+        return "xls" if suffix == ".xls" else "binary"
+
+    # UTF-16/32 文本本身含有 NUL，先看 BOM
+    if not any(head.startswith(bom) for bom, _ in _BOMS) and b"\x00" in head:
+        return "binary"
+
+    lowered = head[:1024].lstrip().lower()
+    if lowered.startswith((b"<!doctype html", b"<html")) or suffix in (".html", ".htm"):
+        return "html"
+    if suffix in (".md", ".markdown"):
+        return "markdown"
+    return "text"
+
+DOC_LOADERS = {}
+
+def register_loader(fmt: str):
+    """
+    注册某种格式的读取器：loader(path, doc_config) -> str
+    doc_config 为配置中的 doc_reader 段
+    """
+    def _decorator(fn):
+        DOC_LOADERS[fmt] = fn
+        return fn
+    return _decorator
+
+@register_loader("pdf")
+def _read_pdf(path, doc_config: dict) -> str:
+    return load_pdf(
+        path,
+        max_chars=doc_config.get("max_chars"),
+        workers=doc_config.get("pdf_workers", 4),
+        batch_pages=doc_config.get("pdf_batch_pages", 8),
+        ocr_min_chars=doc_config.get("ocr_min_chars", 20),
+        ocr_dpi=doc_config.get("ocr_dpi", 200),
+        max_pages=doc_config.get("max_pages"),
+    )
+
+@register_loader("docx")
+def _read_docx(path, doc_config: dict) -> str:
+    return load_docx(path)
+
+@register_loader("xlsx")
+@register_loader("xls")
+def _read_excel(path, doc_config: dict) -> str:
+    return load_excel(path, max_rows=doc_config.get("excel_max_rows"), max_chars=doc_config.get("max_chars"))
+
+@register_loader("epub")
+def _read_epub(path, doc_config: dict) -> str:
+    return load_epub(path, max_chars=doc_config.get("max_chars"))
+
+@register_loader("odt")
+def _read_odt(path, doc_config: dict) -> str:
+    return load_odt(path)
+
+@register_loader("html")
+def _read_html(path, doc_config: dict) -> str:
+    return load_html(path, max_chars=doc_config.get("max_chars"))
+
+@register_loader("markdown")
+@register_loader("text")
+def _read_text(path, doc_config: dict) -> str:
+    return load_text_file(path, max_chars=doc_config.get("max_chars"))
+
+def load_document(path, doc_config: dict = None) -> str:
+    """
+    识别格式并调用对应的读取器
+    """
+    fmt = sniff_format(path)
+    loader = DOC_LOADERS.get(fmt)
+    if loader is None:
+        raise ValueError(f"Unsupported document format: {fmt}")
+    return loader(path, doc_config or {})
+
+def load_document_isolated(path, doc_config: dict = None) -> str:
+    """
+    在沙箱子进程中执行的入口：子进程只导入了本模块，PDF 进程池的 worker 启动开销很小，按 pdf_workers 分页并行
+    内存上限（RLIMIT_AS）会被 worker 继承，按进程分别计算
+    """
+    try:
+        return load_document(path, doc_config)
+    finally:
+        _reset_pdf_pool()
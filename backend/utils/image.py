@@ -1,18 +1,37 @@
 from PIL import Image,PngImagePlugin
 import io
+import zlib
 import base64
+import struct
+import functools
 
 TARGET_IMG_SIZE = (512, 768)
+DEFAULT_COMPRESS_LEVEL = 6
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
 
 def resize_image(image, size=TARGET_IMG_SIZE) -> Image.Image:
+    """
+    大图缩放：JPEG 先用 draft 在解码阶段按 1/2^n 缩小，
+    其余格式由 reducing_gap 先做整数倍快速缩小，再做一次高质量缩放
+    """
     img = Image.open(image)
-    return img.resize(size)
+    img.draft("RGB", size)
+    # PNG 不支持 CMYK 等模式
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    return img.resize(size, Image.BICUBIC, reducing_gap=2.0)
 
 def blank_image(size=TARGET_IMG_SIZE) -> Image.Image:
     return Image.new('RGB', size, color='white')
 
-def save_png(img: Image.Image, data:str) -> bytes:
-    data = base64.b64encode(data.encode("utf-8")).decode("utf-8")
+def encode_card_text(data: str) -> str:
+    """
+    SillyTavern 的 chara 字段：角色卡 JSON 的 base64
+    """
+    return base64.b64encode(data.encode("utf-8")).decode("utf-8")
+
+def save_png(img: Image.Image, data:str, compress_level: int = DEFAULT_COMPRESS_LEVEL) -> bytes:
+    data = encode_card_text(data)
     buf = io.BytesIO()
     pnginfo = None
 
@@ -20,5 +39,31 @@ def save_png(img: Image.Image, data:str) -> bytes:
         pnginfo = PngImagePlugin.PngInfo()
         pnginfo.add_text("chara", data)
 
-    img.save(buf, format="PNG", pnginfo=pnginfo)
-    return buf.getvalue()
\ No newline at end of file
+    img.save(buf, format="PNG", pnginfo=pnginfo, compress_level=compress_level)
+    return buf.getvalue()
+
+def png_text_chunk(keyword: str, text: str) -> bytes:
+    body = keyword.encode("latin-1") + b"\x00" + text.encode("latin-1")
+    return struct.pack(">I", len(body)) + b"tEXt" + body + struct.pack(">I", zlib.crc32(b"tEXt" + body))
+
+def insert_png_text(png: bytes, keyword: str, text: str) -> bytes:
+    """
+    在 IHDR 之后插入一个 tEXt 块，不重新编码图像数据
+    """
+    if not png.startswith(PNG_SIGNATURE):
+        raise ValueError("Not a PNG file")
+    # 签名 8 字节 + IHDR 块 (4 长度 + 4 类型 + 13 数据 + 4 CRC)
+    ihdr_end = len(PNG_SIGNATURE) + 25
+    return png[:ihdr_end] + png_text_chunk(keyword, text) + png[ihdr_end:]
+
+@functools.lru_cache(maxsize=8)
+def _blank_png(size: tuple, compress_level: int) -> bytes:
+    buf = io.BytesIO()
+    blank_image(size).save(buf, format="PNG", compress_level=compress_level)
+    return buf.getvalue()
+
+def blank_card_png(data: str, size=TARGET_IMG_SIZE, compress_level: int = DEFAULT_COMPRESS_LEVEL) -> bytes:
+    """
+    没有立绘时的空白卡：空白图只编码一次，之后每张卡只拼接 chara 文本块
+    """
+    return insert_png_text(_blank_png(tuple(size), compress_level), "chara", encode_card_text(data))
@@ -0,0 +1,77 @@
+import json
+
+class JsonFieldStream:
+    """
+    流式解析 LLM 输出中的 JSON 对象，只关心顶层的字符串字段
+    每次 feed 一段增量文本，返回这段文本里新完成的字段 {key: value}
+    对象开始前的内容（如 ```json）会被忽略
+    """
+    def __init__(self):
+        self.fields = {}
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._literal = []
+        # 顶层对象内的状态：key -> colon -> value -> comma -> key ...
+        self._expect = "key"
+        self._key = None
+
+    def feed(self, chunk: str) -> dict:
+        completed = {}
+
+        for ch in chunk:
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._literal.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._on_top_level_string("".join(self._literal), completed)
+                    self._literal = []
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._literal = [ch]
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1:
+                    # 嵌套值结束
+                    self._expect = "comma"
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif ch == ",":
+                    self._expect = "key"
+                elif not ch.isspace() and self._expect == "value":
+                    # 数字 / 布尔等非字符串值，不关心
+                    self._expect = "comma"
+
+        return completed
+
+    def _on_top_level_string(self, literal: str, completed: dict):
+        try:
+            value = json.loads(literal)
+        except ValueError:
+            value = literal[1:-1]
+
+        if self._expect == "key":
+            self._key = value
+            self._expect = "colon"
+        elif self._expect == "value" and self._key is not None:
+            self.fields[self._key] = value
+            completed[self._key] = value
+            self._key = None
+            self._expect = "comma"
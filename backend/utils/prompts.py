@@ -0,0 +1,77 @@
+import os
+import re
+import time
+import threading
+
+# 占位符格式：%CHARACTER_NAME%
+_PLACEHOLDER_RE = re.compile(r"%([A-Z][A-Z0-9_]*)%")
+
+class PromptTemplate:
+    """
+    预先把模板切成 [文本, 占位符, 文本, 占位符, ...]，渲染时一次拼接
+    替换进去的内容不会再被当作占位符处理；没有提供值的占位符原样保留
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self._parts = _PLACEHOLDER_RE.split(text)
+        self.placeholders = set(self._parts[1::2])
+
+    def render(self, **values) -> str:
+        parts = self._parts[:]
+        for i in range(1, len(parts), 2):
+            name = parts[i]
+            parts[i] = str(values[name]) if name in values else f"%{name}%"
+        return "".join(parts)
+
+
+class PromptLoader:
+    """
+    prompts 目录下的模板只读一次并缓存；
+    每个模板最多每 check_interval 秒检查一次 mtime，文件被修改后自动重新加载
+    """
+    def __init__(self, root: str, check_interval: float = 1.0):
+        self.root = root
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        # name -> (template, mtime, last_checked)
+        self._templates = {}
+
+    def _load(self, name: str) -> PromptTemplate:
+        path = os.path.join(self.root, name)
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, "r", encoding="utf-8") as f:
+            template = PromptTemplate(f.read())
+        with self._lock:
+            self._templates[name] = (template, mtime, time.monotonic())
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        entry = self._templates.get(name)
+        if entry is None:
+            return self._load(name)
+
+        template, mtime, last_checked = entry
+        now = time.monotonic()
+        if now - last_checked < self.check_interval:
+            return template
+        try:
+            if os.stat(os.path.join(self.root, name)).st_mtime_ns != mtime:
+                print(f"[*] Prompt template changed, reloading: {name}")
+                return self._load(name)
+        except OSError:
+            # 文件临时不可用（例如编辑器正在保存），继续用旧版本
+            pass
+        with self._lock:
+            self._templates[name] = (template, mtime, now)
+        return template
+
+    def render(self, name: str, **values) -> str:
+        return self.get(name).render(**values)
+
+    def preload(self):
+        """
+        启动时一次性加载目录下所有模板
+        """
+        for name in os.listdir(self.root):
+            if os.path.isfile(os.path.join(self.root, name)):
+                self._load(name)
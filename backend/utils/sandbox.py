@@ -0,0 +1,114 @@
+import os
+import sys
+import pickle
+import signal
+import subprocess
+
+# ==========================================
+# 子进程隔离执行 (Sandbox)
+# ==========================================
+# 子进程以 python -m utils.sandbox 启动，只导入 fn 所在的模块：
+# 不 fork 服务进程（避免复制其他线程持有的锁），也不像 multiprocessing 的 spawn / forkserver 那样
+# 重新执行入口模块（那会把服务初始化——状态存储、调度线程、缓存清理等——在子进程里再跑一遍）
+# 父子进程之间通过 stdin / stdout 传递 pickle 数据
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，只做超时限制
+    resource = None
+
+# backend/ 目录：子进程从这里导入 fn 所在的模块
+_IMPORT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _current_vm_bytes() -> int:
+    """
+    当前进程已占用的虚拟内存（解释器与已导入的模块），不计入 memory_limit_mb
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def _limit_memory(memory_limit_mb: int):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = _current_vm_bytes() + memory_limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        print(f"[!] Failed to set memory limit: {e}")
+
+def _worker_main():
+    """
+    子进程入口：从 stdin 读取 (memory_limit_mb, fn, args, kwargs)，把 ("ok" | "error", 结果) 写回原来的 stdout
+    fn 内部的打印（包括 C 扩展直接写 fd 1 的输出）改到 stderr，不会混进结果
+    """
+    result_fd = os.dup(1)
+    os.dup2(2, 1)
+    request = sys.stdin.buffer.read()
+    try:
+        # 反序列化时导入 fn 所在的模块，之后再限制内存，模块本身不占用额度
+        memory_limit_mb, fn, args, kwargs = pickle.loads(request)
+        _limit_memory(memory_limit_mb)
+        result = ("ok", fn(*args, **kwargs))
+    except BaseException as e:
+        result = ("error", e)
+    try:
+        data = pickle.dumps(result)
+    except Exception as e:
+        # 异常对象不能 pickle 时只传文字
+        data = pickle.dumps(("error", RuntimeError(f"{type(result[1]).__name__}: {result[1]}" if result[0] == "error" else str(e))))
+    with os.fdopen(result_fd, "wb") as out:
+        out.write(data)
+
+def _kill_tree(proc):
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+    proc.kill()
+    proc.communicate()
+
+def run_isolated(fn, *args, timeout: float = 120, memory_limit_mb: int = 1024, **kwargs):
+    """
+    在独立子进程中执行 fn(*args, **kwargs) 并返回结果
+    - 超过 timeout 秒直接杀掉子进程（连同它再开的子进程），抛出 TimeoutError
+    - memory_limit_mb 为子进程在启动占用之外最多还能申请的内存（RLIMIT_AS，仅 POSIX）
+    - 子进程内的异常原样抛出；子进程崩溃时抛出 RuntimeError
+    fn 必须是能从 backend/ 导入的模块顶层函数（通过 pickle 传给子进程）
+    """
+    request = pickle.dumps((memory_limit_mb, fn, args, kwargs))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (_IMPORT_ROOT, env.get("PYTHONPATH")) if p)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "utils.sandbox"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        env=env,
+        # 独立进程组，超时时可以整组杀掉
+        start_new_session=hasattr(os, "setsid"),
+    )
+    try:
+        # communicate 同时写入请求、读取结果，大结果不会把管道塞满导致双方互等
+        output, _ = proc.communicate(request, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill_tree(proc)
+        raise TimeoutError(f"Task exceeded time limit of {timeout}s")
+    except BaseException:
+        _kill_tree(proc)
+        raise
+
+    if not output:
+        raise RuntimeError(f"Worker process died (exit code {proc.returncode})")
+    status, payload = pickle.loads(output)
+    if status == "error":
+        if isinstance(payload, MemoryError):
+            raise MemoryError(f"Task exceeded memory limit of {memory_limit_mb}MB")
+        raise payload
+    return payload
+
+if __name__ == "__main__":
+    _worker_main()
@@ -0,0 +1,51 @@
+# bench/bench_http_client.py
+# 基准：本地 keep-alive 服务上，裸 requests.get 与共享连接池的对比
+# python bench/bench_http_client.py
+import os
+import sys
+import time
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from services.http_client import HttpClient
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 头和正文分两次写出，不关 Nagle 会在 keep-alive 连接上触发 40ms 的延迟 ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = b"ok" * 512
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/page"
+    client = HttpClient({})
+    n = 2000
+
+    for label, fn in [("requests.get", lambda _: requests.get(url, timeout=10)),
+                      ("HttpClient.get", lambda _: client.get(url))]:
+        for workers in (1, 8):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(fn, range(n)))
+            elapsed = time.perf_counter() - start
+            print(f"{label:<16} workers={workers}  {elapsed / n * 1e3:6.3f} ms/request")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
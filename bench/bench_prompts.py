@@ -0,0 +1,35 @@
+# bench/bench_prompts.py
+# 微基准：每份资料构造一次 reference prompt 的耗时
+# python bench/bench_prompts.py
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from utils.prompts import PromptLoader
+
+def main():
+    root = os.path.join(ROOT, "backend", "prompts")
+    content = "资料内容。" * 2000
+    loader = PromptLoader(root)
+    loader.preload()
+
+    def _old():
+        with open(os.path.join(root, "reference_prompts"), "r", encoding="utf-8") as f:
+            prompts = f.read()
+        prompts = prompts.replace("%RELIABILITY%", "高")
+        return prompts.replace("%CONTENT%", content)
+
+    def _new():
+        return loader.render("reference_prompts", RELIABILITY="高", CONTENT=content)
+
+    assert _old() == _new()
+    n = 20000
+    for label, fn in [("read + str.replace", _old), ("cached template", _new)]:
+        seconds = min(timeit.repeat(fn, number=n, repeat=3))
+        print(f"{label:<20} {seconds / n * 1e6:8.2f} us/material")
+
+if __name__ == "__main__":
+    main()
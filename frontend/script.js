@@ -2,7 +2,9 @@
 let currentStep = 1;
 const totalSteps = 4;
 let processId = null; // 存储后端返回的任务ID
-let pollingInterval = null; // 轮询句柄
+let pollingInterval = null; // 轮询句柄（不支持 SSE 时的兜底）
+let statusSource = null; // SSE 连接
+let localState = null; // 本地合并后的任务状态
 let processedStepIds = new Set(); // 记录已经渲染过的子任务ID
 
 const RELIABILITY_MAP = { "低": 1, "中": 2, "高": 3, "确信": 4 };
@@ -38,13 +40,12 @@ function changeStep(n) {
     // 向后导航：总是允许
     if (n === -1) {
         // 如果当前在步骤3且有正在进行的处理，需要警告用户
-        if (currentStep === 3 && pollingInterval) {
+        if (currentStep === 3 && isUpdating()) {
             if (!confirm("返回上一步将取消正在进行的处理，是否继续？")) {
                 return;
             }
             // 停止轮询
-            clearInterval(pollingInterval);
-            pollingInterval = null;
+            stopStatusUpdates();
         }
         proceedStepChange(n);
         return;
@@ -97,8 +98,7 @@ async function triggerGeneration() {
             body: JSON.stringify({ process_id: processId })
         });
 
-        if (pollingInterval) clearInterval(pollingInterval);
-        pollingInterval = setInterval(pollStatus, 1000);
+        startStatusUpdates();
         console.log("Generation polling started.");
 
     } catch (e) {
@@ -188,13 +188,11 @@ async function startProcessingFlow() {
     document.getElementById('processing-done-msg').classList.add('hidden');
 
     // 如果已有轮询，停止它
-    if (pollingInterval) {
-        clearInterval(pollingInterval);
-        pollingInterval = null;
-    }
+    stopStatusUpdates();
 
     // 重置processId，开始新的处理
     processId = null;
+    localState = null;
 
     const formData = packFormData();
     try {
@@ -226,7 +224,11 @@ async function startProcessingFlow() {
             const result = await response.json();
             processId = result.process_id;
             console.log("Task started:", processId);
-            pollingInterval = setInterval(pollStatus, 1000);
+            startStatusUpdates();
+        } else if (response.status === 429) {
+            const err = await response.json();
+            alert(`服务器繁忙，当前排队 ${err.detail.queue_depth} 个任务，请稍后重试`);
+            changeStep(-1);
         } else {
             alert("提交失败，请检查控制台");
             changeStep(-1);
@@ -290,6 +292,65 @@ function packFormData() {
     return formData;
 }
 
+// === 状态更新：优先使用 SSE 增量推送，不支持时退回 1 秒轮询 ===
+function isUpdating() {
+    return pollingInterval !== null || statusSource !== null;
+}
+
+function startStatusUpdates() {
+    stopStatusUpdates();
+    if (!window.EventSource) {
+        pollingInterval = setInterval(pollStatus, 1000);
+        return;
+    }
+
+    const since = localState ? localState.version : 0;
+    statusSource = new EventSource(`/api/file/events/${processId}?since=${since}`);
+
+    // 完整快照：首次连接或版本过旧时才会收到
+    statusSource.addEventListener('snapshot', (e) => {
+        localState = JSON.parse(e.data);
+        handleState(localState);
+    });
+
+    // 增量事件：只包含变化的字段
+    statusSource.addEventListener('change', (e) => {
+        if (!localState) return;
+        applyChange(localState, JSON.parse(e.data));
+        handleState(localState);
+    });
+    // 出错时 EventSource 会带着 Last-Event-ID 自动重连，这里无需处理
+}
+
+function stopStatusUpdates() {
+    if (pollingInterval) {
+        clearInterval(pollingInterval);
+        pollingInterval = null;
+    }
+    if (statusSource) {
+        statusSource.close();
+        statusSource = null;
+    }
+}
+
+function applyChange(state, event) {
+    if (event.version <= state.version) return;
+    state.version = event.version;
+
+    if (event.type === 'state_updated') {
+        Object.assign(state, event.data);
+    } else if (event.type === 'sub_task_added') {
+        if (!state.sub_tasks.find(t => t.step_id === event.step_id)) {
+            state.sub_tasks.push(event.data);
+        }
+    } else if (event.type === 'sub_task_updated') {
+        const task = state.sub_tasks.find(t => t.step_id === event.step_id);
+        if (task) Object.assign(task, event.data);
+    } else if (event.type === 'sub_task_removed') {
+        state.sub_tasks = state.sub_tasks.filter(t => t.step_id !== event.step_id);
+    }
+}
+
 // 轮询函数
 async function pollStatus() {
     if (!processId) return;
@@ -297,48 +358,85 @@ async function pollStatus() {
         const res = await fetch(`/api/file/status/${processId}`);
         if (!res.ok) return;
 
-        const state = await res.json();
+        localState = await res.json();
+        handleState(localState);
+    } catch (e) {
+        console.error("Polling error", e);
+    }
+}
 
-        // === 逻辑 A: Step 3 (解析阶段) ===
-        if (currentStep === 3) {
-            renderTasks(state.sub_tasks);
-            if (state.is_finished) {
-                finishProcessing();
-                // 停止轮询，并显式设为 null
-                clearInterval(pollingInterval);
-                pollingInterval = null;
-            }
+function handleState(state) {
+    // === 逻辑 A: Step 3 (解析阶段) ===
+    if (currentStep === 3) {
+        renderTasks(state.sub_tasks);
+        if (state.is_finished) {
+            finishProcessing();
+            // 停止轮询
+            stopStatusUpdates();
         }
+    }
 
-        // === 逻辑 B: Step 4 (生成阶段) ===
-        if (currentStep === 4) {
-            // 优先检查是否有结果
-            if (state.final_json) {
-                renderFinalResult(JSON.parse(state.final_json));
-                clearInterval(pollingInterval);
-                pollingInterval = null;
-            }
-            // 兜底：如果后端说 finished 了但没 json，可能是出错了
-            else if (state.is_finished) {
-                // 检查是否有失败的任务
-                const failedTask = state.sub_tasks.find(t => t.type === 'card_generation' && t.status === 'failed');
-                if (failedTask) {
-                    document.getElementById('step-4').innerHTML = `
-                        <div class="error-card">
-                            <i class="fa-solid fa-triangle-exclamation"></i>
-                            <h3>生成失败</h3>
-                            <p>${failedTask.result_summary || "未知错误"}</p>
-                        </div>`;
-                }
-                clearInterval(pollingInterval);
-                pollingInterval = null;
+    // === 逻辑 B: Step 4 (生成阶段) ===
+    if (currentStep === 4) {
+        // 流式生成时先展示已经完成的字段
+        const genTask = state.sub_tasks.find(t => t.step_id === 'step_final_gen');
+        if (!state.final_json && genTask && genTask.status === 'processing' && genTask.detail) {
+            renderPartialCard(genTask.detail);
+        }
+
+        // 优先检查是否有结果
+        if (state.final_json) {
+            renderFinalResult(JSON.parse(state.final_json));
+            stopStatusUpdates();
+        }
+        // 兜底：如果后端说 finished 了但没 json，可能是出错了
+        else if (state.is_finished) {
+            // 检查是否有失败的任务
+            const failedTask = state.sub_tasks.find(t => t.type === 'card_generation' && t.status === 'failed');
+            if (failedTask) {
+                document.getElementById('step-4').innerHTML = `
+                    <div class="error-card">
+                        <i class="fa-solid fa-triangle-exclamation"></i>
+                        <h3>生成失败</h3>
+                        <p>${failedTask.result_summary || "未知错误"}</p>
+                    </div>`;
             }
+            stopStatusUpdates();
         }
+    }
+}
+const PARTIAL_FIELDS = { name: "角色名", description: "描述", first_mes: "开场白" };
 
-    } catch (e) {
-        console.error("Polling error", e);
+function renderPartialCard(detail) {
+    const step4Div = document.getElementById('step-4');
+    let box = document.getElementById('partial-card');
+    if (!box) {
+        box = document.createElement('div');
+        box.id = 'partial-card';
+        box.className = 'partial-card fade-in';
+        step4Div.appendChild(box);
+    }
+    box.innerHTML = '';
+
+    const partial = detail.partial || {};
+    Object.keys(PARTIAL_FIELDS).forEach(key => {
+        if (!partial[key]) return;
+        const label = document.createElement('h4');
+        label.textContent = PARTIAL_FIELDS[key];
+        const text = document.createElement('p');
+        text.textContent = partial[key];
+        box.appendChild(label);
+        box.appendChild(text);
+    });
+
+    if (detail.ttft_seconds !== null && detail.ttft_seconds !== undefined) {
+        const stats = document.createElement('p');
+        stats.className = 'sub-text';
+        stats.textContent = `首字延迟 ${detail.ttft_seconds}s · ${detail.tokens_per_second || '-'} tokens/s`;
+        box.appendChild(stats);
     }
 }
+
 function renderFinalResult(jsonStr) {
     // 将最终的 JSON 字符串保存在全局变量中，供下载函数使用
     window.finalJsonData = jsonStr;
@@ -361,6 +459,20 @@ function renderFinalResult(jsonStr) {
         </div>
     `;
 }
+// 生成文件名（优先用角色名）
+function cardFileName(ext) {
+    let name = window.finalJsonData.name;
+    if (!name) {
+        // 旧任务：从内嵌的 JSON 中获取角色名
+        try {
+            name = JSON.parse(window.finalJsonData.json).name;
+        } catch (e) { /* json 解析失败则使用默认文件名 */ }
+    }
+    if (!name) return `character_card.${ext}`;
+    // 简单过滤文件名中的非法字符
+    return name.replace(/[^a-z0-9_\-\.\u4e00-\u9fa5]/gi, '_') + "." + ext;
+}
+
 //在此处实现下载逻辑
 window.downloadCard = function (type) {
     if (!window.finalJsonData) {
@@ -371,26 +483,17 @@ window.downloadCard = function (type) {
     if (type === 'json') {
         // 下载 JSON 文件
         try {
-            const blob = new Blob([window.finalJsonData.json], { type: "application/json" });
-            const url = URL.createObjectURL(blob);
+            const jsonUrl = window.finalJsonData.json_url;
+            // 旧任务：JSON 内嵌在结果中
+            const url = jsonUrl || URL.createObjectURL(new Blob([window.finalJsonData.json], { type: "application/json" }));
             const a = document.createElement('a');
             a.href = url;
 
-            // 尝试从 JSON 中获取角色名作为文件名
-            let fileName = "character_card.json";
-            try {
-                const jsonObj = JSON.parse(window.finalJsonData.json);
-                if (jsonObj.name) {
-                    // 简单过滤文件名中的非法字符
-                    fileName = jsonObj.name.replace(/[^a-z0-9_\-\.\u4e00-\u9fa5]/gi, '_') + ".json";
-                }
-            } catch (e) { /* json 解析失败则使用默认文件名 */ }
-
-            a.download = fileName;
+            a.download = cardFileName("json");
             document.body.appendChild(a); // FireFox 需要添加到 DOM 才能点击
             a.click();
             document.body.removeChild(a);
-            URL.revokeObjectURL(url);
+            if (!jsonUrl) URL.revokeObjectURL(url);
         } catch (e) {
             console.error("Download failed:", e);
             alert("下载 JSON 失败");
@@ -398,43 +501,36 @@ window.downloadCard = function (type) {
 
     } else if (type === 'png') {
         try {
-            if (!window.finalJsonData.image) {
+            const imageUrl = window.finalJsonData.image_url;
+            if (!imageUrl && !window.finalJsonData.image) {
                 alert("未找到图片数据");
                 return;
             }
 
-            // Base64 转 Blob
-            const base64 = window.finalJsonData.image;
-            const binary = atob(base64);
-            const len = binary.length;
-            const bytes = new Uint8Array(len);
+            let url = imageUrl;
+            if (!imageUrl) {
+                // 旧任务：图片以 Base64 内嵌在结果中，转 Blob
+                const base64 = window.finalJsonData.image;
+                const binary = atob(base64);
+                const len = binary.length;
+                const bytes = new Uint8Array(len);
 
-            for (let i = 0; i < len; i++) {
-                bytes[i] = binary.charCodeAt(i);
-            }
-
-            const blob = new Blob([bytes], { type: "image/png" });
-            const url = URL.createObjectURL(blob);
-
-            // 生成文件名（优先用角色名）
-            let fileName = "character_card.png";
-            try {
-                const jsonObj = JSON.parse(window.finalJsonData.json);
-                if (jsonObj.name) {
-                    fileName =
-                        jsonObj.name.replace(/[^a-z0-9_\-\.\u4e00-\u9fa5]/gi, "_")
-                        + ".png";
+                for (let i = 0; i < len; i++) {
+                    bytes[i] = binary.charCodeAt(i);
                 }
-            } catch (e) { }
+
+                const blob = new Blob([bytes], { type: "image/png" });
+                url = URL.createObjectURL(blob);
+            }
 
             const a = document.createElement("a");
             a.href = url;
-            a.download = fileName;
+            a.download = cardFileName("png");
             document.body.appendChild(a);
             a.click();
 
             document.body.removeChild(a);
-            URL.revokeObjectURL(url);
+            if (!imageUrl) URL.revokeObjectURL(url);
 
         } catch (e) {
             console.error("PNG 下载失败:", e);
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 与 backend/main.py 一致：以 backend/ 为导入根目录
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
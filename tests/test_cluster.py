@@ -0,0 +1,139 @@
+import time
+import pytest
+from models import ProcessState
+from services.cluster import MemoryClusterBackend, SQLiteClusterBackend, WorkCoordinator
+from services.state_store import SharedStateStore
+
+LEASE = 0.2
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryClusterBackend()
+    return SQLiteClusterBackend(str(tmp_path / "state.db"))
+
+
+def make_worker(backend, name):
+    """
+    一个 worker：独立的本地缓存 + 协调器，dispatch 只记录收到的任务
+    """
+    dispatched = []
+
+    def dispatch(job):
+        dispatched.append(job)
+        return 1
+
+    # 后台写回线程间隔放大，测试中只通过 flush() / release() 显式写回
+    store = SharedStateStore(backend, flush_interval=3600)
+    worker = WorkCoordinator(backend, store, dispatch, worker_id=name, lease_seconds=LEASE,
+                             heartbeat_interval=0, release_delay=3600)
+    return worker, dispatched
+
+
+def submit_new(worker, process_id):
+    worker.store.put(ProcessState(process_id=process_id))
+    return worker.submit(process_id, "process")
+
+
+def test_submit_runs_locally_and_holds_lease(backend):
+    a, a_jobs = make_worker(backend, "a")
+    b, _ = make_worker(backend, "b")
+    submit_new(a, "p1")
+
+    assert [(j["process_id"], j["kind"]) for j in a_jobs] == [("p1", "resume")]
+    assert a.store.owns("p1")
+    assert not backend.acquire_lease("p1", "b", LEASE)
+    # 持有者之外的 worker 只能读到快照，不能认领
+    assert b.store.get("p1").process_id == "p1"
+    assert not b.store.owns("p1")
+
+
+def test_expired_lease_is_taken_over(backend):
+    a, _ = make_worker(backend, "a")
+    b, b_jobs = make_worker(backend, "b")
+    submit_new(a, "p1")
+
+    # 持有者宕机：不再续约，租约过期后由其他 worker 重新入队并接手
+    time.sleep(LEASE * 1.5)
+    b.tick()
+
+    assert [(j["process_id"], j["kind"]) for j in b_jobs] == [("p1", "resume")]
+    assert b.store.owns("p1")
+    assert b.claimed == 1
+    assert backend.queue_depth() == 0
+
+
+def test_stale_owner_write_is_fenced(backend):
+    a, _ = make_worker(backend, "a")
+    b, _ = make_worker(backend, "b")
+    submit_new(a, "p1")
+    stale = a.store.get("p1")
+
+    time.sleep(LEASE * 1.5)
+    b.tick()
+    fresh = b.store.get("p1")
+    fresh.final_json = "from b"
+    b.store.mark_dirty(fresh)
+    b.store.flush()
+
+    # 原持有者恢复：续约失败后被 fence，之后的修改不会覆盖新持有者的进度
+    a.tick()
+    assert a.lost_leases == 1
+    assert not a.store.owns("p1")
+    stale.final_json = "from a"
+    stale.is_finished = True
+    a.store.mark_dirty(stale)
+    a.store.flush()
+
+    saved = ProcessState.model_validate_json(backend.load_state("p1"))
+    assert saved.final_json == "from b"
+    assert not saved.is_finished
+
+
+def test_orphans_are_requeued_once(backend):
+    now = time.time()
+    old = now - 60
+    rows = [
+        ProcessState(process_id="orphan"),
+        ProcessState(process_id="done", is_finished=True),
+        ProcessState(process_id="leased"),
+    ]
+    backend.save_states([(s.process_id, s.is_finished, not s.is_finished, old, s.model_dump_json()) for s in rows])
+    assert backend.acquire_lease("leased", "a", 60)
+
+    assert backend.enqueue_orphans(now - LEASE) == ["orphan"]
+    assert backend.queue_depth() == 1
+    # 已在队列中的任务不会重复入队
+    assert backend.enqueue_orphans(now - LEASE) == []
+
+    job = backend.claim_job("b", LEASE)
+    assert (job["process_id"], job["kind"]) == ("orphan", "resume")
+    assert backend.claim_job("b", LEASE) is None
+
+
+def test_queued_job_waits_for_lease(backend):
+    a, _ = make_worker(backend, "a")
+    submit_new(a, "p1")
+    # 共享队列中属于已持有任务的 job：持有者之外的 worker 不能认领
+    backend.enqueue({"process_id": "p1", "kind": "retry", "args": {}, "enqueued_at": time.time()})
+    assert backend.claim_job("b", LEASE) is None
+    job = backend.claim_job("a", LEASE)
+    assert job["process_id"] == "p1"
+
+
+def test_shutdown_hands_off_to_next_worker(backend):
+    a, _ = make_worker(backend, "a")
+    b, b_jobs = make_worker(backend, "b")
+    submit_new(a, "p1")
+    state = a.store.get("p1")
+    state.final_json = "partial"
+    a.store.mark_dirty(state)
+
+    # 正常退出：写回最后的修改并释放租约，不必等待过期
+    a.shutdown()
+    assert not a.store.owns("p1")
+
+    assert b.submit("p1", "resume") == 1
+    assert [(j["process_id"], j["kind"]) for j in b_jobs] == [("p1", "resume")]
+    assert b.store.get("p1").final_json == "partial"
@@ -0,0 +1,24 @@
+from utils.context import pack_materials
+
+
+def _material(content, score=1):
+    return {"source_type": "file", "content": content, "reliability_score": score}
+
+
+def test_materials_within_budget_are_unchanged():
+    materials = [_material("第一段\n\n\n\n  第二段  "), _material("第一段", 3)]
+    packed, stats = pack_materials(materials, 1000)
+    assert packed == materials
+    assert not stats["packed"]
+    assert stats["duplicate_passages"] == 0
+
+
+def test_materials_over_budget_are_deduplicated_and_trimmed():
+    passage = "这是一段很长的资料内容。" * 20
+    materials = [_material(passage, 1), _material(passage + "\n\n" + "另一段内容。" * 40, 3)]
+    packed, stats = pack_materials(materials, 300, chunk_tokens=200)
+    assert stats["packed"]
+    assert stats["duplicate_passages"] > 0
+    assert stats["packed_tokens"] <= 300 + 20
+    # 重复段落只保留可信度高的那一份
+    assert [m["reliability_score"] for m in packed] == [3]
@@ -0,0 +1,100 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.deep_research import ResearchPoller
+from services.http_client import HttpClient
+
+
+class _InteractionsStub(BaseHTTPRequestHandler):
+    """
+    GET /v1beta/interactions/{id}：按 id 预设的响应序列依次返回，序列用完后重复最后一个
+    响应为 (HTTP 状态码, JSON 对象或原始字符串)
+    """
+    scripts = {}
+    polls = {}
+
+    def do_GET(self):
+        interaction_id = self.path.rsplit("/", 1)[-1]
+        assert self.path.startswith("/v1beta/interactions/")
+        assert self.headers.get("x-goog-api-key") == "test-key"
+        n = self.polls.get(interaction_id, 0)
+        self.polls[interaction_id] = n + 1
+        script = self.scripts[interaction_id]
+        code, body = script[min(n, len(script) - 1)]
+        raw = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _InteractionsStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/v1beta/interactions"
+    server.shutdown()
+
+
+@pytest.fixture
+def poller():
+    return ResearchPoller(http_client=HttpClient({"retries": 0}), poll_workers=2,
+                          min_interval=0.01, max_interval=0.05, max_consecutive_errors=3)
+
+
+def _watch(poller, stub, interaction_id, script, timeout=5):
+    _InteractionsStub.scripts[interaction_id] = script
+    future = poller.watch(interaction_id, f"{stub}/{interaction_id}", {"x-goog-api-key": "test-key"}, timeout)
+    return future.result(timeout=10)
+
+
+def test_completed_interaction_returns_last_output(poller, stub):
+    result = _watch(poller, stub, "ok", [
+        (200, {"id": "ok", "status": "in_progress"}),
+        (200, {"id": "ok", "status": "in_progress"}),
+        (200, {"id": "ok", "status": "completed", "outputs": [{"text": "draft"}, {"text": "report"}]}),
+    ])
+    assert result == {"status": "success", "content": "report"}
+    assert _InteractionsStub.polls["ok"] == 3
+    assert poller.active_count() == 0
+
+
+def test_failed_interaction(poller, stub):
+    result = _watch(poller, stub, "failed", [(200, {"status": "failed", "error": "quota"})])
+    assert result["status"] == "error" and "quota" in result["message"]
+
+
+def test_http_errors_and_bad_json_are_retried(poller, stub):
+    result = _watch(poller, stub, "flaky", [
+        (503, {"error": "unavailable"}),
+        (200, "not json"),
+        (200, {"status": "completed", "outputs": [{"text": "done"}]}),
+    ])
+    assert result == {"status": "success", "content": "done"}
+
+
+def test_completed_without_output(poller, stub):
+    result = _watch(poller, stub, "empty", [(200, {"status": "completed", "outputs": []})])
+    assert result["status"] == "error"
+
+
+def test_malformed_payload_resolves_future(poller, stub):
+    result = _watch(poller, stub, "malformed", [(200, ["not", "an", "object"])])
+    assert result["status"] == "error"
+    assert poller.active_count() == 0
+
+
+def test_deadline(poller, stub):
+    result = _watch(poller, stub, "slow", [(200, {"status": "in_progress"})], timeout=0.2)
+    assert result == {"status": "error", "message": "Timeout: Research took too long."}
+
+
+def test_unreachable_host_gives_up_after_consecutive_errors(poller):
+    future = poller.watch("down", "http://127.0.0.1:9/v1beta/interactions/down", {}, 10)
+    result = future.result(timeout=10)
+    assert result["status"] == "error" and "Network unstable" in result["message"]
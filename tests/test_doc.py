@@ -0,0 +1,167 @@
+import zipfile
+import fitz
+import pytest
+from docx import Document
+from utils.doc import (detect_encoding, iter_text_file, load_document, load_document_isolated, load_epub,
+                       load_text_file, sniff_format)
+from utils.sandbox import run_isolated
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / "book.pdf"
+    doc = fitz.open()
+    for i in range(40):
+        doc.new_page().insert_text((72, 72), f"page {i} has a text layer")
+    doc.save(str(path))
+    return str(path)
+
+
+def test_sandboxed_pdf_pages_parallel_match_sequential(pdf_path):
+    sequential = load_document(pdf_path, {"pdf_workers": 1})
+    # 10 个批次，超过直接处理的阈值，子进程中会开进程池
+    parallel = run_isolated(load_document_isolated, pdf_path, {"pdf_workers": 2, "pdf_batch_pages": 4})
+    assert parallel == sequential
+    assert "page 0" in parallel and "page 39" in parallel
+
+
+def test_pdf_max_pages(pdf_path):
+    text = load_document(pdf_path, {"pdf_workers": 1, "max_pages": 3})
+    assert "page 2" in text and "page 3" not in text
+
+
+# --- 格式识别 ---
+
+def _zip(path, files: dict):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def _epub(path, opf: bool = True):
+    chapter = '<html><head><title>t</title><style>p {{}}</style></head><body><p>{}</p><script>x()</script></body></html>'
+    files = {
+        "mimetype": "application/epub+zip",
+        "OEBPS/a.xhtml": chapter.format("第一章"),
+        "OEBPS/b.xhtml": chapter.format("第二章"),
+    }
+    if opf:
+        files["META-INF/container.xml"] = (
+            '<container xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+            '<rootfile full-path="OEBPS/content.opf"/></rootfiles></container>')
+        # spine 顺序与文件名顺序相反
+        files["OEBPS/content.opf"] = (
+            '<package xmlns="http://www.idpf.org/2007/opf">'
+            '<manifest><item id="a" href="a.xhtml"/><item id="b" href="b.xhtml"/></manifest>'
+            '<spine><itemref idref="b"/><itemref idref="a"/></spine></package>')
+    return _zip(path, files)
+
+
+def _odt(path):
+    ns = 'xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" ' \
+         'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+    content = (f'<office:document-content {ns}><office:body><office:text>'
+               '<text:h>标题</text:h><text:p>正文 <text:span>一段</text:span></text:p><text:p/>'
+               '</office:text></office:body></office:document-content>')
+    return _zip(path, {"mimetype": "application/vnd.oasis.opendocument.text", "content.xml": content})
+
+
+def test_sniff_format_trusts_magic_bytes_over_extension(tmp_path):
+    pdf = fitz.open()
+    pdf.new_page()
+    pdf.save(str(tmp_path / "report.txt"))
+    docx_path = tmp_path / "notes.pdf"
+    Document().save(str(docx_path))
+    (tmp_path / "quote.pdf").write_text("see the header %PDF-1.4 in the spec")
+    (tmp_path / "word.doc").write_bytes(b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\x00" * 64)
+    (tmp_path / "data.bin").write_bytes(b"\x7fELF\x00\x01")
+    (tmp_path / "utf16.txt").write_bytes("宽字符".encode("utf-16"))
+    (tmp_path / "page.txt").write_text("<!DOCTYPE html><p>hi</p>")
+    (tmp_path / "readme.md").write_text("# title")
+    openpyxl = pytest.importorskip("openpyxl")
+    workbook = openpyxl.Workbook()
+    workbook.active.append(["name", "age"])
+    workbook.active.append(["Saber", 15])
+    workbook.save(str(tmp_path / "sheet.txt"))
+
+    assert sniff_format(tmp_path / "report.txt") == "pdf"
+    assert sniff_format(docx_path) == "docx"
+    assert sniff_format(_epub(tmp_path / "book.zip")) == "epub"
+    assert sniff_format(tmp_path / "sheet.txt") == "xlsx"
+    assert "Saber | 15" in load_document(tmp_path / "sheet.txt")
+    assert sniff_format(_odt(tmp_path / "doc.docx")) == "odt"
+    assert sniff_format(_zip(tmp_path / "other.epub", {"a.txt": "x"})) == "binary"
+    assert sniff_format(tmp_path / "quote.pdf") == "text"
+    assert sniff_format(tmp_path / "word.doc") == "binary"
+    assert sniff_format(tmp_path / "data.bin") == "binary"
+    assert sniff_format(tmp_path / "utf16.txt") == "text"
+    assert sniff_format(tmp_path / "page.txt") == "html"
+    assert sniff_format(tmp_path / "readme.md") == "markdown"
+    with pytest.raises(ValueError):
+        load_document(tmp_path / "data.bin")
+
+
+# --- HTML / EPUB / ODT / Markdown ---
+
+def test_epub_follows_spine_order(tmp_path):
+    text = load_document(_epub(tmp_path / "book.epub"))
+    assert text == "第二章\n第一章"
+    assert load_document(_epub(tmp_path / "book.epub"), {"max_chars": 3}) == "第二章"
+
+
+def test_epub_without_opf_falls_back_to_file_names(tmp_path):
+    assert load_epub(_epub(tmp_path / "book.epub", opf=False)) == "第一章\n第二章"
+
+
+def test_odt(tmp_path):
+    assert load_document(_odt(tmp_path / "doc.odt")) == "标题\n正文 一段"
+
+
+def test_html_drops_scripts_and_styles(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_text("<html><head><style>body {}</style></head><body><h1>名字</h1>"
+                    "<script>alert(1)</script><p>  简介  </p></body></html>", encoding="utf-8")
+    assert load_document(path) == "名字\n简介"
+
+
+def test_markdown_is_read_verbatim(tmp_path):
+    path = tmp_path / "notes.md"
+    path.write_text("# 人物\n\n- **性格**：温柔", encoding="utf-8")
+    assert load_document(path) == "# 人物\n\n- **性格**：温柔"
+
+
+# --- 文本编码 ---
+
+SAMPLE = 64 * 1024
+
+
+def test_utf8_char_split_at_sample_boundary(tmp_path):
+    # "中" 占 3 个字节，第一个字节是样本的最后一个字节
+    text = "a" * (SAMPLE - 1) + "中文" * 100
+    path = tmp_path / "split.txt"
+    path.write_bytes(text.encode("utf-8"))
+    assert detect_encoding(path) == "utf-8"
+    # 分块边界同样切开多字节字符，增量解码器要跨块拼回
+    assert "".join(iter_text_file(path, chunk_size=SAMPLE)) == text
+    assert "".join(iter_text_file(path, chunk_size=1001)) == text
+
+
+def test_invalid_utf8_inside_sample_is_not_utf8(tmp_path):
+    path = tmp_path / "latin.txt"
+    path.write_bytes(b"caf\xe9 " * 100)
+    assert detect_encoding(path) != "utf-8"
+
+
+@pytest.mark.parametrize("encoding", ["gb18030", "utf-16", "utf-8-sig"])
+def test_multibyte_encodings_decode_across_chunks(tmp_path, encoding):
+    text = "人物设定：温柔，擅长剑术。" * 500
+    path = tmp_path / "cn.txt"
+    path.write_bytes(text.encode(encoding))
+    assert "".join(iter_text_file(path, chunk_size=333)) == text
+
+
+def test_load_text_file_stops_at_max_chars(tmp_path):
+    path = tmp_path / "long.txt"
+    path.write_text("字" * 10000, encoding="utf-8")
+    assert load_text_file(path, max_chars=10, chunk_size=64) == "字" * 10
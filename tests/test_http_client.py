@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+import requests
+from services.http_client import AsyncHttpClient, CircuitOpenError, HttpClient
+
+URL = "http://breaker.test/page"
+CONFIG = {"breaker_failures": 1, "breaker_reset_seconds": 0}
+
+
+def _half_open(client):
+    breaker = client.breakers.get("breaker.test")
+    breaker.record_failure()
+    assert breaker.state == "open"
+    return breaker
+
+
+class _RaisingSession:
+    def __init__(self, exc):
+        self.exc = exc
+
+    def request(self, *args, **kwargs):
+        raise self.exc
+
+
+def test_sync_probe_failure_reopens_circuit():
+    client = HttpClient(CONFIG)
+    breaker = _half_open(client)
+    client._session = lambda: _RaisingSession(requests.exceptions.ConnectionError("down"))
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        client.get(URL)
+    assert breaker.state == "open"
+    assert client.stats()["breaker.test"]["failures"] == 1
+
+
+def test_sync_probe_is_released_on_unexpected_error():
+    client = HttpClient(CONFIG)
+    breaker = _half_open(client)
+    client._session = lambda: _RaisingSession(RuntimeError("bug"))
+
+    with pytest.raises(RuntimeError):
+        client.get(URL)
+    # 试探请求没有结果：熔断器仍是 half-open，下一个请求可以继续试探
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+
+def test_async_probe_is_released_on_cancel():
+    client = AsyncHttpClient(CONFIG)
+    breaker = _half_open(client)
+
+    class _HangingClient:
+        async def request(self, *args, **kwargs):
+            await asyncio.sleep(3600)
+
+    async def _get_client():
+        return _HangingClient()
+
+    client._get_client = _get_client
+
+    async def main():
+        task = asyncio.create_task(client.get(URL))
+        await asyncio.sleep(0.01)
+        # 试探进行中，其他请求被拒绝
+        with pytest.raises(CircuitOpenError):
+            await client.get(URL)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == "half-open"
+    assert breaker.allow()
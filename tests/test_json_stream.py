@@ -0,0 +1,116 @@
+import json
+from types import SimpleNamespace
+import pytest
+from models import CharacterModel
+from utils.json_stream import JsonFieldStream
+
+CARD = {
+    "name": "Saber",
+    "description": "She said \"I am your servant\" \\ 誓约之剑 é 😀",
+    "tags": ["knight", {"nested": "ignored"}],
+    "age": 15,
+    "meta": {"description": "not top level", "list": [1, "2"]},
+    "first_mes": "Are you my master?",
+}
+
+
+def _feed_chunks(chunks) -> tuple:
+    parser = JsonFieldStream()
+    completed = []
+    for chunk in chunks:
+        completed.append(parser.feed(chunk))
+    return parser, completed
+
+
+def _split(text: str, size: int) -> list:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 10 ** 6])
+def test_fields_match_json_for_any_chunking(size):
+    # ensure_ascii 让中文 / emoji 变成 \uXXXX 转义（emoji 是两个代理项），小块会把转义序列切开
+    text = "```json\n" + json.dumps(CARD, ensure_ascii=True) + "\n```"
+    parser, _ = _feed_chunks(_split(text, size))
+    assert parser.fields == {"name": "Saber", "description": CARD["description"], "first_mes": CARD["first_mes"]}
+
+
+def test_escaped_quote_split_at_backslash():
+    parser, completed = _feed_chunks(['{"description": "a \\', '"quoted\\', '" b", "name": "x"}'])
+    assert completed[:2] == [{}, {}]
+    assert parser.fields["description"] == 'a "quoted" b'
+
+
+def test_each_field_is_reported_once_when_completed():
+    parser, completed = _feed_chunks(['{"first_mes": "hi', '", "num": 1, "description"', ': "d"', '}'])
+    assert completed == [{}, {"first_mes": "hi"}, {"description": "d"}, {}]
+    # 字段顺序与模板不同也照常解析
+    assert list(parser.fields) == ["first_mes", "description"]
+
+
+def test_truncated_output_keeps_completed_fields():
+    parser, _ = _feed_chunks(['{"name": "Saber", "description": "unfinished'])
+    assert parser.fields == {"name": "Saber"}
+
+
+# --- 流式失败时退回普通请求 ---
+
+def _event(text: str):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class _FakeCompletions:
+    def __init__(self, stream_chunks, stream_error=None):
+        self.stream_chunks = stream_chunks
+        self.stream_error = stream_error
+        self.calls = []
+
+    def create(self, model, messages, stream=False):
+        self.calls.append(stream)
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=json.dumps(CARD)))])
+
+        def events():
+            for chunk in self.stream_chunks:
+                yield _event(chunk)
+            if self.stream_error:
+                raise self.stream_error
+        return events()
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    from services import processing_service
+    config = {**processing_service.load_config(), "llm": {"model": "m", "stream": True, "context_budget_tokens": 0}}
+    monkeypatch.setattr(processing_service, "load_config", lambda: config)
+    monkeypatch.setattr(processing_service, "RATE_LIMITERS", {})
+
+    def install(completions):
+        monkeypatch.setattr(processing_service, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        return processing_service
+    return install
+
+
+def test_stream_failure_falls_back_to_plain_request(llm):
+    completions = _FakeCompletions(['{"name": "Saber", ', '"descr'], stream_error=ConnectionError("reset"))
+    processing_service = llm(completions)
+    partials = []
+
+    json_str, png = processing_service._mock_llm_generation(CharacterModel(character_name="Saber"), [], partials.append)
+    assert completions.calls == [True, False]
+    assert json.loads(json_str) == CARD
+    assert png.startswith(b"\x89PNG")
+    # 断流前已完成的字段照常推送过
+    assert partials and partials[-1]["partial"] == {"name": "Saber"}
+
+
+def test_stream_success_reports_partials(llm):
+    text = json.dumps(CARD, ensure_ascii=False)
+    completions = _FakeCompletions(_split(text, 5))
+    processing_service = llm(completions)
+    partials = []
+
+    json_str, _ = processing_service._mock_llm_generation(CharacterModel(character_name="Saber"), [], partials.append)
+    assert completions.calls == [True]
+    assert json.loads(json_str) == CARD
+    assert partials[-1]["partial"]["first_mes"] == CARD["first_mes"]
+    assert partials[-1]["tokens"] == len(_split(text, 5))
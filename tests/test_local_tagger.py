@@ -0,0 +1,60 @@
+import threading
+import pytest
+from PIL import Image
+from services import local_tagger
+from services.local_tagger import CATEGORY_CHARACTER, CATEGORY_GENERAL, LocalTagger
+
+np = pytest.importorskip("numpy")
+
+
+class _FakeSession:
+    def run(self, outputs, feeds):
+        batch = next(iter(feeds.values()))
+        return [np.tile(np.array([0.9, 0.5, 0.1], dtype=np.float32), (len(batch), 1))]
+
+
+def _loaded_tagger(**kwargs) -> LocalTagger:
+    # 跳过 onnxruntime 加载，直接装上假的 session 和推理线程
+    tagger = LocalTagger("model.onnx", "tags.csv", **kwargs)
+    tagger._session = _FakeSession()
+    tagger._input_name = "input"
+    tagger._input_size = 8
+    tagger._tags = [("saber", CATEGORY_CHARACTER), ("blonde_hair", CATEGORY_GENERAL), ("sky", CATEGORY_GENERAL)]
+    tagger._worker = threading.Thread(target=tagger._batch_loop, daemon=True)
+    tagger._worker.start()
+    return tagger
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    path = tmp_path / "a.png"
+    Image.new("RGBA", (12, 6), (255, 0, 0, 128)).save(path)
+    return str(path)
+
+
+def test_tag_and_close(image_path):
+    tagger = _loaded_tagger(character_threshold=0.85, general_threshold=0.35)
+    assert tagger.tag(image_path) == ["saber", "blonde_hair"]
+
+    tagger.close()
+    tagger._worker.join(5)
+    assert not tagger._worker.is_alive()
+    assert tagger._session is None
+    with pytest.raises(RuntimeError):
+        tagger.tag(image_path)
+
+
+def test_only_current_config_is_kept(monkeypatch):
+    monkeypatch.setattr(local_tagger, "_TAGGER", None)
+    monkeypatch.setattr(local_tagger, "_TAGGER_KEY", None)
+    first = local_tagger.get_local_tagger({"general_threshold": 0.3})
+    assert local_tagger.get_local_tagger({"general_threshold": 0.3}) is first
+
+    second = local_tagger.get_local_tagger({"general_threshold": 0.5})
+    assert second is not first
+    assert first._closed and not second._closed
+
+    local_tagger.release_local_tagger({"general_threshold": 0.5})
+    assert local_tagger._TAGGER is second
+    local_tagger.release_local_tagger()
+    assert local_tagger._TAGGER is None and second._closed
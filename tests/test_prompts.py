@@ -0,0 +1,56 @@
+import os
+from utils.prompts import PromptLoader, PromptTemplate
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend", "prompts")
+
+
+def test_render_substitutes_placeholders():
+    template = PromptTemplate("名字：%CHARACTER_NAME%，可信度 %RELIABILITY%，%CHARACTER_NAME%")
+    assert template.placeholders == {"CHARACTER_NAME", "RELIABILITY"}
+    assert template.render(CHARACTER_NAME="Saber", RELIABILITY=5) == "名字：Saber，可信度 5，Saber"
+
+
+def test_missing_values_and_lowercase_markers_are_kept():
+    template = PromptTemplate("%CONTENT% 100% %lower% %A_1%")
+    assert template.placeholders == {"CONTENT", "A_1"}
+    assert template.render() == "%CONTENT% 100% %lower% %A_1%"
+
+
+def test_substituted_values_are_not_expanded_again():
+    template = PromptTemplate("%CONTENT%|%RELIABILITY%")
+    assert template.render(CONTENT="%RELIABILITY%", RELIABILITY="高") == "%RELIABILITY%|高"
+
+
+def test_preload_and_reload_on_change(tmp_path):
+    (tmp_path / "a").write_text("A=%X%", encoding="utf-8")
+    (tmp_path / "b").write_text("B", encoding="utf-8")
+    (tmp_path / "subdir").mkdir()
+    loader = PromptLoader(str(tmp_path), check_interval=0)
+    loader.preload()
+    assert set(loader._templates) == {"a", "b"}
+    assert loader.render("a", X=1) == "A=1"
+
+    (tmp_path / "a").write_text("A2=%X%", encoding="utf-8")
+    os.utime(tmp_path / "a", ns=(0, 10 ** 9))
+    assert loader.render("a", X=1) == "A2=1"
+
+    # 文件临时不可用时继续用旧版本
+    os.remove(tmp_path / "a")
+    assert loader.render("a", X=1) == "A2=1"
+
+
+def test_cached_template_within_check_interval(tmp_path):
+    (tmp_path / "a").write_text("old", encoding="utf-8")
+    loader = PromptLoader(str(tmp_path), check_interval=3600)
+    assert loader.get("a").text == "old"
+    (tmp_path / "a").write_text("new", encoding="utf-8")
+    os.utime(tmp_path / "a", ns=(0, 10 ** 9))
+    assert loader.get("a").text == "old"
+
+
+def test_repo_prompts_preload():
+    loader = PromptLoader(PROMPTS_DIR)
+    loader.preload()
+    assert "reference_prompts" in loader._templates
+    rendered = loader.render("reference_prompts", RELIABILITY="高", CONTENT="资料")
+    assert "资料" in rendered and "%CONTENT%" not in rendered
@@ -0,0 +1,78 @@
+import os
+import time
+import pytest
+from models import ReferenceModel
+from services.result_cache import ResultCache, file_key, url_key
+
+
+def _age(cache, key, seconds):
+    # 访问时间记录在 mtime 上，调整 mtime 模拟更早的访问
+    path = cache._path(key)
+    t = time.time() - seconds
+    os.utime(path, (t, t))
+    cache._index[key] = (cache._index[key][0], t)
+
+
+def test_get_set_and_ttl(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    assert cache.get("a" * 64) is None
+    cache.set("a" * 64, "内容")
+    assert cache.get("a" * 64) == "内容"
+    assert cache.get("a" * 64, ttl=-1) is None
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10 ** 6)
+    keys = [c * 64 for c in "abc"]
+    for i, key in enumerate(keys):
+        cache.set(key, "x" * 100)
+        _age(cache, key, 100 - i)
+    # a 最早写入，但刚被读过，应淘汰 b
+    cache.get(keys[0])
+    # 只放得下三个条目（created_at 的长度不固定，留出半个条目的余量）
+    cache.max_bytes = cache.stats()["size_bytes"] * 7 // 6
+    cache.set("d" * 64, "x" * 100)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None and cache.get(keys[2]) is not None
+    assert cache.stats()["evictions"] == 1
+    assert not os.path.exists(cache._path(keys[1]))
+
+
+def test_index_survives_restart(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.set("a" * 64, "x")
+    reopened = ResultCache(str(tmp_path))
+    assert reopened.stats()["entries"] == 1
+    assert reopened.stats()["size_bytes"] == cache.stats()["size_bytes"]
+
+
+def test_keys_are_stable_and_content_addressed(tmp_path):
+    first, second = tmp_path / "a.txt", tmp_path / "b.txt"
+    first.write_text("same")
+    second.write_text("same")
+    assert file_key("doc_reader", str(first)) == file_key("doc_reader", str(second))
+    assert file_key("doc_reader", str(first)) != file_key("image_reader", str(first))
+    assert url_key("r", "https://example.com") == url_key("r", "https://example.com")
+    assert url_key("r", "https://example.com/1") != url_key("r", "https://example.com/2")
+
+
+def test_doc_reader_key_follows_output_options(tmp_path):
+    processing_service = pytest.importorskip("services.processing_service")
+    if processing_service.READER_CACHE is None:
+        pytest.skip("result_cache 未启用")
+    path = tmp_path / "doc.txt"
+    path.write_text("text")
+    task_def = {"type": "doc_analysis", "payload": {"ref_obj": ReferenceModel(
+        resource_type="file", reliability_score=5, resource_url=str(path))}}
+
+    def key(doc_config):
+        return processing_service._reader_cache_key(task_def, {"doc_reader": doc_config})[0]
+
+    base = {"max_chars": 1000, "max_pages": 10, "excel_max_rows": 100, "pdf_workers": 4}
+    assert key(base) == key(dict(base))
+    for option in ("max_chars", "max_pages", "excel_max_rows"):
+        assert key({**base, option: 5}) != key(base)
+    # 只影响速度的配置不改变缓存键
+    assert key({**base, "pdf_workers": 1, "sandbox": {"enabled": False}}) == key(base)
@@ -0,0 +1,31 @@
+import os
+import pytest
+from utils.sandbox import run_isolated
+
+
+def test_result_and_errors_cross_the_process_boundary():
+    assert run_isolated(eval, "__import__('os').getpid()") != os.getpid()
+    with pytest.raises(ValueError):
+        run_isolated(int, "not a number")
+
+
+def test_child_loads_only_the_target_module():
+    modules = run_isolated(eval, "[m for m in __import__('sys').modules if m.startswith(('services', 'routers', 'main'))]")
+    assert modules == []
+    assert run_isolated(eval, "__import__('threading').active_count()") == 1
+
+
+def test_timeout_kills_the_child():
+    with pytest.raises(TimeoutError):
+        run_isolated(eval, "__import__('time').sleep(30)", timeout=1)
+
+
+def test_crash_is_reported():
+    with pytest.raises(RuntimeError):
+        run_isolated(os._exit, 3)
+
+
+@pytest.mark.skipif(os.name != "posix", reason="RLIMIT_AS 仅 POSIX")
+def test_memory_limit():
+    with pytest.raises(MemoryError):
+        run_isolated(bytearray, 2 * 1024 ** 3, memory_limit_mb=256)
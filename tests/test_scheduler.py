@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import pytest
+from services.scheduler import AsyncJobRunner, JobScheduler, SchedulerFullError
+
+
+def test_job_scheduler_limit_leaves_room_for_other_jobs():
+    scheduler = JobScheduler(workers=1, max_queue=4)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    scheduler.submit("running", block)
+    assert started.wait(5)
+    # 批量任务最多占 2 个排队位置
+    scheduler.submit("batch-1", block, limit=2)
+    scheduler.submit("batch-2", block, limit=2)
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit("batch-3", block, limit=2)
+    # 其他任务仍可使用剩余的队列
+    scheduler.submit("interactive-1", block)
+    scheduler.submit("interactive-2", block)
+    with pytest.raises(SchedulerFullError):
+        scheduler.submit("interactive-3", block)
+    release.set()
+    assert scheduler.metrics()["rejected"] == 2
+
+
+def test_job_scheduler_worker_is_free_after_job_returns():
+    scheduler = JobScheduler(workers=1, max_queue=4)
+    done = threading.Event()
+    scheduler.submit("dispatch", lambda: None)
+    scheduler.submit("next", done.set)
+    assert done.wait(5)
+
+
+async def _make_event():
+    return asyncio.Event()
+
+
+def test_async_runner_limit():
+    runner = AsyncJobRunner(max_jobs=1, max_queue=4)
+    release = runner.run(_make_event()).result(5)
+    started = threading.Event()
+
+    async def block():
+        started.set()
+        await release.wait()
+
+    runner.submit("running", block)
+    assert started.wait(5)
+    runner.submit("batch-1", block, limit=1)
+    with pytest.raises(SchedulerFullError):
+        runner.submit("batch-2", block, limit=1)
+    runner.submit("interactive", block)
+    runner.loop.call_soon_threadsafe(release.set)
+    assert runner.metrics()["rejected"] == 1
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import uuid
+import pytest
+from models import ProcessState, SubTaskResult, TaskStatus
+from services.state_events import ChangeJournal
+
+
+def test_versions_are_sequential_per_process():
+    journal = ChangeJournal()
+    a, b = ProcessState(process_id="a"), ProcessState(process_id="b")
+    assert [journal.record(a, {"type": "state_updated"}) for _ in range(3)] == [1, 2, 3]
+    assert journal.record(b, {"type": "state_updated"}) == 1
+    assert a.version == 3 and journal.version("a") == 3 and journal.version("missing") == 0
+
+
+def test_since_replays_only_newer_events():
+    journal = ChangeJournal()
+    state = ProcessState(process_id="p")
+    for step in ("s1", "s2", "s3"):
+        journal.record(state, {"type": "sub_task_removed", "step_id": step})
+    assert [e["step_id"] for e in journal.since("p", 1)] == ["s2", "s3"]
+    assert journal.since("p", 3) == []
+    # 客户端版本比服务端新（服务重启过）或任务未知：改取快照
+    assert journal.since("p", 4) is None
+    assert journal.since("unknown", 0) is None
+
+
+def test_gap_falls_back_to_snapshot():
+    journal = ChangeJournal(max_events=2)
+    state = ProcessState(process_id="p")
+    for _ in range(5):
+        journal.record(state, {"type": "state_updated"})
+    assert journal.since("p", 2) is None
+    assert [e["version"] for e in journal.since("p", 3)] == [4, 5]
+
+
+def test_restored_state_skips_ahead():
+    journal = ChangeJournal(restart_gap=1000)
+    state = ProcessState(process_id="p", version=7)
+    journal.seed(state)
+    assert state.version == 1007
+    assert journal.record(state, {"type": "state_updated"}) == 1008
+    journal.drop("p")
+    assert journal.version("p") == 0
+
+
+# --- 接口：/status?since= 与 /events SSE ---
+
+@pytest.fixture
+def service(monkeypatch):
+    from services import processing_service
+    from routers import file_router
+    monkeypatch.setattr(processing_service, "JOURNAL", ChangeJournal(max_events=3))
+    monkeypatch.setattr(file_router, "SSE_POLL_INTERVAL", 0.01)
+    state = ProcessState(process_id=f"test_{uuid.uuid4().hex}")
+    processing_service.STATE_STORE.put(state)
+    yield processing_service, file_router, state
+    processing_service.STATE_STORE.delete(state.process_id)
+
+
+def _sub_task(step_id: str) -> SubTaskResult:
+    return SubTaskResult(step_id=step_id, title=step_id, type="doc_analysis", status=TaskStatus.PENDING)
+
+
+def test_status_since(service):
+    processing_service, file_router, state = service
+    processing_service._add_sub_task(state, _sub_task("step_ref_0"))
+    processing_service._update_sub_task(state, state.sub_tasks[0], status=TaskStatus.SUCCESS)
+    v1, v2 = state.version - 1, state.version
+
+    changes = file_router.check_status(state.process_id, since=v1)
+    assert changes["version"] == v2
+    assert [e["type"] for e in changes["events"]] == ["sub_task_updated"]
+    assert changes["events"][0]["data"]["status"] == TaskStatus.SUCCESS
+
+    # 变更日志只保留 3 条，更早的版本返回完整状态
+    for _ in range(3):
+        processing_service._update_state(state, final_json="{}")
+    reset = file_router.check_status(state.process_id, since=v1)
+    assert reset["reset"] is True and reset["state"] is state
+
+
+class _FakeRequest:
+    def __init__(self, headers: dict = None):
+        self.headers = headers or {}
+
+    async def is_disconnected(self):
+        return False
+
+
+def _read_sse(file_router, process_id, count, headers=None, since=0, on_first=None):
+    async def run():
+        response = await file_router.stream_status(process_id, _FakeRequest(headers), since=since)
+        messages = []
+        async for chunk in response.body_iterator:
+            fields = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+            messages.append((fields["event"], int(fields["id"]), json.loads(fields["data"])))
+            if len(messages) == 1 and on_first:
+                on_first()
+            if len(messages) == count:
+                await response.body_iterator.aclose()
+                return messages
+    return asyncio.run(asyncio.wait_for(run(), 5))
+
+
+def test_events_stream_snapshot_then_changes(service):
+    processing_service, file_router, state = service
+    processing_service._update_state(state, final_json="{}")
+
+    messages = _read_sse(file_router, state.process_id, 2,
+                         on_first=lambda: processing_service._add_sub_task(state, _sub_task("step_ref_0")))
+    (kind, version, snapshot), (change_kind, change_version, change) = messages
+    assert kind == "snapshot" and snapshot["final_json"] == "{}" and version == state.version - 1
+    assert change_kind == "change" and change_version == state.version
+    assert change["type"] == "sub_task_added" and change["step_id"] == "step_ref_0"
+
+
+def test_events_resume_from_last_event_id(service):
+    processing_service, file_router, state = service
+    processing_service._update_state(state, final_json="a")
+    resume_from = state.version
+    processing_service._update_state(state, final_json="b")
+
+    [(kind, version, event)] = _read_sse(file_router, state.process_id, 1,
+                                         headers={"last-event-id": str(resume_from)})
+    assert kind == "change" and version == state.version and event["data"] == {"final_json": "b"}
+
+    # 版本过旧时先推送一次快照
+    for _ in range(4):
+        processing_service._update_state(state, final_json="c")
+    [(kind, version, snapshot)] = _read_sse(file_router, state.process_id, 1,
+                                            headers={"last-event-id": str(resume_from)})
+    assert kind == "snapshot" and version == state.version and snapshot["final_json"] == "c"
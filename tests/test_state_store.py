@@ -0,0 +1,25 @@
+import time
+from models import ProcessState
+from services.state_store import SQLiteStateStore
+
+
+def test_sqlite_evicts_disk_only_rows_with_callback(tmp_path):
+    path = str(tmp_path / "state.db")
+    old = SQLiteStateStore(path, ttl_seconds=60, flush_interval=3600)
+    for pid, finished in (("done", True), ("running", False), ("cached", True)):
+        old.put(ProcessState(process_id=pid, is_finished=finished))
+    for pid in old._touched:
+        old._touched[pid] = time.time() - 120
+    old.flush()
+
+    # 重启后：done 只在库中，cached 被重新读入热缓存并刚被访问
+    store = SQLiteStateStore(path, ttl_seconds=60, flush_interval=3600)
+    assert store.get("cached") is not None
+    evicted = []
+    store.on_evict = evicted.append
+
+    assert store.evict_expired() == ["done"]
+    assert evicted == ["done"]
+    assert store.get("done") is None
+    assert store.get("running") is not None
+    assert store.get("cached") is not None